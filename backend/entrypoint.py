@@ -1,10 +1,16 @@
 # Import modules required for startup initialisation
+import os
+
 import src.factory.dramatiq_broker
 import src.periodic
 import uvicorn
-from src.factory import app, create_db_and_tables
+from src.factory import app, config, create_db_and_tables
+from src.factory.database import engine
+from src.utils.events import event_bus
 from src.controller import router
 from fastapi.middleware.cors import CORSMiddleware
+from src.utils.compression import SelectiveGZipMiddleware
+from src.utils.upload_limit import RequestSizeLimitMiddleware
 
 origins = [
     "http://localhost",
@@ -18,6 +24,9 @@ origins = [
     "https://nginx",      # if nginx hostname is ever used
 ]
 
+# Oversized uploads are turned away before their body is parsed into temporary files. Added first so that the CORS
+# middleware wrapping it still adds its headers to the rejection.
+app.add_middleware(RequestSizeLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -25,8 +34,21 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Log pages and listings compress well. Server-Sent Event streams, log archives and file downloads are not compressed.
+app.add_middleware(SelectiveGZipMiddleware, minimum_size=1024)
+# Included on import, worker processes import this module to load the app.
+app.include_router(router)
+# Consume events from the start, so that cache invalidations published by other processes are applied.
+app.add_event_handler("startup", event_bus.start_consumer)
 
 if __name__ == '__main__':
     create_db_and_tables()
-    app.include_router(router)
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
\ No newline at end of file
+    workers = config.API_WORKERS or os.cpu_count() or 1
+    if workers > 1:
+        # Connections of the migration are not handed down to the worker processes.
+        engine.dispose()
+        uvicorn.run("entrypoint:app", host="0.0.0.0", port=8000, log_level="info", workers=workers,
+                    timeout_graceful_shutdown=config.API_GRACEFUL_SHUTDOWN_SECONDS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info",
+                    timeout_graceful_shutdown=config.API_GRACEFUL_SHUTDOWN_SECONDS)
\ No newline at end of file
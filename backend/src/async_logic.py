@@ -0,0 +1,121 @@
+"""
+Asynchronous versions of the read endpoints of `src.logic` that clients poll. With DATABASE_ASYNC enabled their queries
+run on the asyncio engine and files are read without blocking the event loop, so a poller does not hold a threadpool
+thread for the duration of its request. Otherwise they run the synchronous version in the threadpool, as FastAPI does
+for synchronous handlers.
+"""
+import logging
+from typing import Optional
+
+import anyio
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+
+import src.logic as logic
+from src.db_models import DockerJobs, DockerJobsArchive, DockerScripts
+from src.factory.database import async_engine
+from src.utils.pagination import CountMode, InvalidCursor, split_page
+
+
+async def get_images(page: int = 0, limit: int = 100, _id: Optional[str] = None, name: Optional[str] = None,
+                     status: Optional[int] = None, cursor: Optional[str] = None, count: CountMode = "exact") -> dict | Response:
+    if async_engine is None:
+        return await run_in_threadpool(logic.get_images, page, limit, _id, name, status, cursor, count)
+    try:
+        statement, total_query = logic.images_query(limit, _id, name, status, cursor, page)
+    except InvalidCursor as e:
+        return Response(status_code=400, content=str(e))
+
+    async with AsyncSession(async_engine) as session:
+        total = await logic.count_cache.count_async(session, total_query, count, ("images", _id, name, status))
+        res, next_cursor = split_page((await session.exec(statement)).all(), limit, key=lambda i: (i.created_at, i.id))
+    return logic.images_page(res, page, limit, total, count, next_cursor)
+
+
+async def get_scripts(page: int = 0, limit: int = 100, _id: Optional[str] = None, name: Optional[str] = None,
+                      image: Optional[str] = None, is_deleted: Optional[bool] = False, cursor: Optional[str] = None,
+                      count: CountMode = "exact") -> dict | Response:
+    if async_engine is None:
+        return await run_in_threadpool(logic.get_scripts, page=page, limit=limit, _id=_id, name=name, image=image,
+                                       is_deleted=is_deleted, cursor=cursor, count=count)
+    if _id is not None:
+        async with AsyncSession(async_engine) as session:
+            return logic.script_details((await session.exec(logic.script_query(_id))).first())
+
+    try:
+        query, total_query = logic.scripts_query(limit, name, image, is_deleted, cursor, page)
+    except InvalidCursor as e:
+        return Response(status_code=400, content=str(e))
+
+    async with AsyncSession(async_engine) as session:
+        results, next_cursor = split_page((await session.exec(query)).all(), limit, key=lambda r: (r[0].created_at, r[0].id))
+        total = await logic.count_cache.count_async(session, total_query, count, ("scripts", name, image, is_deleted))
+    return logic.scripts_page(results, page, limit, total, next_cursor)
+
+
+async def get_schedule(page: int = 0, limit: int = 100, _id: Optional[int] = None, script_id: Optional[str] = None,
+                       cursor: Optional[str] = None, count: CountMode = "exact") -> dict | Response:
+    if async_engine is None or _id is not None:
+        return await run_in_threadpool(logic.get_schedule, page, limit, _id, script_id, cursor, count)
+    try:
+        query, total_query = logic.schedules_query(limit, script_id, cursor, page)
+    except InvalidCursor as e:
+        return Response(status_code=400, content=str(e))
+
+    async with AsyncSession(async_engine) as session:
+        results, next_cursor = split_page((await session.exec(query)).all(), limit, key=lambda i: (i.created_at, i.id))
+        total = await logic.count_cache.count_async(session, total_query, count, ("schedules", script_id))
+    return logic.schedules_page(results, page, limit, total, next_cursor)
+
+
+async def get_script_jobs(script_id: str, page: int = 0, limit: int = 100, status: Optional[int] = None,
+                          cursor: Optional[str] = None, count: CountMode = "exact", archived: bool = False) -> Response:
+    if async_engine is None:
+        return await run_in_threadpool(logic.get_script_jobs, script_id, page, limit, status, cursor, count, archived)
+    try:
+        query = (DockerJobsArchive if archived else DockerJobs).script_jobs_query(script_id, page, limit, status, cursor)
+    except InvalidCursor as e:
+        return Response(status_code=400, content=str(e))
+
+    async with AsyncSession(async_engine) as session:
+        jobs, next_cursor = split_page((await session.exec(query)).all(), limit, key=lambda job: (job.created_at, job.id))
+        total = await logic.count_cache.count_async(session, logic.script_jobs_count_query(script_id, status, archived), count,
+                                                     ("jobs", script_id, status, archived))
+    return logic.script_jobs_response(jobs, page, limit, total, next_cursor)
+
+
+async def get_script_code(script_id: str) -> Response:
+    if async_engine is None:
+        return await run_in_threadpool(logic.get_script_code, script_id)
+    async with AsyncSession(async_engine) as session:
+        script_object: Optional[DockerScripts] = (await session.exec(select(DockerScripts).where(
+            DockerScripts.id == script_id, DockerScripts.deleted == False))).first()
+    if script_object is None:
+        return Response(status_code=404, content="Script not found")
+
+    script_path = anyio.Path(logic.get_script_code_path(script_object.id))
+    try:
+        code = await script_path.read_bytes()
+    except FileNotFoundError:
+        return Response(status_code=404, content="Script not found")
+    return Response(content=code, media_type="text")
+
+
+async def get_job_logs(job_id: int, last_position: int = 0, tail: Optional[int] = None, before: Optional[int] = None,
+                       max_bytes: Optional[int] = None, max_lines: Optional[int] = None, line: Optional[int] = None,
+                       since: Optional[float] = None, until: Optional[float] = None, stream: Optional[str] = None) -> Response:
+    if async_engine is None:
+        return await run_in_threadpool(logic.get_job_logs, job_id, last_position, tail, before, max_bytes, max_lines, line,
+                                       since, until, stream)
+    async with AsyncSession(async_engine) as session:
+        job_object: Optional[DockerJobs | DockerJobsArchive] = (await session.exec(select(DockerJobs).where(DockerJobs.id == job_id))).first()
+        if job_object is None:
+            job_object = (await session.exec(select(DockerJobsArchive).where(DockerJobsArchive.id == job_id))).first()
+    if job_object is None:
+        logic.log_event(logging.WARNING, message="Job with ID: '{}' doesn't exist".format(job_id), resource_id=job_id)
+        return Response(status_code=404, content="Job doesn't exist.")
+    # Log pages are read from (possibly compressed) segment files, which are read in a worker thread.
+    return await run_in_threadpool(logic.job_logs_response, job_object, last_position, tail, before, max_bytes, max_lines,
+                                   line, since, until, stream)
@@ -4,13 +4,18 @@ from typing import List, Optional, Annotated
 
 from fastapi.params import Query
 from sqlalchemy.exc import NoResultFound
+from starlette.requests import Request
 from starlette.responses import Response
 
+import src.async_logic as async_logic
 import src.logic as logic
 from fastapi import APIRouter, Form, File, UploadFile
 
 from src.enums import AvailableScriptLanguages
+from src.periodic import garbage_collection_job
 from src.schemas import ScriptUpdate, ScheduleCreate, ScheduleUpdate, UpdateImageForm
+from src.utils.pagination import CountMode
+from src.utils.response_cache import response_cache, script_code, IMAGES, SCRIPTS, LANGUAGES
 
 router = APIRouter()
 # Made change to force no cache
@@ -18,30 +23,46 @@ router = APIRouter()
 # ---------- Endpoints: General ----------
 
 @router.get("/api/general/languages")
-def get_available_languages():
-    available = AvailableScriptLanguages.get_values()
-    return Response(status_code=200, content=json.dumps({"supported_languages": [i.model_dump(include={"name", "extension"}) for i in available]}), media_type="application/json")
+async def get_available_languages(request: Request):
+    def languages():
+        available = AvailableScriptLanguages.get_values()
+        return Response(status_code=200, content=json.dumps({"supported_languages": [i.model_dump(include={"name", "extension"}) for i in available]}), media_type="application/json")
+    return await response_cache.respond(request, LANGUAGES, languages)
+
+@router.get("/api/general/gc")
+def get_garbage_collection_report():
+    return logic.get_garbage_collection_report()
+
+@router.post("/api/general/gc")
+def run_garbage_collection():
+    garbage_collection_job.send()
+    return Response(status_code=202, content="Garbage collection started")
 
 # ---------- Endpoints: Images ----------
 
 @router.get("/api/image")
-def get_images(
+async def get_images(
+        request: Request,
         page: int = 0,
         limit: int = 100,
         _id: Optional[str] = None,
         name: Optional[str] = None,
-        status: Optional[int] = None
+        status: Optional[int] = None,
+        cursor: Optional[str] = None,
+        count: CountMode = "exact"
 ):
-    return logic.get_images(page, limit, _id, name, status)
+    return await response_cache.respond(request, IMAGES, lambda: async_logic.get_images(page, limit, _id, name, status, cursor, count))
 
 
 @router.get("/api/image/{image_id}")
-def get_image(image_id: str):
-    image_dict = logic.get_images(page=0, limit=1, _id=image_id)
-    if len(image_dict.get('images')) == 1:
-        return {"image": image_dict.get('images')[0]}
-    else:
-        return Response(status_code=404)
+async def get_image(image_id: str, request: Request):
+    async def image():
+        image_dict = await async_logic.get_images(page=0, limit=1, _id=image_id, count="none")
+        if len(image_dict.get('images')) == 1:
+            return {"image": image_dict.get('images')[0]}
+        else:
+            return Response(status_code=404)
+    return await response_cache.respond(request, IMAGES, image)
 
 @router.get("/api/image/{image_id}/Dockerfile")
 def get_image_dockerfile(image_id: str):
@@ -76,25 +97,49 @@ def destroy_image(image_id: str):
 @router.post("/api/image/{image_id}/build")
 def build_image(image_id: str):
     try:
-        logic.build_image_before(image_id)
+        version = logic.build_image_before(image_id)
     except NoResultFound:
         return Response(status_code=404)
     except logic.InvalidImageStatus as e:
         return Response(status_code=422, content=str(e))
-    logic.build_image.send(image_id)
-    return Response(status_code=200, content="Build started for image ID: {}".format(image_id))
+    logic.build_image.send(image_id, version)
+    return Response(status_code=200, content="Build of version {} started for image ID: {}".format(version, image_id))
+
+@router.get("/api/image/{image_id}/versions")
+def get_image_versions(image_id: str):
+    return logic.get_image_versions(image_id)
+
+# Switch the image to the given built version
+@router.post("/api/image/{image_id}/versions/{version}/activate")
+def activate_image_version(image_id: str, version: int):
+    return logic.activate_image_version(image_id, version)
+
+# Switch the image back to its previous built version
+@router.post("/api/image/{image_id}/rollback")
+def rollback_image(image_id: str):
+    return logic.activate_image_version(image_id)
 
 @router.get("/api/image/{image_id}/logs")
-async def get_image_build_logs(image_id: str):
-    return logic.get_image_build_logs(image_id)
+def get_image_build_logs(image_id: str, last_position: int = 0, tail: Optional[int] = Query(None, ge=0), before: Optional[int] = None,
+                         max_bytes: Optional[int] = Query(None, gt=0), max_lines: Optional[int] = Query(None, gt=0),
+                         line: Optional[int] = Query(None, ge=0)):
+    return logic.get_image_build_logs(image_id, last_position, tail, before, max_bytes, max_lines, line)
+
+@router.get("/api/image/{image_id}/logs/stream")
+def stream_image_build_logs(image_id: str, request: Request, last_position: int = 0):
+    return logic.stream_image_build_logs(image_id, request, last_position)
+
+@router.get("/api/image/{image_id}/build/steps")
+def get_image_build_steps(image_id: str):
+    return logic.get_image_build_steps(image_id)
 
 @router.get("/api/image/{image_id}/files")
 def get_image_files(image_id: str):
     return logic.get_image_files(image_id)
 
 @router.get("/api/image/{image_id}/files/download")
-def download_image_files(image_id: str, file_id: typing.Annotated[typing.Optional[typing.List[int]], Query()] = None):
-    return logic.download_image_file(image_id, file_id)
+def download_image_files(image_id: str, file_id: typing.Annotated[typing.Optional[typing.List[int]], Query()] = None, store_compressed: bool = True):
+    return logic.download_image_file(image_id, file_id, store_compressed)
 
 
 # ---------- Endpoints: Scripts ----------
@@ -102,14 +147,18 @@ def download_image_files(image_id: str, file_id: typing.Annotated[typing.Optiona
 
 # Get Scripts
 @router.get("/api/script")
-def get_script(
+async def get_script(
+        request: Request,
         page: int = 0,
         limit: int = 100,
         _id: Optional[str] = None,
         name: Optional[str] = None,
         image: Optional[str] = None,
-        is_deleted: Optional[bool] = None):
-    return logic.get_scripts(page=page, limit=limit, _id=_id, name=name, image=image, is_deleted=is_deleted)
+        is_deleted: Optional[bool] = None,
+        cursor: Optional[str] = None,
+        count: CountMode = "exact"):
+    return await response_cache.respond(request, SCRIPTS, lambda: async_logic.get_scripts(
+        page=page, limit=limit, _id=_id, name=name, image=image, is_deleted=is_deleted, cursor=cursor, count=count))
 
 # Create Script
 @router.post("/api/script")
@@ -134,14 +183,34 @@ def update_script_info(script_id: str, item_update: ScriptUpdate):
 
 # Get script code
 @router.get("/api/script/{script_id}/code")
-async def get_script_code(script_id: str):
-    return logic.get_script_code(script_id)
+async def get_script_code(script_id: str, request: Request):
+    return await response_cache.respond(request, script_code(script_id), lambda: async_logic.get_script_code(script_id))
+
+# Get a script's run statistics
+@router.get("/api/script/{script_id}/stats")
+def get_script_stats(script_id: str):
+    return logic.get_script_stats(script_id)
 
 # Update script information
 @router.patch("/api/script/{script_id}/code")
 def update_script_code(script_id: str, script: UploadFile = File(...)):
     return logic.update_script_code(script_id, script)
 
+# Get the stored versions of a script's code
+@router.get("/api/script/{script_id}/versions")
+def get_script_versions(script_id: str, page: int = 0, limit: int = 100):
+    return logic.get_script_versions(script_id, page, limit)
+
+# Diff two versions of a script's code
+@router.get("/api/script/{script_id}/versions/diff")
+def diff_script_versions(script_id: str, from_version: int, to_version: int, context: int = 3):
+    return logic.diff_script_versions(script_id, from_version, to_version, context)
+
+# Get the code of a script's version
+@router.get("/api/script/{script_id}/versions/{version}")
+def get_script_version_code(script_id: str, version: int):
+    return logic.get_script_version_code(script_id, version)
+
 # Run Script
 @router.post("/api/script/{script_id}")
 def run_script(script_id: str):
@@ -152,8 +221,9 @@ def run_script(script_id: str):
 
 
 @router.get("/api/schedule")
-def get_schedule(page: int = 0, limit: int = 100, _id: Optional[int] = None, script_id: Optional[str] = None):
-    return logic.get_schedule(page, limit, _id, script_id)
+async def get_schedule(page: int = 0, limit: int = 100, _id: Optional[int] = None, script_id: Optional[str] = None,
+                       cursor: Optional[str] = None, count: CountMode = "exact"):
+    return await async_logic.get_schedule(page, limit, _id, script_id, cursor, count)
 
 @router.post("/api/schedule")
 def create_schedule(create_data: ScheduleCreate):
@@ -172,12 +242,35 @@ def update_schedule(schedule_id: int, update_data: ScheduleUpdate):
 
 
 @router.get("/api/jobs/history/{script_id}")
-def get_job_history(script_id: str, page: int = 0, limit: int = 100, status: Optional[int] = None) -> Response:
-    return logic.get_script_jobs(script_id, page, limit, status)
+async def get_job_history(script_id: str, page: int = 0, limit: int = 100, status: Optional[int] = None,
+                          cursor: Optional[str] = None, count: CountMode = "exact", archived: bool = False) -> Response:
+    return await async_logic.get_script_jobs(script_id, page, limit, status, cursor, count, archived)
+
+@router.get("/api/script/{script_id}/logs/export")
+def export_script_logs(script_id: str, format: typing.Literal["tar.gz", "zip"] = "tar.gz", status: Optional[int] = None,
+                       since: Optional[int] = None, until: Optional[int] = None, after_job_id: Optional[int] = None):
+    return logic.export_script_logs(script_id, format, status, since, until, after_job_id)
+
+@router.get("/api/jobs/search")
+def search_job_logs(q: str, script_id: Optional[str] = None, status: Optional[int] = None, since: Optional[int] = None,
+                    until: Optional[int] = None, raw: bool = False, limit: int = Query(20, gt=0, le=100),
+                    matches_per_job: int = Query(5, gt=0, le=100)):
+    return logic.search_job_logs(q, script_id, status, since, until, raw, limit, matches_per_job)
+
+@router.get("/api/jobs/events")
+def stream_job_events(request: Request, script_id: Optional[str] = None):
+    return logic.stream_job_events(request, script_id)
 
 @router.get("/api/job/{job_id}")
-def get_job_logs(job_id, last_position: int = 0) -> Response:
-    return logic.get_job_logs(job_id, last_position)
+async def get_job_logs(job_id, last_position: int = 0, tail: Optional[int] = Query(None, ge=0), before: Optional[int] = None,
+                       max_bytes: Optional[int] = Query(None, gt=0), max_lines: Optional[int] = Query(None, gt=0),
+                       line: Optional[int] = Query(None, ge=0), since: Optional[float] = None, until: Optional[float] = None,
+                       stream: Optional[typing.Literal["stdout", "stderr"]] = None) -> Response:
+    return await async_logic.get_job_logs(job_id, last_position, tail, before, max_bytes, max_lines, line, since, until, stream)
+
+@router.get("/api/job/{job_id}/stream")
+def stream_job_logs(job_id: int, request: Request, last_position: int = 0) -> Response:
+    return logic.stream_job_logs(job_id, request, last_position)
 
 @router.delete("/api/job/{job_id}")
 def delete_job(job_id: int):
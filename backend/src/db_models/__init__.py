@@ -1,16 +1,24 @@
 from .images import DockerImage
 from .image_files import DockerImageFiles
+from .image_versions import DockerImageVersions
+from .script_stats import DockerScriptStats
 from .jobs import DockerJobs
+from .jobs_archive import DockerJobsArchive
 from .scripts import DockerScripts
 from .scheduled import DockerScheduled
 from .scripts_history import DockerScriptHistory
+from .script_versions import DockerScriptVersions
 
 
 __all__ = [
     "DockerImage",
     "DockerImageFiles",
+    "DockerImageVersions",
     "DockerJobs",
+    "DockerJobsArchive",
     "DockerScripts",
     "DockerScheduled",
-    "DockerScriptHistory"
+    "DockerScriptHistory",
+    "DockerScriptStats",
+    "DockerScriptVersions"
 ]
\ No newline at end of file
@@ -1,15 +1,22 @@
 import os.path
 import typing
 
+from sqlalchemy import Index
 from sqlalchemy.exc import NoResultFound
 from sqlmodel import SQLModel, Field, Session, select
 from sqlmodel.sql.expression import Select, col
 
 
 class DockerImageFiles(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_dockerimagefiles_image_id", "image_id"), # Files of an image
+        Index("ix_dockerimagefiles_sha256", "sha256"), # Files not deduplicated yet
+    )
+
     id: int | None = Field(default=None, primary_key=True)
     image_id: str = Field(nullable=False, foreign_key="dockerimage.id")
     filepath: str  = Field(nullable=False)
+    sha256: str | None = Field(default=None, nullable=True, max_length=64) # Blob the file is linked to, None until deduplicated
 
     @property
     def get_name(self) -> str:
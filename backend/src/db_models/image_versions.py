@@ -0,0 +1,63 @@
+import typing
+from datetime import datetime
+from typing import Optional, Self
+
+import pytz
+from sqlalchemy import UniqueConstraint
+from sqlmodel import SQLModel, Field, Session, select
+from sqlmodel.sql.expression import Select, col
+
+from src.enums import ImageStatus
+
+
+class DockerImageVersions(SQLModel, table=True):
+    """
+    DB Model for the builds of a DockerImage. Every build is made from a snapshot of the image's src directory taken
+    when the build was requested, so the image's files can be edited whilst a version is building or serving jobs. The
+    image's `image_id` and `version` point at the version that jobs run on.
+    """
+    __table_args__ = (UniqueConstraint("image_id", "version"),)
+
+    id: int | None = Field(default=None, primary_key=True)
+    image_id: str = Field(nullable=False, foreign_key="dockerimage.id", index=True)
+    version: int = Field(nullable=False)
+    status: int = Field(default=ImageStatus.BUILDING.value, nullable=False)
+    docker_image_id: str | None = Field(default=None, nullable=True) # The Image ID according to the Docker client
+    docker_tag: str | None = Field(default=None, nullable=True) # Tag of the version in the Docker environment
+    created_at: int = Field(default_factory=lambda: int(datetime.now(pytz.utc).timestamp()), nullable=False)
+    built_at: int | None = Field(default=None, nullable=True)
+
+    @classmethod
+    def get(cls, image_id: str, version: int, session: Session) -> Optional[Self]:
+        return session.exec(typing.cast(Select, select(cls).where(cls.image_id == image_id, cls.version == version))).first()
+
+    @classmethod
+    def get_by_image_id(cls, image_id: str, session: Session) -> typing.Sequence[Self]:
+        """Versions of an image, newest first."""
+        return session.exec(typing.cast(Select, select(cls).where(cls.image_id == image_id).order_by(col(cls.version).desc()))).all()
+
+    @classmethod
+    def get_latest(cls, image_id: str, session: Session) -> Optional[Self]:
+        return session.exec(typing.cast(Select, select(cls).where(cls.image_id == image_id).order_by(col(cls.version).desc()).limit(1))).first()
+
+    @classmethod
+    def get_previous_built(cls, image_id: str, version: int, session: Session) -> Optional[Self]:
+        """The newest successfully built version older than `version`."""
+        return session.exec(typing.cast(Select, select(cls).where(
+            cls.image_id == image_id, cls.version < version, cls.status == ImageStatus.BUILD_SUCCESS.value
+        ).order_by(col(cls.version).desc()).limit(1))).first()
+
+    @classmethod
+    def is_building(cls, image_id: str, session: Session) -> bool:
+        return session.exec(typing.cast(Select, select(cls.id).where(
+            cls.image_id == image_id, cls.status == ImageStatus.BUILDING.value))).first() is not None
+
+    @classmethod
+    def expire_builds(cls, image_id: str, requested_before: int, session: Session) -> typing.Sequence[Self]:
+        """Mark the versions of an image still building since before `requested_before` as failed."""
+        stale = session.exec(typing.cast(Select, select(cls).where(
+            cls.image_id == image_id, cls.status == ImageStatus.BUILDING.value, cls.created_at < requested_before))).all()
+        for image_version in stale:
+            image_version.status = ImageStatus.BUILD_FAILED.value
+            session.add(image_version)
+        return stale
@@ -2,7 +2,7 @@ import typing
 from datetime import datetime
 from typing import Self, Optional, Sequence, cast
 import pytz
-from sqlalchemy import func
+from sqlalchemy import func, Index
 from sqlalchemy.exc import NoResultFound
 from sqlmodel import SQLModel, Field, Session, select, col
 from sqlmodel.sql._expression_select_cls import Select
@@ -11,6 +11,11 @@ from src.enums import ImageStatus
 
 
 class DockerImage(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_dockerimage_created", "created_at", "id"), # Images, newest first
+        Index("ix_dockerimage_image_id", "image_id"), # Lookups by the Docker client's image ID
+    )
+
     id: str = Field(primary_key=True, nullable=False) # Image ID in DB
     image_id: str | None = Field(default=None) # The Image ID according to Docker client (Only applies to build images)1
     name: str = Field(default=None, nullable=False) # User-friendly name (shown in UI)
@@ -18,6 +23,7 @@ class DockerImage(SQLModel, table=True):
     tag: str | None = Field(default=None) # Image ID tag
     status: int = Field(default=0, nullable=False) # Flag for if the image is built in the docker engine.
     created_at: int = Field(default_factory=lambda: int(datetime.now(pytz.utc).timestamp()), nullable=False)
+    version: int | None = Field(default=None, nullable=True) # Version (DockerImageVersions) that jobs run on
 
     @property
     def status_enum(self):
@@ -27,6 +33,11 @@ class DockerImage(SQLModel, table=True):
     def status_enum(self, value):
         self.status = value.value
 
+    @property
+    def is_serving(self) -> bool:
+        """Whether a built version of the image is available to run jobs on."""
+        return self.status == ImageStatus.BUILD_SUCCESS.value and self.image_id is not None
+
     @classmethod
     def get_by_id(cls, _id: str, session: Session) -> Optional[Self]:
         """Get DockerImage instance given the image ID in the database."""
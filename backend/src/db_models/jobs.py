@@ -4,13 +4,23 @@ from datetime import datetime
 import docker.errors
 import pytz
 from docker import DockerClient
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field, Session, select
 from sqlmodel.sql.expression import Select, col, desc
 from typing import Self, Optional
+from src.db_models.script_stats import DockerScriptStats
 from src.enums import JobStatus
+from src.utils.pagination import paginate, split_page
 
 
 class DockerJobs(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_dockerjobs_script_created", "script_id", "created_at", "id"), # Job history, newest first
+        Index("ix_dockerjobs_script_status_created", "script_id", "status", "created_at", "id"), # Filtered history, running jobs of a script
+        Index("ix_dockerjobs_status_script", "status", "script_id"), # Running and terminal jobs across scripts
+        Index("ix_dockerjobs_container_id", "container_id"), # Kill lookups
+    )
+
     id: int | None = Field(default=None, primary_key=True)
     created_at: int | None = Field(default_factory=lambda: int(datetime.now(tz=pytz.utc).timestamp()), nullable=False)
     finished_at: int | None = Field(default=None)
@@ -19,25 +29,55 @@ class DockerJobs(SQLModel, table=True):
     status: int | None = Field(default=None, nullable=False)
     container_id: str | None = Field(default=None, nullable=True)
     message_id: str | None = Field(default=None, nullable=True)
+    script_version: int | None = Field(default=None, nullable=True) # Version of the script's code the job ran
 
     @classmethod
-    def get_by_id(cls, _id: int, session: Session) -> Optional[Self]:
-        return session.exec(typing.cast("Select", select(cls).where(cls.id == _id))).first()
+    def get_by_id(cls, _id: int, session: Session, lock: bool = False) -> Optional[Self]:
+        """:param lock: Lock the job until the end of the transaction, e.g. so that it is not archived meanwhile."""
+        query = select(cls).where(cls.id == _id)
+        return session.exec(typing.cast("Select", query.with_for_update() if lock else query)).first()
 
     @classmethod
     def get_by_container_id(cls, container_id: str, session: Session) -> typing.Sequence[Self]:
         return session.exec(typing.cast("Select", select(cls).where(cls.container_id == container_id))).all()
 
     @classmethod
-    def get_by_script_id(cls, script_id: str, page: int, limit: int, status: Optional[int], session: Session) -> typing.Sequence[Self]:
+    def script_jobs_query(cls, script_id: str, page: int, limit: int, status: Optional[int], cursor: Optional[str] = None) -> Select:
+        """Statement selecting one page of a script's jobs, newest first, see `paginate`."""
         where = [cls.script_id == script_id]
         if status:
             where.append(cls.status == status)
-        return session.exec(typing.cast("Select", select(cls).where(*where).order_by(col(cls.id).desc())).limit(limit).offset(limit * page)).all()
+        return typing.cast("Select", paginate(select(cls).where(*where), col(cls.created_at), col(cls.id), limit, cursor, page))
+
+    @classmethod
+    def get_by_script_id(cls, script_id: str, page: int, limit: int, status: Optional[int], session: Session,
+                         cursor: Optional[str] = None) -> typing.Tuple[typing.List[Self], Optional[str]]:
+        """One page of a script's jobs, newest first, and the cursor of the next page."""
+        query = cls.script_jobs_query(script_id, page, limit, status, cursor)
+        return split_page(session.exec(query).all(), limit, key=lambda job: (job.created_at, job.id))
 
     def set_killed(self):
         self.status = JobStatus.KILLED.value
 
+    def set_finished(self, status: int, session: Session, lock: bool = True) -> bool:
+        """
+        Move the job to a terminal status and count it in its script's statistics, in the session's transaction. The
+        job is locked and reloaded first, a job that has already finished (e.g. was killed whilst its output was being
+        followed) keeps its status and is not counted again.
+        :param lock: False when the job has just been loaded with a lock in this transaction.
+        :return: Whether the job had not finished before.
+        """
+        if lock:
+            session.refresh(self, with_for_update=True)
+        if self.finished_at is None:
+            self.finished_at = int(datetime.now(tz=pytz.utc).timestamp())
+        session.add(self)
+        if self.status in [s.value for s in JobStatus.get_deletable()]:
+            return False
+        self.status = status
+        DockerScriptStats.record(self, session)
+        return True
+
     @classmethod
     def get_running_jobs(cls, script_id: str | None, session: Session) -> typing.Sequence[Self]:
         # Ensure query includes only running jobs
@@ -63,8 +103,7 @@ class DockerJobs(SQLModel, table=True):
             raise RuntimeError(f"Failed to kill container {self.container_id}: {str(e)}")
 
         # Update status
-        self.status = JobStatus.KILLED.value
-        session.add(self)
+        self.set_finished(JobStatus.KILLED.value, session)
         session.flush()
 
     @classmethod
@@ -95,8 +134,7 @@ class DockerJobs(SQLModel, table=True):
             raise RuntimeError(f"Failed to kill container {result.container_id}: {str(e)}")
 
         # Update status
-        result.status = JobStatus.KILLED.value
-        session.add(result)
+        result.set_finished(JobStatus.KILLED.value, session)
 
         return result
 
@@ -0,0 +1,52 @@
+import typing
+from datetime import datetime
+
+import pytz
+from sqlalchemy import Index
+from sqlmodel import SQLModel, Field, Session, select
+from sqlmodel.sql.expression import Select, col
+from typing import Self, Optional
+
+from src.utils.pagination import paginate, split_page
+
+
+class DockerJobsArchive(SQLModel, table=True):
+    """Finished jobs moved out of DockerJobs by the job archiver, keeping their IDs. See `src.utils.job_archiver`."""
+
+    __table_args__ = (
+        Index("ix_dockerjobsarchive_script_created", "script_id", "created_at", "id"), # Archived job history, newest first
+        Index("ix_dockerjobsarchive_script_status_created", "script_id", "status", "created_at", "id"), # Filtered history
+        Index("ix_dockerjobsarchive_created", "created_at", "id"), # Expiry by the garbage collector
+    )
+
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    created_at: int | None = Field(default=None, nullable=False)
+    finished_at: int | None = Field(default=None)
+    script_id: str | None = Field(default=None, nullable=False)
+    logs: str | None = Field(default=None)
+    status: int | None = Field(default=None, nullable=False)
+    container_id: str | None = Field(default=None, nullable=True)
+    message_id: str | None = Field(default=None, nullable=True)
+    script_version: int | None = Field(default=None, nullable=True)
+    archived_at: int | None = Field(default_factory=lambda: int(datetime.now(tz=pytz.utc).timestamp()), nullable=False)
+
+    @classmethod
+    def get_by_id(cls, _id: int, session: Session, lock: bool = False) -> Optional[Self]:
+        """:param lock: Lock the job until the end of the transaction, e.g. so that it is not archived meanwhile."""
+        query = select(cls).where(cls.id == _id)
+        return session.exec(typing.cast("Select", query.with_for_update() if lock else query)).first()
+
+    @classmethod
+    def script_jobs_query(cls, script_id: str, page: int, limit: int, status: Optional[int], cursor: Optional[str] = None) -> Select:
+        """Statement selecting one page of a script's archived jobs, newest first, see `paginate`."""
+        where = [cls.script_id == script_id]
+        if status:
+            where.append(cls.status == status)
+        return typing.cast("Select", paginate(select(cls).where(*where), col(cls.created_at), col(cls.id), limit, cursor, page))
+
+    @classmethod
+    def get_by_script_id(cls, script_id: str, page: int, limit: int, status: Optional[int], session: Session,
+                         cursor: Optional[str] = None) -> typing.Tuple[typing.List[Self], Optional[str]]:
+        """One page of a script's archived jobs, newest first, and the cursor of the next page."""
+        query = cls.script_jobs_query(script_id, page, limit, status, cursor)
+        return split_page(session.exec(query).all(), limit, key=lambda job: (job.created_at, job.id))
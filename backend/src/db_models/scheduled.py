@@ -2,13 +2,19 @@ import typing
 from datetime import datetime
 
 import pytz
-from sqlalchemy import Select
+from sqlalchemy import Select, Index, update
 from sqlmodel import SQLModel, Field, Session, select, col
 from sqlalchemy.sql._typing import _OnClauseArgument, _ColumnExpressionArgument
 from src.db_models import DockerScripts, DockerImage
 
 
 class DockerScheduled(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_dockerscheduled_runnable", "enabled", "running"), # Schedules due to be checked by the scheduler
+        Index("ix_dockerscheduled_script_created", "script_id", "created_at", "id"), # Schedules of a script, newest first
+        Index("ix_dockerscheduled_created", "created_at", "id"), # Schedules, newest first
+    )
+
     id: int | None = Field(default=None, primary_key=True)
     script_id: str = Field(nullable=False, foreign_key="dockerscripts.id")
     created_at: int | None = Field(default_factory=lambda: int(datetime.now(tz=pytz.utc).timestamp()), nullable=False)
@@ -44,10 +50,11 @@ class DockerScheduled(SQLModel, table=True):
 
     @classmethod
     def get_runnable(cls, session: Session) -> typing.Sequence[typing.Self]:
+        # Compared with = rather than IS, which MySQL cannot look up in ix_dockerscheduled_runnable.
         return session.exec(typing.cast(Select, select(cls))
-                            .where(col(cls.enabled).is_(True))
+                            .where(col(cls.enabled) == True)
                             .where(col(cls.cron).is_not(None))
-                            .where(col(cls.running).is_(False))
+                            .where(col(cls.running) == False)
                             ).all()
     @classmethod
     def exists(cls, script_id: str, cron_string: str, session: Session) -> bool:
@@ -61,4 +68,10 @@ class DockerScheduled(SQLModel, table=True):
             obj.running = False
             session.add(obj)
             session.flush()
-            session.refresh(obj)
\ No newline at end of file
+            session.refresh(obj)
+
+    @classmethod
+    def set_finished_many(cls, ids: typing.Collection[int], session: Session) -> None:
+        """`set_finished` of several schedules in a single statement."""
+        if ids:
+            session.execute(update(cls).where(col(cls.id).in_(sorted(ids))).values(running=False))
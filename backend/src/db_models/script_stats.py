@@ -0,0 +1,131 @@
+import typing
+from datetime import datetime
+
+import pytz
+from sqlalchemy import Select, Text
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import SQLModel, Field, Session, select
+
+from src.enums import JobStatus
+from src.utils.run_stats import DurationHistogram
+
+
+class DockerScriptStats(SQLModel, table=True):
+    """
+    Run statistics of a script, updated incrementally as its jobs finish, so that they can be read without scanning
+    the script's jobs. Duration of a job is the time from it being queued until it finished.
+    """
+
+    script_id: str = Field(primary_key=True, max_length=255)
+    runs: int = Field(default=0, nullable=False)
+    success_count: int = Field(default=0, nullable=False)
+    failed_count: int = Field(default=0, nullable=False)
+    killed_count: int = Field(default=0, nullable=False)
+    latest_job_id: int | None = Field(default=None, nullable=True) # Most recently created job that finished
+    latest_status: int | None = Field(default=None, nullable=True)
+    latest_created_at: int | None = Field(default=None, nullable=True)
+    latest_finished_at: int | None = Field(default=None, nullable=True)
+    latest_duration: int | None = Field(default=None, nullable=True)
+    duration_count: int = Field(default=0, nullable=False)
+    duration_sum: int = Field(default=0, nullable=False)
+    duration_min: int | None = Field(default=None, nullable=True)
+    duration_max: int | None = Field(default=None, nullable=True)
+    duration_buckets: str | None = Field(default=None, nullable=True, sa_type=Text) # See `DurationHistogram`
+    updated_at: int | None = Field(default_factory=lambda: int(datetime.now(tz=pytz.utc).timestamp()), nullable=False)
+
+    @classmethod
+    def get_by_script_id(cls, script_id: str, session: Session) -> typing.Optional[typing.Self]:
+        return session.exec(typing.cast(Select, select(cls).where(cls.script_id == script_id))).first()
+
+    @classmethod
+    def get_for_update(cls, script_id: str, session: Session) -> typing.Self:
+        """A script's statistics locked until the end of the transaction, created when the script has none yet."""
+        query = typing.cast(Select, select(cls).where(cls.script_id == script_id).with_for_update())
+        stats = session.exec(query).first()
+        if stats is not None:
+            return stats
+        try:
+            with session.begin_nested():
+                session.add(cls(script_id=script_id))
+        except IntegrityError:
+            # Created by a job of the same script finishing at the same time.
+            pass
+        return session.exec(query.execution_options(populate_existing=True)).one()
+
+    @classmethod
+    def record(cls, job, session: Session) -> typing.Self:
+        """
+        Count a job that has just finished in its script's statistics. Must be called once per job, in the transaction
+        committing the job's terminal status, see `DockerJobs.set_finished`.
+        """
+        stats = cls.get_for_update(job.script_id, session)
+        stats.add(job.id, job.status, job.created_at, job.finished_at)
+        session.add(stats)
+        return stats
+
+    def add(self, job_id: int, status: int, created_at: typing.Optional[int], finished_at: typing.Optional[int]) -> None:
+        self.runs += 1
+        if status == JobStatus.SUCCESS.value:
+            self.success_count += 1
+        elif status == JobStatus.FAILED.value:
+            self.failed_count += 1
+        elif status == JobStatus.KILLED.value:
+            self.killed_count += 1
+
+        duration = finished_at - created_at if created_at is not None and finished_at is not None else None
+        if duration is not None:
+            duration = max(duration, 0)
+            self.duration_count += 1
+            self.duration_sum += duration
+            self.duration_min = duration if self.duration_min is None else min(self.duration_min, duration)
+            self.duration_max = duration if self.duration_max is None else max(self.duration_max, duration)
+            histogram = DurationHistogram.loads(self.duration_buckets)
+            histogram.add(duration)
+            self.duration_buckets = histogram.dumps()
+
+        if self.latest_job_id is None or (created_at or 0, job_id) >= (self.latest_created_at or 0, self.latest_job_id):
+            self.latest_job_id = job_id
+            self.latest_status = status
+            self.latest_created_at = created_at
+            self.latest_finished_at = finished_at
+            self.latest_duration = duration
+        self.updated_at = int(datetime.now(tz=pytz.utc).timestamp())
+
+    @property
+    def success_rate(self) -> typing.Optional[float]:
+        return self.success_count / self.runs if self.runs else None
+
+    @property
+    def mean_duration(self) -> typing.Optional[float]:
+        return self.duration_sum / self.duration_count if self.duration_count else None
+
+    def percentile(self, q: float) -> typing.Optional[float]:
+        """Approximate q-th percentile of the durations, kept between the shortest and longest duration."""
+        value = DurationHistogram.loads(self.duration_buckets).percentile(q)
+        if value is None:
+            return None
+        return round(min(max(value, self.duration_min or 0), self.duration_max or value), 1)
+
+    def summary(self) -> dict:
+        """Statistics shown alongside a script in listings."""
+        return {
+            "runs": self.runs,
+            "success_rate": self.success_rate,
+            "latest_job_id": self.latest_job_id,
+            "latest_status": self.latest_status,
+            "latest_finished_at": self.latest_finished_at,
+            "latest_duration": self.latest_duration,
+            "p50_duration": self.percentile(50),
+            "p95_duration": self.percentile(95),
+        }
+
+    def details(self) -> dict:
+        return {
+            **self.model_dump(exclude={"duration_buckets"}),
+            "success_rate": self.success_rate,
+            "mean_duration": self.mean_duration,
+            "p50_duration": self.percentile(50),
+            "p90_duration": self.percentile(90),
+            "p95_duration": self.percentile(95),
+            "p99_duration": self.percentile(99),
+        }
@@ -0,0 +1,44 @@
+import typing
+from datetime import datetime
+from typing import Optional, Self
+
+import pytz
+from sqlalchemy import UniqueConstraint, func
+from sqlmodel import SQLModel, Field, Session, select
+from sqlmodel.sql.expression import Select, col
+
+
+class DockerScriptVersions(SQLModel, table=True):
+    """
+    DB Model for the stored versions of a script's code. The content of every version lives in the script's
+    `versions.pack` file, either in full (a keyframe, `base_version` is None) or as a delta against the previous
+    version. `offset` and `length` locate the version's compressed record in the pack.
+    """
+    __table_args__ = (UniqueConstraint("script_id", "version"),)
+
+    id: int | None = Field(default=None, primary_key=True)
+    script_id: str = Field(nullable=False, foreign_key="dockerscripts.id", index=True)
+    version: int = Field(nullable=False)
+    sha256: str = Field(nullable=False, max_length=64)
+    size: int = Field(nullable=False) # Size of the version's content
+    base_version: int | None = Field(default=None, nullable=True)
+    offset: int = Field(nullable=False)
+    length: int = Field(nullable=False)
+    created_at: int | None = Field(default_factory=lambda: int(datetime.now(tz=pytz.utc).timestamp()), nullable=False)
+
+    @classmethod
+    def get(cls, script_id: str, version: int, session: Session) -> Optional[Self]:
+        return session.exec(typing.cast(Select, select(cls).where(cls.script_id == script_id, cls.version == version))).first()
+
+    @classmethod
+    def get_by_script_id(cls, script_id: str, page: int, limit: int, session: Session) -> typing.Sequence[Self]:
+        return session.exec(typing.cast(Select, select(cls).where(cls.script_id == script_id).order_by(
+            col(cls.version).desc()).limit(limit).offset(limit * page))).all()
+
+    @classmethod
+    def get_chain(cls, script_id: str, version: int, session: Session) -> typing.Sequence[Self]:
+        """The versions needed to reconstruct `version`: its closest keyframe and the deltas following it."""
+        keyframe = select(func.max(cls.version)).where(
+            cls.script_id == script_id, cls.version <= version, col(cls.base_version).is_(None)).scalar_subquery()
+        return session.exec(typing.cast(Select, select(cls).where(
+            cls.script_id == script_id, cls.version >= keyframe, cls.version <= version).order_by(col(cls.version)))).all()
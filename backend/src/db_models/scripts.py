@@ -1,12 +1,17 @@
 import typing
 from datetime import datetime
 import pytz
-from sqlalchemy import Select, func
+from sqlalchemy import Select, func, Index
 from sqlalchemy.exc import NoResultFound
 from sqlmodel import SQLModel, Field, Session, select, col
 
 
 class DockerScripts(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_dockerscripts_image_deleted", "image_id", "deleted"), # Scripts of an image
+        Index("ix_dockerscripts_deleted_created", "deleted", "created_at", "id"), # Scripts, newest first
+    )
+
     id: str | None = Field(default=None, primary_key=True)
     name: str | None = Field(default=None, nullable=False)
     description: str | None = Field(default=None, nullable=True)
@@ -14,6 +19,10 @@ class DockerScripts(SQLModel, table=True):
     image_id: str | None = Field(default=None, nullable=True, foreign_key="dockerimage.id")
     language: str | None = Field(default=None, nullable=False)
     deleted: bool | None = Field(default=False, nullable=False)
+    log_head_bytes: int | None = Field(default=None, nullable=True) # Overrides the global LOG_HEAD_BYTES cap when set
+    log_tail_bytes: int | None = Field(default=None, nullable=True) # Overrides the global LOG_TAIL_BYTES cap when set
+    code_sha256: str | None = Field(default=None, nullable=True, max_length=64) # Blob the script's source is linked to
+    version: int | None = Field(default=None, nullable=True) # Current version of the code, None until first versioned
 
     @classmethod
     def exists(cls, _id: str | None, session: Session) -> bool:
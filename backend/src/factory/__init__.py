@@ -1,5 +1,5 @@
-from .database import SessionDep, get_session, create_db_and_tables
+from .database import SessionDep, AsyncSessionDep, get_session, get_async_session, create_db_and_tables
 from .web import app
 from .conf import config
 
-__all__ = ["SessionDep", "get_session", "create_db_and_tables", "app", "config"]
\ No newline at end of file
+__all__ = ["SessionDep", "AsyncSessionDep", "get_session", "get_async_session", "create_db_and_tables", "app", "config"]
\ No newline at end of file
@@ -33,6 +33,92 @@ class Config:
         self.IMAGE_DIR: str = os.path.join(self.DATA_DIR, self.image_dir_name)
         self.script_dir_name: str = "scripts"
         self.SCRIPT_DIR: str = os.path.join(self.DATA_DIR, self.script_dir_name)
+        # Content-addressed store that image files and script sources are hardlinked from.
+        self.blob_dir_name: str = "blobs"
+        self.BLOB_DIR: str = os.path.join(self.DATA_DIR, self.blob_dir_name)
+        # Compression applied to the cached build context archive that is streamed to the docker daemon ("gzip" or none)
+        self.BUILD_CONTEXT_COMPRESSION: str | None = self.all.get('BUILD_CONTEXT_COMPRESSION', None) or None
+        # Versions still building this many seconds after they were requested are considered crashed and marked failed.
+        self.IMAGE_BUILD_TIMEOUT_SECONDS: int = int(self.all.get('IMAGE_BUILD_TIMEOUT_SECONDS', 3600))
+        # Job log size caps (bytes). The first LOG_HEAD_BYTES and the last LOG_TAIL_BYTES of a job's output are kept,
+        # rotating through segments of LOG_SEGMENT_BYTES. Scripts can override the head and tail caps individually.
+        self.LOG_HEAD_BYTES: int = int(self.all.get('LOG_HEAD_BYTES', 10 * 1024 * 1024))
+        self.LOG_TAIL_BYTES: int = int(self.all.get('LOG_TAIL_BYTES', 50 * 1024 * 1024))
+        self.LOG_SEGMENT_BYTES: int = int(self.all.get('LOG_SEGMENT_BYTES', 10 * 1024 * 1024))
+        # Number of lines between two entries of a log's sparse line index.
+        self.LOG_INDEX_INTERVAL: int = int(self.all.get('LOG_INDEX_INTERVAL', 10000))
+        # Write job logs in the timestamped format ("<timestamp> <stdout|stderr> <line>") with a time index every
+        # LOG_TIME_INDEX_INTERVAL seconds, so logs can be read by time window.
+        self.LOG_TIMESTAMPS: bool = bool(self.all.get('LOG_TIMESTAMPS', False))
+        self.LOG_TIME_INDEX_INTERVAL: float = float(self.all.get('LOG_TIME_INDEX_INTERVAL', 10.0))
+        # Compression applied to a job's log once the job has finished ("gzip" or none), in independently
+        # decompressable blocks of LOG_COMPRESSION_BLOCK_BYTES so offset based reads stay cheap.
+        self.LOG_COMPRESSION: str | None = self.all.get('LOG_COMPRESSION', "gzip") or None
+        self.LOG_COMPRESSION_LEVEL: int = int(self.all.get('LOG_COMPRESSION_LEVEL', 6))
+        self.LOG_COMPRESSION_BLOCK_BYTES: int = int(self.all.get('LOG_COMPRESSION_BLOCK_BYTES', 1024 * 1024))
+        # Server-Sent Event log streams: how often the log files and the job/image status are checked (seconds).
+        self.LOG_STREAM_POLL_INTERVAL: float = float(self.all.get('LOG_STREAM_POLL_INTERVAL', 0.5))
+        self.LOG_STREAM_STATUS_INTERVAL: float = float(self.all.get('LOG_STREAM_STATUS_INTERVAL', 2.0))
+        self.LOG_STREAM_IDLE_TIMEOUT: float = float(self.all.get('LOG_STREAM_IDLE_TIMEOUT', 60.0))
+        # Upper bounds of a single log read response, clients may request less.
+        self.LOG_READ_MAX_BYTES: int = int(self.all.get('LOG_READ_MAX_BYTES', 1024 * 1024))
+        self.LOG_READ_MAX_LINES: int = int(self.all.get('LOG_READ_MAX_LINES', 5000))
+        # Full-text search index over the logs of finished jobs, kept in a local SQLite database.
+        self.LOG_SEARCH_ENABLED: bool = bool(self.all.get('LOG_SEARCH_ENABLED', True))
+        self.LOG_SEARCH_DB: str = self.all.get('LOG_SEARCH_DB', os.path.join(self.DATA_DIR, "log_search.db"))
+        self.LOG_SEARCH_CRON: str = self.all.get('LOG_SEARCH_CRON', "*/10 * * * *")
+        self.LOG_SEARCH_BATCH_SIZE: int = int(self.all.get('LOG_SEARCH_BATCH_SIZE', 100))
+        self.LOG_SEARCH_MAX_LINE_BYTES: int = int(self.all.get('LOG_SEARCH_MAX_LINE_BYTES', 2048))
+        # Catch-up runs scan at most LOG_SEARCH_SCAN_LIMIT jobs. Jobs that have not finished within
+        # LOG_SEARCH_PENDING_SECONDS of being created, or failed to index, are retried LOG_SEARCH_MAX_RETRIES times.
+        self.LOG_SEARCH_SCAN_LIMIT: int = int(self.all.get('LOG_SEARCH_SCAN_LIMIT', 5000))
+        self.LOG_SEARCH_PENDING_SECONDS: int = int(self.all.get('LOG_SEARCH_PENDING_SECONDS', 86400))
+        self.LOG_SEARCH_MAX_RETRIES: int = int(self.all.get('LOG_SEARCH_MAX_RETRIES', 5))
+        # Script versions: a full copy of the code is stored at least every SCRIPT_VERSION_KEYFRAME_INTERVAL versions,
+        # deltas against the previous version in between. Reconstructed versions are cached up to the given size.
+        self.SCRIPT_VERSION_KEYFRAME_INTERVAL: int = int(self.all.get('SCRIPT_VERSION_KEYFRAME_INTERVAL', 50))
+        self.SCRIPT_VERSION_CACHE_BYTES: int = int(self.all.get('SCRIPT_VERSION_CACHE_BYTES', 32 * 1024 * 1024))
+        # Seconds a listing's total row count is reused for when requested with count=cached.
+        self.PAGINATION_COUNT_CACHE_SECONDS: float = float(self.all.get('PAGINATION_COUNT_CACHE_SECONDS', 30.0))
+        # API worker processes, 0 for one per CPU core. Each has its own database engine and pool. Sending SIGHUP to the
+        # main process replaces the workers one by one, allowing requests in flight API_GRACEFUL_SHUTDOWN_SECONDS to finish.
+        self.API_WORKERS: int = int(self.all.get('API_WORKERS', 1))
+        self.API_GRACEFUL_SHUTDOWN_SECONDS: int = int(self.all.get('API_GRACEFUL_SHUTDOWN_SECONDS', 30))
+        # Database connection pool settings, applied to the synchronous and the asynchronous engine alike.
+        self.DB_POOL_SIZE: int = int(self.all.get('DB_POOL_SIZE', 10))
+        self.DB_MAX_OVERFLOW: int = int(self.all.get('DB_MAX_OVERFLOW', 20))
+        self.DB_POOL_TIMEOUT: float = float(self.all.get('DB_POOL_TIMEOUT', 30.0))
+        self.DB_POOL_RECYCLE: int = int(self.all.get('DB_POOL_RECYCLE', 1800))
+        self.DB_POOL_PRE_PING: bool = bool(self.all.get('DB_POOL_PRE_PING', True))
+        # Serve the read endpoints polled by clients from an asyncio database engine instead of the threadpool.
+        # ASYNC_DATABASE_CONN_URL defaults to DATABASE_CONN_URL with the aiomysql driver.
+        self.DATABASE_ASYNC: bool = bool(self.all.get('DATABASE_ASYNC', False))
+        self.ASYNC_DATABASE_CONN_URL: str | None = self.all.get('ASYNC_DATABASE_CONN_URL', None)
+        # Memory for cached GET responses, and seconds after which a process stops trusting the version of a cached
+        # resource it was told about (0 trusts it until the resource changes).
+        self.RESPONSE_CACHE_BYTES: int = int(self.all.get('RESPONSE_CACHE_BYTES', 16 * 1024 * 1024))
+        self.RESPONSE_CACHE_TTL_SECONDS: float = float(self.all.get('RESPONSE_CACHE_TTL_SECONDS', 300.0))
+        # Job state changes of the runner are written in batches of up to JOB_STATE_BATCH_SIZE jobs, each change waiting at
+        # most JOB_STATE_FLUSH_SECONDS for others to join its batch.
+        self.JOB_STATE_BATCH_SIZE: int = int(self.all.get('JOB_STATE_BATCH_SIZE', 200))
+        self.JOB_STATE_FLUSH_SECONDS: float = float(self.all.get('JOB_STATE_FLUSH_SECONDS', 0.05))
+        # Finished jobs older than JOB_ARCHIVE_AFTER_DAYS (0 disables archiving) are moved to the archive table on
+        # JOB_ARCHIVE_CRON, JOB_ARCHIVE_BATCH_SIZE jobs per transaction and at most JOB_ARCHIVE_MAX_BATCHES per run.
+        self.JOB_ARCHIVE_AFTER_DAYS: int = int(self.all.get('JOB_ARCHIVE_AFTER_DAYS', 0))
+        self.JOB_ARCHIVE_CRON: str = self.all.get('JOB_ARCHIVE_CRON', "*/10 * * * *")
+        self.JOB_ARCHIVE_BATCH_SIZE: int = int(self.all.get('JOB_ARCHIVE_BATCH_SIZE', 1000))
+        self.JOB_ARCHIVE_MAX_BATCHES: int = int(self.all.get('JOB_ARCHIVE_MAX_BATCHES', 20))
+        # Upload limits in bytes. A value of 0 disables the corresponding limit.
+        self.UPLOAD_MAX_FILE_BYTES: int = int(self.all.get('UPLOAD_MAX_FILE_BYTES', 100 * 1024 * 1024))
+        self.UPLOAD_MAX_REQUEST_BYTES: int = int(self.all.get('UPLOAD_MAX_REQUEST_BYTES', 500 * 1024 * 1024))
+        # Garbage collector retention policies. A value of 0 disables the corresponding policy.
+        self.GC_CRON: str = self.all.get('GC_CRON', "0 * * * *")
+        self.GC_BATCH_SIZE: int = int(self.all.get('GC_BATCH_SIZE', 500))
+        self.GC_KEEP_JOBS_PER_SCRIPT: int = int(self.all.get('GC_KEEP_JOBS_PER_SCRIPT', 0))
+        self.GC_MAX_JOB_AGE_DAYS: int = int(self.all.get('GC_MAX_JOB_AGE_DAYS', 0))
+        # Built image versions kept besides the active one, so the image can be rolled back without rebuilding.
+        self.GC_KEEP_IMAGE_VERSIONS: int = int(self.all.get('GC_KEEP_IMAGE_VERSIONS', 2))
+        self.GC_GRACE_PERIOD_SECONDS: int = int(self.all.get('GC_GRACE_PERIOD_SECONDS', 3600))
         self.validate()
 
 
@@ -47,4 +133,9 @@ class Config:
             os.makedirs(self.SCRIPT_DIR)
             logger.info(f"Created Script Directory: {self.SCRIPT_DIR}")
 
+        if not os.path.exists(self.BLOB_DIR):
+            logger.warning(f"Blob directory does not exist: {self.BLOB_DIR}")
+            os.makedirs(self.BLOB_DIR)
+            logger.info(f"Created Blob Directory: {self.BLOB_DIR}")
+
 config = Config()
\ No newline at end of file
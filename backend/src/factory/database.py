@@ -1,16 +1,37 @@
-from typing import Annotated
+from typing import Annotated, AsyncIterator, Optional
 from fastapi import Depends
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 from sqlmodel import create_engine, Session, SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
 from src.factory.conf import config
 from src.db_models import *
+from src.utils.migrations import run_migrations
 import os
 
 def get_database_url() -> str:
     return config.DATABASE_CONN_URL
 
 
+def get_async_database_url() -> str:
+    if config.ASYNC_DATABASE_CONN_URL:
+        return config.ASYNC_DATABASE_CONN_URL
+    return make_url(config.DATABASE_CONN_URL).set(drivername="mysql+aiomysql").render_as_string(hide_password=False)
+
+
+def get_pool_options() -> dict:
+    return {
+        "pool_size": config.DB_POOL_SIZE,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+        "pool_timeout": config.DB_POOL_TIMEOUT,
+        "pool_recycle": config.DB_POOL_RECYCLE,
+        "pool_pre_ping": config.DB_POOL_PRE_PING,
+    }
+
+
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+    # Creates missing tables and brings tables created by earlier releases up to date with the models.
+    run_migrations(engine, SQLModel.metadata)
 
 
 def get_session():
@@ -18,7 +39,17 @@ def get_session():
         yield session
 
 
-engine = create_engine(get_database_url(), echo=config.all.get("SQLALCHEMY_ECHO", True))
+async def get_async_session() -> AsyncIterator[AsyncSession]:
+    async with AsyncSession(async_engine) as session:
+        yield session
+
+
+engine = create_engine(get_database_url(), echo=config.all.get("SQLALCHEMY_ECHO", True), **get_pool_options())
+# Only created in async mode, the driver is not required otherwise.
+async_engine: Optional[AsyncEngine] = create_async_engine(
+    get_async_database_url(), echo=config.all.get("SQLALCHEMY_ECHO", True), **get_pool_options()
+) if config.DATABASE_ASYNC else None
 
 
 SessionDep = Annotated[Session, Depends(get_session)]
+AsyncSessionDep = Annotated[AsyncSession, Depends(get_async_session)]
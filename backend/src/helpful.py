@@ -1,3 +1,4 @@
+import hashlib
 import os
 import typing
 import uuid
@@ -5,6 +6,31 @@ from typing import Optional
 
 from fastapi import UploadFile
 
+from src.factory.conf import config
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, filename: Optional[str], limit: int, scope: str = "file"):
+        self.filename = filename
+        self.limit = limit
+        self.scope = scope
+        super().__init__("Upload {} exceeds the {} limit of {} bytes".format(filename, scope, limit))
+
+
+class UploadBudget:
+    """Bytes that all files saved for one request may still take up together."""
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        self.limit = config.UPLOAD_MAX_REQUEST_BYTES if max_bytes is None else max_bytes
+        self.remaining = self.limit
+
+    def consume(self, size: int, filename: Optional[str] = None) -> None:
+        self.remaining -= size
+        if self.limit > 0 and self.remaining < 0:
+            raise UploadTooLarge(filename, self.limit, scope="request")
+
 
 def to_int_or_none(value: str | float) -> typing.Optional[int]:
     try:
@@ -22,9 +48,51 @@ def has_illegal_characters(string: str, illegal_chars: Optional[list[str]] = Non
         illegal_chars = list("[@!#$%^&*()<>?/|}{~:]_.")
     return any(char in illegal_chars for char in string)
 
-def save_file(save_path: str, file: UploadFile):
-    with open(save_path, "wb") as f:
-        f.write(file.file.read())
+def check_upload_sizes(files: typing.Iterable[Optional[UploadFile]]) -> None:
+    """
+    Reject uploads by the sizes reported for them before anything is written. Files without a reported size are
+    only checked whilst they are being saved.
+    """
+    budget = UploadBudget()
+    for file in files:
+        if file is None or file.size is None:
+            continue
+        if 0 < config.UPLOAD_MAX_FILE_BYTES < file.size:
+            raise UploadTooLarge(file.filename, config.UPLOAD_MAX_FILE_BYTES)
+        budget.consume(file.size, file.filename)
+
+def save_file(save_path: str, file: UploadFile, budget: Optional[UploadBudget] = None,
+              max_bytes: Optional[int] = None) -> str:
+    """
+    Copy an upload to `save_path` in fixed-size chunks, so memory use does not depend on the size of the upload.
+    The content is written to a temporary file next to the destination and renamed over it once complete, so the
+    destination is never left partially written, also when a size limit is exceeded midway.
+
+    :param budget: Size budget of the request the file belongs to, shared by all its files.
+    :param max_bytes: Maximum size of the file, UPLOAD_MAX_FILE_BYTES by default. 0 disables the limit.
+    :return: Hex encoded SHA-256 digest of the content.
+    """
+    max_bytes = config.UPLOAD_MAX_FILE_BYTES if max_bytes is None else max_bytes
+    digest = hashlib.sha256()
+    size = 0
+    temp_path = "{}.{}.tmp".format(save_path, uuid.uuid4().hex)
+    try:
+        file.file.seek(0)
+        with open(temp_path, "wb") as f:
+            while chunk := file.file.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if 0 < max_bytes < size:
+                    raise UploadTooLarge(file.filename, max_bytes)
+                if budget is not None:
+                    budget.consume(len(chunk), file.filename)
+                digest.update(chunk)
+                f.write(chunk)
+        os.replace(temp_path, save_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return digest.hexdigest()
 
 def securely_create_dir(root_directory: str):
     if not os.path.exists(root_directory):
@@ -1,29 +1,44 @@
-import io
+import hashlib
 import json
 import logging
 import os
 import shutil
 import traceback
 import typing
-import zipfile
+from datetime import datetime
 from typing import List, Optional
 
 import dramatiq
+import pytz
 from croniter import croniter
 import docker.errors
 from fastapi import UploadFile
 from sqlalchemy import ScalarResult, Select, ColumnElement, Sequence, func
 from sqlalchemy.exc import NoResultFound, SQLAlchemyError
+from starlette.requests import Request
 from starlette.responses import Response, StreamingResponse, FileResponse
 
 from src.enums import ImageStatus, JobStatus, AvailableScriptLanguages
 from src.factory import get_session, config
 from sqlmodel import select, Session, or_, col
-from src.db_models import DockerImage, DockerImageFiles, DockerScripts, DockerScheduled, DockerJobs
+from src.db_models import DockerImage, DockerImageFiles, DockerImageVersions, DockerScripts, DockerScheduled, DockerJobs, DockerJobsArchive, DockerScriptVersions, DockerScriptStats
 from src.factory.database import engine
-from src.helpful import securely_create_dir, save_file
+from src.helpful import securely_create_dir, check_upload_sizes, UploadBudget, UploadTooLarge
 from src.schemas import ScriptUpdate, ScheduleUpdate, UpdateImageForm
+from src.utils.archive import ArchiveEntry, file_entry, stream_tar_gz, stream_zip
+from src.utils.blob_store import blob_store
+from src.utils.pagination import COUNT_CACHE, CountCache, CountMode, InvalidCursor, paginate, split_page
+from src.utils.response_cache import response_cache, script_code as script_code_resource, IMAGES, SCRIPTS
+from src.utils.image_versions import snapshot_src
+from src.utils.script_versions import ScriptVersionStore, VersionNotFound, CorruptVersion
+from src.utils.build_progress import BuildProgress
 from src.utils.docker_manager import DockerManager, DockerfileNotFound
+from src.utils.garbage_collector import GarbageCollector
+from src.utils.events import event_bus, publish_job_event, stream_events, invalidate_cache, register_cache, JOB_TOPIC
+from src.utils.log_search import LogSearchIndex, InvalidSearchQuery, remove_from_search_index
+from src.utils.log_stream import stream_log, get_resume_position
+from src.utils.job_archiver import all_jobs_after
+from src.utils.job_logs import get_log_path, remove_log_files, get_log_files, compress_log, read_log_page, JobLogReader, LogNotTimestamped
 
 """
 ----- Images
@@ -61,8 +76,6 @@ from src.utils.docker_manager import DockerManager, DockerfileNotFound
  [X] Update script state (enabled, disabled)
 """
 
-# TODO: Add script version history data
-
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 handler = logging.StreamHandler()
@@ -70,6 +83,29 @@ handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)
 logger.addHandler(handler)
 
 
+# Disable caching and proxy buffering so Server-Sent Events reach the client as soon as they are written.
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# Totals of listings requested with count="cached", invalidated across API processes when the listed rows change.
+count_cache = CountCache(config.PAGINATION_COUNT_CACHE_SECONDS)
+register_cache(COUNT_CACHE, count_cache.invalidate)
+event_bus.add_listener(lambda event: count_cache.invalidate(("jobs", event["data"].get("script_id"))), topics={JOB_TOPIC})
+
+
+def on_job_finished(event: dict) -> None:
+    """
+    Finished jobs change their script's statistics shown in the scripts listing. Every API process hears the event and
+    derives the same version of the listing from it.
+    """
+    if event["action"] not in ("finished", "killed"):
+        return
+    token = hashlib.sha1("{}:{}:{}".format(event["data"].get("id"), event["action"], event["timestamp"]).encode("utf-8")).hexdigest()[:16]
+    response_cache.apply((SCRIPTS, token, event["timestamp"]))
+
+
+event_bus.add_listener(on_job_finished, topics={JOB_TOPIC})
+
+
 class InvalidImageStatus(Exception):
     """Raised when an invalid image status is encountered or an image status prevents the current process from running
     i.e., when status is NOT dormant but the build method was invoked"""
@@ -83,6 +119,13 @@ def log_event(level: int, message: str | None, resource_id: str | int | None, er
         log_object["resource_id"] = resource_id
     logger.log(level, json.dumps(log_object))
 
+def get_garbage_collection_report() -> Response:
+    """Return the report of the last garbage collector run, including the number of bytes it reclaimed."""
+    report = GarbageCollector.load_report()
+    if report is None:
+        return Response(status_code=404, content="Garbage collector has not run yet.")
+    return Response(status_code=200, content=json.dumps(report), media_type="application/json")
+
 # --------------------
 # Image Methods
 # --------------------
@@ -96,6 +139,11 @@ def create_image(name: str, description: str, dockerfile: UploadFile, supporting
     if dockerfile.size == 0 or dockerfile is None or len(dockerfile.filename.split(".")) != 1:
         return Response(status_code=422, content="Invalid dockerfile file provided")
 
+    try:
+        check_upload_sizes([dockerfile, *supporting])
+    except UploadTooLarge as e:
+        return Response(status_code=413, content=str(e))
+
     with Session(engine) as session:
         if not DockerImage.is_unique_name(name=name, session=session):
             return Response(status_code=409, content="Image name already exists")
@@ -110,17 +158,20 @@ def create_image(name: str, description: str, dockerfile: UploadFile, supporting
     os.makedirs(image_src_dir, exist_ok=False)
 
     final_paths = []
+    budget = UploadBudget()
 
-    # Save periodic.Dockerfile
-    dockerfile_path = os.path.join(image_src_dir, dockerfile.filename)
-    save_file(dockerfile_path, dockerfile)
-    final_paths.append(dockerfile_path)
-
-    # Save Supporting Files.
-    for s_file in supporting:
-        s_file_path = os.path.join(image_src_dir, s_file.filename)
-        save_file(s_file_path, s_file)
-        final_paths.append(s_file_path)
+    try:
+        # Save periodic.Dockerfile
+        dockerfile_path = os.path.join(image_src_dir, dockerfile.filename)
+        final_paths.append((dockerfile_path, blob_store.save_upload(dockerfile_path, dockerfile, budget)))
+
+        # Save Supporting Files.
+        for s_file in supporting:
+            s_file_path = os.path.join(image_src_dir, s_file.filename)
+            final_paths.append((s_file_path, blob_store.save_upload(s_file_path, s_file, budget)))
+    except UploadTooLarge as e:
+        shutil.rmtree(dir_path)
+        return Response(status_code=413, content=str(e))
 
     with Session(engine) as session:
         try:
@@ -128,10 +179,12 @@ def create_image(name: str, description: str, dockerfile: UploadFile, supporting
             session.add(di_record)
             session.commit()
 
-            for l in final_paths:
-                session.add(DockerImageFiles(image_id=image_id, filepath=os.path.basename(l)))
+            for l, digest in final_paths:
+                session.add(DockerImageFiles(image_id=image_id, filepath=os.path.basename(l), sha256=digest))
 
             session.commit()
+            invalidate_cache(COUNT_CACHE, ("images",))
+            response_cache.bump(IMAGES)
             return {"image_id": image_id}
         except Exception as e:
             logger.error("Failed to create Docker image", exc_info=e)
@@ -142,18 +195,32 @@ def create_image(name: str, description: str, dockerfile: UploadFile, supporting
 
 
 def get_images(page: int = 0, limit: int = 100, _id: Optional[str] = None, name: Optional[str] = None,
-               status: Optional[int] = None) -> dict:
+               status: Optional[int] = None, cursor: Optional[str] = None, count: CountMode = "exact") -> dict | Response:
     """
-    Returns a list of Docker images based on the provided parameters
+    Returns a list of Docker images based on the provided parameters, newest first.
 
-    :param page:
+    :param page: Ignored when a cursor is given.
     :param limit:
     :param _id:
     :param name:
     :param status:
+    :param cursor: next_cursor of the previous page.
+    :param count: How the total is determined, see `CountCache.count`.
     :return:
     """
-    statement = select(DockerImage)
+    try:
+        statement, total_query = images_query(limit, _id, name, status, cursor, page)
+    except InvalidCursor as e:
+        return Response(status_code=400, content=str(e))
+
+    with Session(engine) as session:
+        total = count_cache.count(session, total_query, count, ("images", _id, name, status))
+        res, next_cursor = split_page(session.exec(statement).all(), limit, key=lambda i: (i.created_at, i.id))
+        return images_page(res, page, limit, total, count, next_cursor)
+
+def images_query(limit: int, _id: Optional[str], name: Optional[str], status: Optional[int], cursor: Optional[str],
+                 page: int) -> typing.Tuple[Select, Select]:
+    """Statements selecting a page of the images matching the filters and counting all of them."""
     filters = []
     if _id is not None:
         filters.append(DockerImage.id == _id)
@@ -161,25 +228,24 @@ def get_images(page: int = 0, limit: int = 100, _id: Optional[str] = None, name:
         filters.append(DockerImage.name == name)
     if status is not None:
         filters.append(DockerImage.status == status)
-
-    if len(filters) > 0:
-        statement = statement.where(*filters)
-
-    with Session(engine) as session:
-        total_query = select(func.count(DockerImage.id))
-        total = session.exec(total_query if len(filters) == 0 else total_query.where(*filters)).one()
-        res = session.exec(statement.offset(page * limit).limit(limit)).all()
-        return {
-            "images": [{
-                "id": i.id,
-                "name": i.name,
-                "description": i.description,
-                "status": i.status_enum
-            } for i in res],
-            "page": page,
-            "limit": limit,
-            "total": total if total else 0,
-        }
+    statement = paginate(select(DockerImage).where(*filters), col(DockerImage.created_at), col(DockerImage.id), limit, cursor, page)
+    return statement, select(func.count(col(DockerImage.id))).where(*filters)
+
+def images_page(images: typing.Sequence[DockerImage], page: int, limit: int, total: Optional[int], count: CountMode,
+                next_cursor: Optional[str]) -> dict:
+    return {
+        "images": [{
+            "id": i.id,
+            "name": i.name,
+            "description": i.description,
+            "status": i.status_enum,
+            "version": i.version
+        } for i in images],
+        "page": page,
+        "limit": limit,
+        "total": total if total or count == "none" else 0,
+        "next_cursor": next_cursor,
+    }
 
 def get_image_dockerfile(image_id: str) -> Response | StreamingResponse:
     with Session(engine) as session:
@@ -241,24 +307,10 @@ def update_image(image_id: str, update_form: UpdateImageForm) -> Response:
         if image is None:
             return Response(status_code=404, content="Image with ID, {}, not found.".format(image_id))
 
-        # If image status is BUILD_SUCCESS allow only changing of name and description
-        if image.status == ImageStatus.BUILD_SUCCESS.value:
-            update = False
-            if update_form.name is not None:
-                update = True
-                if not DockerImage.is_unique_name(update_form.name, session=session):
-                    return Response(status_code=409, content="Image with given name already exists")
-                image.name = update_form.name
-            if update_form.description is not None:
-                update = True
-                image.description = update_form.description
-            if update:
-                session.add(image)
-                session.commit()
-            logger.info("Updated image: %s. Name/Description field was updated.", image.id)
-            return Response(status_code=204)
-        # Allow for update/changing of any value including files.
-        elif image.status in [ImageStatus.BUILD_FAILED.value, ImageStatus.DORMANT.value]:
+        # Allow for update/changing of any value including files. Builds work on a snapshot of the files taken when the
+        # build is requested, so the files of built or building images can be changed as well; the changes apply to
+        # the image's next version.
+        if image.status in [ImageStatus.BUILD_FAILED.value, ImageStatus.DORMANT.value, ImageStatus.BUILD_SUCCESS.value, ImageStatus.BUILDING.value]:
             # Update DB Files first
             update = False
             if update_form.name is not None:
@@ -275,13 +327,28 @@ def update_image(image_id: str, update_form: UpdateImageForm) -> Response:
             # Construct image src path
             image_src_dir = os.path.join(config.IMAGE_DIR, image.id, "src")
 
+            if update_form.dockerfile is not None and not os.path.exists(image_src_dir):
+                return Response(status_code=404, content="Image with ID, {}, not found.".format(image_id))
+
+            # Every upload is stored and checked against the size limits before any of the image's files are replaced
+            # or removed, so a rejected update leaves the image as it was. Blobs of a rejected update are left to the
+            # garbage collector.
+            try:
+                check_upload_sizes([update_form.dockerfile, *(update_form.added or [])])
+                budget = UploadBudget()
+                dockerfile_digest = blob_store.put_upload(update_form.dockerfile, budget) if update_form.dockerfile is not None else None
+                added_digests = [blob_store.put_upload(s_file, budget) for s_file in update_form.added or []]
+            except UploadTooLarge as e:
+                session.rollback()
+                return Response(status_code=413, content=str(e))
 
             # Update Dockerfile if required
-            if update_form.dockerfile is not None:
-                if not os.path.exists(image_src_dir):
-                    return Response(status_code=404, content="Image with ID, {}, not found.".format(image_id))
-                image_path = os.path.join(image_src_dir, "Dockerfile")
-                save_file(image_path, update_form.dockerfile)
+            if dockerfile_digest is not None:
+                blob_store.link(dockerfile_digest, os.path.join(image_src_dir, "Dockerfile"))
+                for f in DockerImageFiles.get_by_image_id(image_id, session=session):
+                    if f.filepath == "Dockerfile":
+                        f.sha256 = dockerfile_digest
+                        session.add(f)
 
             if update_form.removed is not None:
                 # Remove files that are to be deleted.
@@ -298,13 +365,15 @@ def update_image(image_id: str, update_form: UpdateImageForm) -> Response:
 
             if update_form.added is not None:
                 # Add files that are new
-                for s_file in update_form.added:
+                for s_file, digest in zip(update_form.added, added_digests):
                     s_file_path = os.path.join(image_src_dir, s_file.filename)
-                    save_file(s_file_path, s_file)
-                    session.add(DockerImageFiles(image_id=image.id, filepath=os.path.basename(s_file_path)))
+                    blob_store.link(digest, s_file_path)
+                    session.add(DockerImageFiles(image_id=image.id, filepath=os.path.basename(s_file_path), sha256=digest))
 
             # Submit changes to db
             session.commit()
+            invalidate_cache(COUNT_CACHE, ("images",))
+            response_cache.bump(IMAGES, SCRIPTS)
             return Response(status_code=204)
         else:
             return Response(status_code=500, content="Image could not be updated.")
@@ -328,62 +397,133 @@ def destroy_image(image_id: str):
             logger.error("Failed to disabled scheduled tasks for scripts using image with id: '{}'. Error: '{}'".format(image_id, str(e)))
             return Response(status_code=500, content="Something went wrong.")
         image.status = ImageStatus.DORMANT.value
+        image.version = None
         session.add(image)
         try:
             docker_manager = DockerManager()
-            docker_manager.delete_image_from_env(image.image_id)
+            # Every built version goes, there is nothing left to roll back to.
+            for version in DockerImageVersions.get_by_image_id(image_id, session):
+                if version.status == ImageStatus.BUILD_SUCCESS.value and version.docker_tag is not None:
+                    docker_manager.delete_image_from_env(version.docker_tag)
+                if version.status in [ImageStatus.BUILD_SUCCESS.value, ImageStatus.BUILD_FAILED.value]:
+                    version.status = ImageStatus.DORMANT.value
+                    session.add(version)
+            if image.image_id is not None:
+                docker_manager.delete_image_from_env(image.image_id)
             session.commit()
+            invalidate_cache(COUNT_CACHE, ("images",))
+            response_cache.bump(IMAGES)
             return Response(status_code=204)
         except Exception as e:
             logger.error("Failed to delete image with id: '{}'. Error: '{}'".format(image_id, str(e)))
             session.rollback()
             return Response(status_code=500, content="Something went wrong.")
 
-def build_image_before(image_id: str) -> Response | None:
+def build_image_before(image_id: str) -> int:
     """
-    Before attempting to build the image (within request context) ensure image exists and its status is Dormant.
+    Before attempting to build the image (within request context) ensure image exists and is not being built already,
+    then record the new version of the image from a snapshot of its current files.
     :param image_id:
-    :return:
+    :return: The version to build.
     """
     with Session(engine) as session:
         try:
+            # Locks the image's row, so concurrent requests cannot both start a build.
             image: DockerImage = session.exec(
-                typing.cast(Select, select(DockerImage).where(DockerImage.id == image_id))
+                typing.cast(Select, select(DockerImage).where(DockerImage.id == image_id).with_for_update())
             ).one()
         except NoResultFound as e:
             raise e
-        if image.status != ImageStatus.DORMANT.value:
-            raise InvalidImageStatus("Cannot build image. Image has to be DORMANT to be built.")
-        return None
+        # Builds whose worker crashed never finish, they would block the image's builds forever.
+        requested_before = int(datetime.now(tz=pytz.utc).timestamp()) - config.IMAGE_BUILD_TIMEOUT_SECONDS
+        expired = DockerImageVersions.expire_builds(image_id, requested_before, session)
+        if expired:
+            log_event(logging.WARNING, "Marked {} timed out build(s) as failed".format(len(expired)), resource_id=image_id)
+            if image.status == ImageStatus.BUILDING.value and not DockerImageVersions.is_building(image_id, session):
+                image.status = ImageStatus.BUILD_FAILED.value
+                session.add(image)
+        if image.status == ImageStatus.BUILDING.value or DockerImageVersions.is_building(image_id, session):
+            raise InvalidImageStatus("Cannot build image. A version of the image is being built already.")
+        latest = DockerImageVersions.get_latest(image_id, session)
+        version = latest.version + 1 if latest is not None else 1
+        snapshot_src(image_id, version)
+        session.add(DockerImageVersions(image_id=image_id, version=version))
+        session.commit()
+        return version
 
 
 @dramatiq.actor
-def build_image(image_id: str) -> None:
+def build_image(image_id: str, version: Optional[int] = None) -> None:
     try:
         docker_manager = DockerManager()
-        docker_manager.build_image(image_id)
-        logger.info(f"Successfully built image: {image_id}")
+        docker_manager.build_image(image_id, version)
+        logger.info(f"Finished build of image: {image_id}")
         return None
     except docker.errors.APIError as e:
         logger.error("Image build failed for ID '{}' with error: '{}'".format(image_id, str(e)))
-        with Session(engine) as session:
-            image = DockerImage.get_by_image_id(image_id, session)
-            image.status = ImageStatus.BUILD_FAILED.value
-            session.add(image)
-            session.commit()
+        DockerManager.fail_build(image_id, version)
         return None
     except DockerfileNotFound as de:
         logger.error("Dockerfile not found for image with ID '{}'".format(image_id))
         logger.error(str(de))
-        with Session(engine) as session:
-            # image = DockerImage.get_by_image_id(image_id, session)
-            image = DockerImage.get_by_id(image_id, session)
-            image.status = ImageStatus.BUILD_FAILED.value
-            session.add(image)
-            session.commit()
+        DockerManager.fail_build(image_id, version)
+        return None
+    except Exception:
+        # Any other error would leave the version building, blocking further builds of the image.
+        logger.error("Image build failed for ID '{}': {}".format(image_id, traceback.format_exc()))
+        DockerManager.fail_build(image_id, version)
         return None
 
-def get_image_build_logs(image_id: str, last_position: int = 0):
+
+def get_image_versions(image_id: str):
+    with Session(engine) as session:
+        image = DockerImage.get_by_id(image_id, session)
+        if image is None:
+            return Response(status_code=404, content="Image not found")
+        versions = DockerImageVersions.get_by_image_id(image_id, session)
+        content = {
+            "active_version": image.version,
+            "versions": [{**version.model_dump(), "status": ImageStatus.get_name(version.status).lower()} for version in versions]
+        }
+        return Response(status_code=200, content=json.dumps(content), media_type="application/json")
+
+def activate_image_version(image_id: str, version: Optional[int] = None):
+    """
+    Switch the image to an earlier built version, without rebuilding. Jobs started from then on run on that version.
+    :param version: Version to switch to, the newest built version older than the active one if not given.
+    """
+    with Session(engine) as session:
+        image = session.exec(typing.cast(Select, select(DockerImage).where(DockerImage.id == image_id).with_for_update())).first()
+        if image is None:
+            return Response(status_code=404, content="Image not found")
+        if version is not None:
+            target = DockerImageVersions.get(image_id, version, session)
+        elif image.version is not None:
+            target = DockerImageVersions.get_previous_built(image_id, image.version, session)
+        else:
+            target = None
+        if target is None:
+            return Response(status_code=404, content="No version of the image to switch to.")
+        if target.status != ImageStatus.BUILD_SUCCESS.value or target.docker_image_id is None:
+            return Response(status_code=409, content="Version {} of the image is not built.".format(target.version))
+        if not DockerManager().image_exists(target.docker_image_id):
+            return Response(status_code=409, content="Version {} of the image is no longer in the docker environment.".format(target.version))
+
+        image.image_id = target.docker_image_id
+        image.version = target.version
+        image.status = ImageStatus.BUILD_SUCCESS.value
+        session.add(image)
+        session.commit()
+        invalidate_cache(COUNT_CACHE, ("images",))
+        response_cache.bump(IMAGES)
+        log_event(logging.INFO, "Switched image to version {}".format(target.version), resource_id=image_id)
+        return Response(status_code=200, content=json.dumps({"image_id": image_id, "active_version": target.version}), media_type="application/json")
+
+def get_image_build_logs(image_id: str, last_position: int = 0, tail: Optional[int] = None, before: Optional[int] = None,
+                         max_bytes: Optional[int] = None, max_lines: Optional[int] = None, line: Optional[int] = None):
+    """
+    Fetch a bounded page of an image's build log, see `read_log_page`.
+    """
     try:
         # Check it exists in DB
         with Session(engine) as session:
@@ -396,18 +536,65 @@ def get_image_build_logs(image_id: str, last_position: int = 0):
             if not os.path.exists(logs_path):
                 return Response(status_code=404, content="Failed to get build logs. Logs not found.")
 
-            with open(logs_path, 'r') as log_file:
-                log_file.seek(last_position)
-                new_lines = log_file.readlines()
-                new_position = log_file.tell()
-            return Response(status_code=200, content=json.dumps({"image": image_id, "lines": new_lines, "new_position": new_position, "status": image.status_enum.name.lower()}), media_type="application/json")
+            # Builds append to build.log without maintaining a line index.
+            page = read_log_page(logs_path, last_position, tail=tail, before=before, max_bytes=max_bytes, max_lines=max_lines, line=line,
+                                 line_index=False)
+            return Response(status_code=200, content=json.dumps({"image": image_id, **page, "status": image.status_enum.name.lower()}), media_type="application/json")
     except FileNotFoundError as de:
         return Response(status_code=404, content=str(de))
 
+def stream_image_build_logs(image_id: str, request: Request, last_position: int = 0) -> Response | StreamingResponse:
+    """
+    Stream an image's build log as Server-Sent Events until the build has either succeeded or failed. A build whose log
+    is quiet for a while (e.g. a long running step) keeps the stream open with keep-alive comments.
+    """
+    with Session(engine) as session:
+        if DockerImage.get_by_id(image_id, session) is None:
+            return Response(status_code=404, content="Image not found")
+    log_path = os.path.join(config.IMAGE_DIR, image_id, "build.log")
+
+    def resolve():
+        with Session(engine) as _session:
+            image = DockerImage.get_by_id(image_id, _session)
+            if image is None:
+                return None, True, None
+            # An image serving jobs keeps its status whilst a new version builds, the build is tracked by its version.
+            image_version = DockerImageVersions.get_latest(image_id, _session)
+            if image_version is None:
+                return image.status_enum.name.lower(), image.status != ImageStatus.BUILDING.value, log_path
+            return ImageStatus.get_name(image_version.status).lower(), image_version.status != ImageStatus.BUILDING.value, log_path
+
+    return StreamingResponse(
+        stream_log(request, resolve, position=get_resume_position(request, last_position),
+                   poll_interval=config.LOG_STREAM_POLL_INTERVAL, status_interval=config.LOG_STREAM_STATUS_INTERVAL,
+                   idle_timeout=config.LOG_STREAM_IDLE_TIMEOUT),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+def get_image_build_steps(image_id: str) -> Response:
+    """
+    Fetch the structured progress of the image's latest build: one record per Dockerfile step with its instruction,
+    whether the layer cache was used, its duration and the bytes pulled while it ran.
+    :param image_id:
+    :return:
+    """
+    with Session(engine) as session:
+        image = DockerImage.get_by_id(image_id, session)
+        if image is None:
+            return Response(status_code=404, content="Image not found")
+        build_steps = BuildProgress.load(os.path.join(config.IMAGE_DIR, image_id, "build_steps.json"))
+        if build_steps is None:
+            return Response(status_code=404, content="No build progress found for image.")
+        return Response(status_code=200, content=json.dumps({"image": image_id, "status": image.status_enum.name.lower(), **build_steps}), media_type="application/json")
+
 def delete_image(image_id: str):
     try:
         docker_manager = DockerManager()
         docker_manager.delete_image(image_id)
+        # Removes the image's scripts and schedules as well.
+        invalidate_cache(COUNT_CACHE)
+        response_cache.bump(IMAGES, SCRIPTS)
         log_event(logging.INFO, "Successfully deleted image with ID '{}'".format(image_id), resource_id=image_id)
         return Response(status_code=200)
     except TypeError as e:  # Raised when provided ID is an invalid type. Generally 'NoneType'
@@ -419,6 +606,17 @@ def delete_image(image_id: str):
         log_event(logging.ERROR, "Failed to delete image with ID '{}'".format(image_id), error=traceback.format_exc(), resource_id=image_id)
         return Response(status_code=500, content="Cannot delete image")
 
+def get_image_file_path(image_id: str, filepath: str) -> Optional[str]:
+    """
+    Absolute path of an image file. DockerImageFiles.filepath holds the file's name within the image's src directory.
+    :return: The path, or None if it would resolve outside of the image's src directory.
+    """
+    image_src_dir = os.path.normpath(os.path.join(config.IMAGE_DIR, image_id, "src"))
+    file_path = os.path.normpath(os.path.join(image_src_dir, filepath))
+    if os.path.commonpath([image_src_dir, file_path]) != image_src_dir:
+        return None
+    return file_path
+
 def get_image_files(image_id: str) -> Response:
     with Session(engine) as session:
         image = DockerImage.get_by_id(image_id, session)
@@ -427,39 +625,38 @@ def get_image_files(image_id: str) -> Response:
         files = DockerImageFiles.get_by_image_id(image_id, session)
 
         def get_size(path):
-            return os.path.getsize(path) if os.path.isfile(path) else 0
-        return Response(status_code=200, content=json.dumps({"files": [{**file.model_dump(exclude={"filepath"}), "name": os.path.basename(file.filepath) if file.filepath is not None else None, "size": get_size(file.filepath)} for file in files]}), media_type="application/json")
-
-def create_zip_stream(file_paths: typing.List[str]) -> io.BytesIO:
-    buffer = io.BytesIO()
-    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-        for path in file_paths:
-            zip_file.write(path, arcname=os.path.basename(path))
-    buffer.seek(0)
-    return buffer
-
-def download_image_file(image_id: str, file_id: typing.List[int]) -> Response:
-    MAX_SIZE_BYTES = 10 * 1024 * 1024 # 10 MB
+            return os.path.getsize(path) if path is not None and os.path.isfile(path) else 0
+        return Response(status_code=200, content=json.dumps({"files": [{**file.model_dump(exclude={"filepath"}), "name": os.path.basename(file.filepath) if file.filepath is not None else None, "size": get_size(get_image_file_path(image_id, file.filepath))} for file in files]}), media_type="application/json")
+
+def download_image_file(image_id: str, file_id: typing.List[int], store_compressed: bool = True) -> Response:
+    """
+    Download image files. A single file is sent as is, several files are streamed as a ZIP archive that is compressed
+    on the fly, so memory use doesn't depend on the size of the download.
+    :param image_id:
+    :param file_id: IDs of the files to download.
+    :param store_compressed: Store files that are compressed already (archives, images, ...) without deflating them.
+    :return:
+    """
+    if not file_id:
+        return Response(status_code=400, content="No files requested.")
     # Ensure file ids exist
     with Session(engine) as session:
         files = DockerImageFiles.get_all_by_id(file_id, session)
+        if len(files) != len(set(file_id)):
+            return Response(status_code=404, content="File not found")
+
+        file_paths = []
         for f in files:
-            if f.image_id != image_id:
+            file_path = get_image_file_path(image_id, f.filepath)
+            if f.image_id != image_id or file_path is None or not os.path.isfile(file_path):
                 return Response(status_code=404, content="File not found for provided image.")
-            if not os.path.exists(f.filepath):
-                return Response(status_code=404, content="File not found for provided image.")
-
-        if len(files) != len(file_id):
-            return Response(status_code=404, content="File not found")
+            file_paths.append(file_path)
 
-        if len(files) == 1:
-            file = files[0]
-            if os.path.exists(file.filepath):
-                if os.path.getsize(file.filepath) <= MAX_SIZE_BYTES:
-                    return FileResponse(file.filepath, filename=os.path.basename(file.filepath), media_type="application/octet-stream")
+    if len(file_paths) == 1:
+        return FileResponse(file_paths[0], filename=os.path.basename(file_paths[0]), media_type="application/octet-stream")
 
-        zip_stream = create_zip_stream([f.filepath for f in files])
-        return StreamingResponse(zip_stream, status_code=200, media_type="application/zip", headers={"Content-Disposition": f"attachment; filename=image_files_{image_id}.zip"})
+    zip_stream = stream_zip(file_entry(path, store_compressed=store_compressed) for path in file_paths)
+    return StreamingResponse(zip_stream, status_code=200, media_type="application/zip", headers={"Content-Disposition": f"attachment; filename=image_files_{image_id}.zip"})
 
 # --------------------
 # Script Methods
@@ -471,56 +668,85 @@ def get_scripts(
         _id: Optional[str] = None,
         name: Optional[str] = None,
         image: Optional[str] = None,
-        is_deleted: Optional[bool] = False) -> dict:
+        is_deleted: Optional[bool] = False,
+        cursor: Optional[str] = None,
+        count: CountMode = "exact") -> dict | Response:
     """
     :param is_deleted:
-    :param page:
+    :param page: Ignored when a cursor is given.
     :param limit:
     :param _id:
     :param name:
     :param image: Filter param for either image ID or image Name
+    :param cursor: next_cursor of the previous page.
+    :param count: How the total is determined, see `CountCache.count`.
 
     :return:
     """
-    where_statements: typing.List[ColumnElement[bool]] = [col(DockerScripts.deleted).is_not(not is_deleted)]
-    query = select(DockerScripts, DockerImage.name, DockerImage.status).join(DockerImage, typing.cast(ColumnElement,
-                                                                                  DockerImage.id == DockerScripts.image_id))
-
     if _id is not None:
         with Session(engine) as session:
-            result: Optional[tuple[DockerScripts, str, int]] = session.exec(query.where(
-                typing.cast(ColumnElement[bool], or_(DockerScripts.id == _id)))).first()
-            if result is None:
-                return {"script": None}
-            script, image_name, image_status = result
-            return {"script": {**script.model_dump(mode="json"), "image_name": image_name, "image_status": image_status}}
+            return script_details(session.exec(script_query(_id)).first())
+
+    try:
+        query, total_query = scripts_query(limit, name, image, is_deleted, cursor, page)
+    except InvalidCursor as e:
+        return Response(status_code=400, content=str(e))
 
+    with Session(engine) as session:
+        results, next_cursor = split_page(session.exec(query).all(), limit, key=lambda r: (r[0].created_at, r[0].id))
+        total = count_cache.count(session, total_query, count, ("scripts", name, image, is_deleted))
+        return scripts_page(results, page, limit, total, next_cursor)
+
+def script_query(_id: str) -> Select:
+    """Statement selecting a script with its image's name and status, and its run statistics."""
+    return select(DockerScripts, DockerImage.name, DockerImage.status, DockerScriptStats).join(
+        DockerImage, typing.cast(ColumnElement, DockerImage.id == DockerScripts.image_id)).outerjoin(
+        DockerScriptStats, typing.cast(ColumnElement, DockerScriptStats.script_id == DockerScripts.id)).where(
+        typing.cast(ColumnElement[bool], DockerScripts.id == _id))
+
+def script_details(result: Optional[typing.Tuple[DockerScripts, str, int, Optional[DockerScriptStats]]]) -> dict:
+    if result is None:
+        return {"script": None}
+    script, image_name, image_status, stats = result
+    return {"script": {**script.model_dump(mode="json"), "image_name": image_name, "image_status": image_status,
+                       "stats": stats.summary() if stats is not None else None}}
+
+def scripts_query(limit: int, name: Optional[str], image: Optional[str], is_deleted: Optional[bool], cursor: Optional[str],
+                  page: int) -> typing.Tuple[Select, Select]:
+    """Statements selecting a page of the scripts matching the filters and counting all of them."""
+    where_statements: typing.List[ColumnElement[bool]] = [col(DockerScripts.deleted) == bool(is_deleted)]
     if image is not None:
         where_statements.append(
             or_(typing.cast(ColumnElement, DockerImage.id == DockerScripts.image_id), col(DockerImage.name).ilike(f"%{image}%"))
         )
-
     if name is not None:
         where_statements.append(col(DockerScripts.name).ilike(f"%{name}%"))
 
-    with Session(engine) as session:
-
-        total_query = select(func.count(col(DockerScripts.id)))
-
-        for where_statement in where_statements:
-            query = query.where(where_statement)
-            total_query = total_query.where(where_statement)
+    on_image = typing.cast(ColumnElement, DockerImage.id == DockerScripts.image_id)
+    on_stats = typing.cast(ColumnElement, DockerScriptStats.script_id == DockerScripts.id)
+    query = select(DockerScripts, DockerImage.name, DockerImage.status, DockerScriptStats).join(DockerImage, on_image).outerjoin(
+        DockerScriptStats, on_stats).where(*where_statements)
+    total_query = select(func.count(col(DockerScripts.id))).join(DockerImage, on_image).where(*where_statements)
+    return paginate(query, col(DockerScripts.created_at), col(DockerScripts.id), limit, cursor, page), total_query
 
-        results = session.exec(query.limit(limit).offset(limit * page)).all()
-
-        total = session.exec(total_query).one()
+def scripts_page(results: typing.Sequence[typing.Tuple[DockerScripts, str, int, Optional[DockerScriptStats]]], page: int,
+                 limit: int, total: Optional[int], next_cursor: Optional[str]) -> dict:
+    return {
+        "page": page,
+        "limit": limit,
+        "total": total,
+        "next_cursor": next_cursor,
+        "scripts": [{**s.model_dump(exclude=["deleted"]), "image_name": i, "stats": stats.summary() if stats is not None else None}
+                    for s, i, _, stats in results]
+    }
 
-        return {
-            "page": page,
-            "limit": limit,
-            "total": total,
-            "scripts": [{**s.model_dump(exclude=["deleted"]), "image_name": i} for s, i in results]
-        }
+def get_script_stats(script_id: str) -> Response:
+    with Session(engine) as session:
+        if not DockerScripts.exists(script_id, session=session):
+            return Response(status_code=404, content="Script not found")
+        stats = DockerScriptStats.get_by_script_id(script_id, session)
+        content = stats.details() if stats is not None else DockerScriptStats(script_id=script_id).details()
+        return Response(status_code=200, content=json.dumps(content), media_type="application/json")
 
 
 
@@ -537,6 +763,11 @@ def create_script(name: str, image_id: str, description: str, language: str, scr
     if script_code is None or script_code.size == 0:
         return Response(status_code=422, content="Invalid script file provided")
 
+    try:
+        check_upload_sizes([script_code])
+    except UploadTooLarge as e:
+        return Response(status_code=413, content=str(e))
+
     with Session(engine) as session:
         if not DockerScripts.is_unique_name(name, session):
             return Response(status_code=409, content="Script already exists with this name!")
@@ -559,17 +790,23 @@ def create_script(name: str, image_id: str, description: str, language: str, scr
 
         try:
             # Save file to src directory
-            save_file(script_path, script_code)
+            digest = blob_store.save_upload(script_path, script_code)
 
             # Add script details to the database
             with Session(engine) as session:
-                script = DockerScripts(id=script_id, name=name, description=description, image_id=image_id, language=language)
+                script = DockerScripts(id=script_id, name=name, description=description, image_id=image_id, language=language,
+                                       code_sha256=digest)
                 session.add(script)
+                with open(script_path, "rb") as f:
+                    ScriptVersionStore(script_id).add(script, f.read(), session)
                 session.commit()
                 session.refresh(script)
-
-                # TODO: Add Script Version history here.
+                invalidate_cache(COUNT_CACHE, ("scripts",))
+                response_cache.bump(SCRIPTS)
                 return Response(status_code=200, content=json.dumps(script.model_dump(mode="json")))
+        except UploadTooLarge as e:
+            shutil.rmtree(dir_path)
+            return Response(status_code=413, content=str(e))
         except Exception as de:
             log_event(logging.ERROR, "Failed to create script with ID '{}'".format(script_id), resource_id=script_id, error=str(de))
             if os.path.exists(dir_path):
@@ -592,6 +829,8 @@ def delete_script(script_id: str):
             else:
                 DockerScripts.mark_as_deleted(_id=script_id, session=session)
                 session.commit()
+                invalidate_cache(COUNT_CACHE, ("scripts",))
+                response_cache.bump(SCRIPTS, script_code_resource(script_id))
                 return Response(status_code=204)
     except Exception as e:
         log_event(logging.ERROR, "Failed to delete script", resource_id=script_id, error=str(e))
@@ -609,6 +848,7 @@ def before_run_script(script_id: str, session: Session) -> DockerJobs:
     session.add(job_object)
     session.commit()
     session.refresh(job_object)
+    publish_job_event(job_object, "created")
     return job_object
 
 def run_script(script_id: str) -> Response:
@@ -659,37 +899,46 @@ def update_script_info(script_id: str, item_update: ScriptUpdate):
         if item_update.language is not None and not AvailableScriptLanguages.is_valid_language(item_update.language):
             return Response(status_code=422, content="Invalid language '{}'".format(item_update.language))
 
+        for cap in (item_update.log_head_bytes, item_update.log_tail_bytes):
+            if cap is not None and cap < 0:
+                return Response(status_code=422, content="Log size caps cannot be negative.")
+
         update_data = item_update.model_dump(exclude_unset=True)
         for key, value in update_data.items():
             setattr(script_object, key, value)
         session.add(script_object)
         session.commit()
         session.refresh(script_object)
+        invalidate_cache(COUNT_CACHE, ("scripts",))
+        response_cache.bump(SCRIPTS)
 
         #  TODO: Add script version history record update here for modified.
         return Response(status_code=200, content=json.dumps(script_object.model_dump(mode="json")), media_type="application/json")
 
 # ----- script code methods -----
 
-def get_script_code(script_id) -> Response | StreamingResponse:
+def get_script_code_path(script_id: str) -> str:
+    return os.path.join(config.SCRIPT_DIR, script_id, "src/script")
+
+def get_script_code(script_id) -> Response:
     with Session(engine) as session:
         script_object = DockerScripts.get_by_id(script_id, session=session)
         if script_object is None:
             return Response(status_code=404, content="Script not found")
-        script_path = os.path.join(config.SCRIPT_DIR, script_object.id, "src/script")
+        script_path = get_script_code_path(script_object.id)
 
         if not os.path.exists(script_path):
             return Response(status_code=404, content="Script not found")
 
-        def generate_code():
-            with open(script_path) as f:
-                yield f.read().encode("utf-8")
-
-        return StreamingResponse(content=generate_code(), media_type="text")
+        with open(script_path, "rb") as f:
+            return Response(content=f.read(), media_type="text")
 
 def update_script_code(script_id: str, script_code: UploadFile):
     with Session(engine) as session:
-        if not DockerScripts.exists(script_id, session=session):
+        # Locks the script's row, so concurrent updates are numbered and stored one after the other.
+        script = session.exec(typing.cast(Select, select(DockerScripts).where(
+            DockerScripts.id == script_id, col(DockerScripts.deleted).is_(False)).with_for_update())).first()
+        if script is None:
             return Response(status_code=404, content="Script not found")
         if script_code is None or script_code.size == 0:
             return Response(status_code=422, content="Invalid script file provided")
@@ -697,11 +946,65 @@ def update_script_code(script_id: str, script_code: UploadFile):
         if not os.path.exists(overwrite_path):
             return Response(status_code=404, content="Script file not found")
         try:
-            save_file(overwrite_path, script_code)
+            versions = ScriptVersionStore(script_id)
+            if script.version is None:
+                # Code saved before scripts were versioned becomes their first version.
+                with open(overwrite_path, "rb") as f:
+                    versions.add(script, f.read(), session)
+            current = DockerScriptVersions.get(script_id, script.version, session)
+            digest = blob_store.save_upload(overwrite_path, script_code)
+            if current is None or current.sha256 != digest:
+                with open(overwrite_path, "rb") as f:
+                    versions.add(script, f.read(), session)
+            script.code_sha256 = digest
+            session.add(script)
+            session.commit()
+        except UploadTooLarge as e:
+            return Response(status_code=413, content=str(e))
         except Exception:
             log_event(logging.ERROR, "Failed to update script code", resource_id=script_id, error=traceback.format_exc())
             return Response(status_code=500, content="Failed to update script code")
-        return Response(status_code=204)
+    # Bumped once the new code is committed, a failure to bump must not report the update as failed.
+    response_cache.bump(SCRIPTS, script_code_resource(script_id))
+    return Response(status_code=204)
+
+def get_script_versions(script_id: str, page: int = 0, limit: int = 100):
+    with Session(engine) as session:
+        script = DockerScripts.get_by_id(script_id, session=session)
+        if script is None:
+            return Response(status_code=404, content="Script not found")
+        versions = DockerScriptVersions.get_by_script_id(script_id, page=page, limit=limit, session=session)
+        content = {
+            "current_version": script.version,
+            "versions": [version.model_dump(exclude={"offset", "length"}) for version in versions]
+        }
+        return Response(status_code=200, content=json.dumps(content), media_type="application/json")
+
+def get_script_version_code(script_id: str, version: int):
+    with Session(engine) as session:
+        if not DockerScripts.exists(script_id, session=session):
+            return Response(status_code=404, content="Script not found")
+        try:
+            code = ScriptVersionStore(script_id).read(version, session)
+        except VersionNotFound as e:
+            return Response(status_code=404, content=str(e))
+        except CorruptVersion as e:
+            log_event(logging.ERROR, "Failed to read script version", resource_id=script_id, error=str(e))
+            return Response(status_code=500, content="Script version could not be read")
+        return Response(status_code=200, content=code, media_type="text")
+
+def diff_script_versions(script_id: str, from_version: int, to_version: int, context: int = 3):
+    with Session(engine) as session:
+        if not DockerScripts.exists(script_id, session=session):
+            return Response(status_code=404, content="Script not found")
+        try:
+            diff = ScriptVersionStore(script_id).diff(from_version, to_version, session, context=context)
+        except VersionNotFound as e:
+            return Response(status_code=404, content=str(e))
+        except CorruptVersion as e:
+            log_event(logging.ERROR, "Failed to read script version", resource_id=script_id, error=str(e))
+            return Response(status_code=500, content="Script version could not be read")
+        return Response(status_code=200, content=diff, media_type="text/x-diff")
 
 
 # --------------------
@@ -712,35 +1015,43 @@ def get_schedule(
         page: int = 0,
         limit: int = 100,
         _id: Optional[str] = None,
-        script_id: Optional[str] = None) -> Response | dict:
-    where_statements = []
-    query = select(DockerScheduled)
-
+        script_id: Optional[str] = None,
+        cursor: Optional[str] = None,
+        count: CountMode = "exact") -> Response | dict:
     if _id is not None:
         with Session(engine) as session:
             result: Optional[DockerScheduled] = session.exec(
-                typing.cast(Select, query.where(DockerScheduled.id == _id))).first()
-            return Response(status_code=200,
-                            content={"schedule": {**result.model_dump()}} if result is not None else {"schedule": None})
+                typing.cast(Select, select(DockerScheduled).where(DockerScheduled.id == _id))).first()
+            return {"schedule": result.model_dump() if result is not None else None}
 
-    if script_id is not None:
-        where_statements.append(DockerScheduled.script_id == script_id)
+    try:
+        query, total_query = schedules_query(limit, script_id, cursor, page)
+    except InvalidCursor as e:
+        return Response(status_code=400, content=str(e))
 
     with Session(engine) as session:
-        total_query = select(func.count(col(DockerScheduled.id)))
-
-        for where_statement in where_statements:
-            query = query.where(where_statement)
-            total_query = total_query.where(where_statement)
+        results, next_cursor = split_page(session.exec(query).all(), limit, key=lambda i: (i.created_at, i.id))
+        total = count_cache.count(session, total_query, count, ("schedules", script_id))
+        return schedules_page(results, page, limit, total, next_cursor)
 
-        results = session.exec(query.limit(limit).offset(limit * (page))).all()
+def schedules_query(limit: int, script_id: Optional[str], cursor: Optional[str], page: int) -> typing.Tuple[Select, Select]:
+    """Statements selecting a page of the schedules matching the filters and counting all of them."""
+    where_statements = []
+    if script_id is not None:
+        where_statements.append(DockerScheduled.script_id == script_id)
+    query = paginate(select(DockerScheduled).where(*where_statements), col(DockerScheduled.created_at), col(DockerScheduled.id),
+                     limit, cursor, page)
+    return query, select(func.count(col(DockerScheduled.id))).where(*where_statements)
 
-        return {
-            "page": page,
-            "limit": limit,
-            "total": session.exec(total_query).one() if total_query is not None else len(results),
-            "schedules": [i.model_dump() for i in results]
-        }
+def schedules_page(results: typing.Sequence[DockerScheduled], page: int, limit: int, total: Optional[int],
+                   next_cursor: Optional[str]) -> dict:
+    return {
+        "page": page,
+        "limit": limit,
+        "total": total,
+        "next_cursor": next_cursor,
+        "schedules": [i.model_dump() for i in results]
+    }
 
 
 def create_schedule(
@@ -771,6 +1082,7 @@ def create_schedule(
         session.add(schedule)
         session.commit()
         session.refresh(schedule)
+        invalidate_cache(COUNT_CACHE, ("schedules",))
 
     return Response(status_code=200, content=json.dumps({"schedule": schedule.model_dump()}), media_type="application/json")
 
@@ -814,6 +1126,7 @@ def update_schedule(
         session.add(schedule)
         session.commit()
         session.refresh(schedule)
+        invalidate_cache(COUNT_CACHE, ("schedules",))
 
         return Response(status_code=204)
 
@@ -832,6 +1145,7 @@ def delete_schedule(schedule_id: int = None) -> Response:
                 return Response(status_code=200)
             session.delete(schedule)
             session.commit()
+            invalidate_cache(COUNT_CACHE, ("schedules",))
             logger.info("Successfully deleted schedule with ID:  '{}'.".format(schedule_id))
             return Response(status_code=200, content="Successfully deleted schedule")
     except TypeError as e:
@@ -846,56 +1160,223 @@ def delete_schedule(schedule_id: int = None) -> Response:
 # Job Methods
 # --------------------
 
-def get_script_jobs(script_id: str, page: int = 0, limit: int = 100, status: Optional[int] = None) -> Response:
-    """Fetch all jobs related to a given script. Enforce pagination rules.
+def get_script_jobs(script_id: str, page: int = 0, limit: int = 100, status: Optional[int] = None, cursor: Optional[str] = None,
+                    count: CountMode = "exact", archived: bool = False) -> Response:
+    """Fetch all jobs related to a given script, newest first. Enforce pagination rules.
     :param script_id: ID of the script to query for.
-    :param page: Page number.
+    :param page: Page number. Ignored when a cursor is given.
     :param limit: Limit the number of jobs.
     :param status: Filter jobs by this status.
+    :param cursor: next_cursor of the previous page.
+    :param count: How the total is determined, see `CountCache.count`.
+    :param archived: List the jobs moved to the archive by the job archiver instead.
     :return: Response
     """
+    model = DockerJobsArchive if archived else DockerJobs
     with Session(engine) as session:
-        jobs = DockerJobs.get_by_script_id(script_id, page, limit, status, session)
-        total_query = select(func.count(col(DockerJobs.id))).where(DockerJobs.script_id == script_id)
-        total = session.exec(typing.cast("Select", total_query)).one()
+        try:
+            jobs, next_cursor = model.get_by_script_id(script_id, page, limit, status, session, cursor=cursor)
+        except InvalidCursor as e:
+            return Response(status_code=400, content=str(e))
+        total = count_cache.count(session, script_jobs_count_query(script_id, status, archived), count,
+                                  ("jobs", script_id, status, archived))
+    return script_jobs_response(jobs, page, limit, total, next_cursor)
+
+def script_jobs_count_query(script_id: str, status: Optional[int], archived: bool = False) -> Select:
+    model = DockerJobsArchive if archived else DockerJobs
+    total_query = select(func.count(col(model.id))).where(model.script_id == script_id)
+    if status:
+        total_query = total_query.where(model.status == status)
+    return typing.cast("Select", total_query)
+
+def script_jobs_response(jobs: typing.Sequence[DockerJobs | DockerJobsArchive], page: int, limit: int, total: Optional[int],
+                         next_cursor: Optional[str]) -> Response:
     return Response(status_code=200, content=json.dumps({
         "history": [job.model_dump(exclude={"logs"}) for job in jobs],
         "page": page,
         "limit": limit,
-        "total": total
+        "total": total,
+        "next_cursor": next_cursor
     }), media_type="application/json")
 
-def get_job_logs(job_id: int, last_position: int = 0) -> Response:
+def export_script_logs(script_id: str, archive_format: str = "tar.gz", status: Optional[int] = None, since: Optional[int] = None,
+                       until: Optional[int] = None, after_job_id: Optional[int] = None) -> Response:
     """
-    Fetch all logs related to a given job. Use last position to avoid re-reading the whole file while streaming.
+    Stream an archive of the logs of a script's finished jobs, built on the fly with constant memory. Jobs are added in
+    ascending ID order, so an interrupted download is resumed by passing the ID of the last complete job as after_job_id.
+    :param script_id:
+    :param archive_format: "tar.gz" or "zip".
+    :param status: Only jobs with this status.
+    :param since: Only jobs created at or after this UNIX timestamp.
+    :param until: Only jobs created at or before this UNIX timestamp.
+    :param after_job_id: Only jobs with a greater ID.
+    :return:
+    """
+    with Session(engine) as session:
+        if DockerScripts.get_by_id(script_id, session) is None:
+            return Response(status_code=404, content="Script not found.")
+
+    terminal = [i.value for i in JobStatus.get_deletable()]
+    if status is not None and status not in terminal:
+        return Response(status_code=400, content="Only the logs of finished jobs can be exported.")
+
+    def where(model) -> list:
+        conditions = [model.script_id == script_id, col(model.logs).is_not(None),
+                      col(model.status).in_([status] if status is not None else terminal)]
+        if since is not None:
+            conditions.append(model.created_at >= since)
+        if until is not None:
+            conditions.append(model.created_at <= until)
+        return conditions
+
+    def jobs() -> typing.Iterator:
+        # Jobs are fetched in batches by keyset, so the list of jobs isn't held in memory either. Archived jobs are
+        # exported alongside the others.
+        last_id = after_job_id or 0
+        while True:
+            with Session(engine) as session:
+                batch = all_jobs_after(last_id, 500, session, where)
+            if len(batch) == 0:
+                return
+            yield from batch
+            last_id = batch[-1].id
+
+    def entries() -> typing.Iterator[ArchiveEntry]:
+        for job in jobs():
+            reader = JobLogReader(get_log_path(job.script_id, job.logs))
+            if not reader.exists():
+                continue
+            parts = reader.content_parts()
+            name = "{}/job_{}_{}.log".format(script_id, job.id, JobStatus(job.status).name.lower())
+            yield ArchiveEntry(name, lambda reader=reader, parts=parts: reader.iter_content(parts), size=reader.content_size(parts),
+                               mtime=job.finished_at or job.created_at)
+
+    filename = "logs_{}{}.{}".format(script_id, "_after_{}".format(after_job_id) if after_job_id else "", archive_format)
+    if archive_format == "zip":
+        content, media_type = stream_zip(entries()), "application/zip"
+    else:
+        content, media_type = stream_tar_gz(entries()), "application/gzip"
+    return StreamingResponse(content, status_code=200, media_type=media_type, headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+def get_job_logs(job_id: int, last_position: int = 0, tail: Optional[int] = None, before: Optional[int] = None,
+                 max_bytes: Optional[int] = None, max_lines: Optional[int] = None, line: Optional[int] = None,
+                 since: Optional[float] = None, until: Optional[float] = None, stream: Optional[str] = None) -> Response:
+    """
+    Fetch a bounded page of a job's logs. Use last position to avoid re-reading the whole file while streaming.
     :param job_id:
-    :param last_position:
+    :param last_position: Position to read forwards from.
+    :param tail: Read the last N lines (before `before`) instead of reading forwards.
+    :param before: Position the tail ends at, the end of the log by default. Used to page backwards.
+    :param max_bytes: Maximum bytes of output to return, capped to LOG_READ_MAX_BYTES.
+    :param max_lines: Maximum lines of output to return, capped to LOG_READ_MAX_LINES.
+    :param line: Read forwards from this line number (0 based) instead of from last_position.
+    :param since: Read forwards from the first line written at or after this UNIX timestamp (timestamped logs only).
+    :param until: Stop at the first line written at or after this UNIX timestamp (timestamped logs only).
+    :param stream: Only return the lines written to "stdout" or "stderr" (timestamped logs only).
     :return:
     """
     log_event(logging.INFO, message="Fetching job logs for job: '{}' from position: '{}'".format(job_id, last_position), resource_id=job_id)
     with (Session(engine) as session):
-        job_object = DockerJobs.get_by_id(job_id, session=session)
+        job_object = DockerJobs.get_by_id(job_id, session=session) or DockerJobsArchive.get_by_id(job_id, session=session)
         if job_object is None:
             log_event(logging.WARNING,
                       message="Job with ID: '{}' doesn't exist".format(job_id),
                       resource_id=job_id)
             return Response(status_code=404, content="Job doesn't exist.")
-        log_file = job_object.logs
-
-        if log_file is None:
-            return Response(status_code=404, content="No logs found.")
-        log_file = os.path.join(config.SCRIPT_DIR, job_object.script_id, "logs", log_file)
-        log_event(logging.INFO,
-                  message="Fetching job logs for job: '{}' at: '{}'".format(job_id, log_file),
-                  resource_id=job_id)
-
-        if os.path.exists(log_file):
-            with open(log_file, 'r') as log_file:
-                log_file.seek(last_position)
-                new_lines = log_file.readlines()
-                new_position = log_file.tell()
-            return Response(status_code=200, content=json.dumps({"job": job_object.model_dump(), "lines": new_lines, "new_position": new_position, "job_status": job_object.status}), media_type="application/json")
-        return Response(status_code=404, content="Log file '{}' does not exist.".format(log_file))
+        return job_logs_response(job_object, last_position, tail, before, max_bytes, max_lines, line, since, until, stream)
+
+def job_logs_response(job_object: DockerJobs | DockerJobsArchive, last_position: int = 0, tail: Optional[int] = None, before: Optional[int] = None,
+                      max_bytes: Optional[int] = None, max_lines: Optional[int] = None, line: Optional[int] = None,
+                      since: Optional[float] = None, until: Optional[float] = None, stream: Optional[str] = None) -> Response:
+    """Read a page of a job's logs from disk, see `get_job_logs`."""
+    log_file = job_object.logs
+
+    if log_file is None:
+        return Response(status_code=404, content="No logs found.")
+    log_file = get_log_path(job_object.script_id, log_file)
+    log_event(logging.INFO,
+              message="Fetching job logs for job: '{}' at: '{}'".format(job_object.id, log_file),
+              resource_id=job_object.id)
+
+    if JobLogReader(log_file).exists():
+        try:
+            page = read_log_page(log_file, last_position, tail=tail, before=before, max_bytes=max_bytes, max_lines=max_lines,
+                                 line=line, since=since, until=until, stream=stream)
+        except LogNotTimestamped as e:
+            return Response(status_code=400, content=str(e))
+        return Response(status_code=200, content=json.dumps({"job": job_object.model_dump(), **page, "job_status": job_object.status}), media_type="application/json")
+    return Response(status_code=404, content="Log file '{}' does not exist.".format(log_file))
+
+def stream_job_logs(job_id: int, request: Request, last_position: int = 0) -> Response | StreamingResponse:
+    """
+    Stream a job's logs as Server-Sent Events from the given position until the job reaches a terminal state.
+    :param job_id:
+    :param request: Incoming request, used to detect disconnects and the Last-Event-ID header of reconnecting clients.
+    :param last_position: Logical log position to resume from.
+    :return:
+    """
+    with Session(engine) as session:
+        if DockerJobs.get_by_id(job_id, session=session) is None:
+            return Response(status_code=404, content="Job doesn't exist.")
+
+    terminal_statuses = [i.value for i in JobStatus.get_deletable()]
+
+    def resolve():
+        with Session(engine) as _session:
+            job_object = DockerJobs.get_by_id(job_id, session=_session)
+            if job_object is None:
+                return None, True, None
+            log_path = get_log_path(job_object.script_id, job_object.logs) if job_object.logs is not None else None
+            return job_object.status, job_object.status in terminal_statuses, log_path
+
+    return StreamingResponse(
+        stream_log(request, resolve, position=get_resume_position(request, last_position),
+                   poll_interval=config.LOG_STREAM_POLL_INTERVAL, status_interval=config.LOG_STREAM_STATUS_INTERVAL),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+def stream_job_events(request: Request, script_id: Optional[str] = None) -> StreamingResponse:
+    """
+    Stream job lifecycle events (created, running, finished, killed, deleted) as Server-Sent Events, so clients only
+    have to refresh the rows that actually changed instead of polling the job history.
+    :param request:
+    :param script_id: Only stream events of jobs belonging to this script.
+    :return:
+    """
+    async def generate():
+        predicate = (lambda event: event["data"].get("script_id") == script_id) if script_id is not None else None
+        subscription = event_bus.subscribe(topics={JOB_TOPIC}, predicate=predicate)
+        async for message in stream_events(request, subscription):
+            yield message
+
+    return StreamingResponse(generate(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+def search_job_logs(query: str, script_id: Optional[str] = None, status: Optional[int] = None, since: Optional[int] = None,
+                    until: Optional[int] = None, raw: bool = False, limit: int = 20, matches_per_job: int = 5) -> Response:
+    """
+    Search the logs of finished jobs through the full-text index.
+    :param query: Text to search for, or an FTS5 query if raw is set.
+    :param script_id: Only jobs of this script.
+    :param status: Only jobs with this status.
+    :param since: Only jobs created at or after this UNIX timestamp.
+    :param until: Only jobs created at or before this UNIX timestamp.
+    :param raw: Interpret the query as FTS5 query syntax instead of a phrase.
+    :param limit: Maximum number of jobs returned.
+    :param matches_per_job: Maximum number of matching lines returned per job.
+    :return:
+    """
+    if not config.LOG_SEARCH_ENABLED:
+        return Response(status_code=404, content="Log search is disabled.")
+    if not query.strip():
+        return Response(status_code=400, content="Search query must not be empty.")
+    try:
+        with LogSearchIndex() as index:
+            jobs = index.search(query, script_id=script_id, status=status, since=since, until=until, raw=raw,
+                                limit=limit, matches_per_job=matches_per_job)
+    except InvalidSearchQuery as e:
+        return Response(status_code=400, content="Invalid search query: {}".format(e))
+    return Response(status_code=200, content=json.dumps({"query": query, "jobs": jobs}), media_type="application/json")
 
 def delete_job(job_id: int) -> Response:
     """
@@ -903,21 +1384,28 @@ def delete_job(job_id: int) -> Response:
     :param job_id:
     :return:
     """
-    with Session(engine) as session:
-        job_object = DockerJobs.get_by_id(job_id, session=session)
+    with Session(engine, expire_on_commit=False) as session:
+        # Locked, so that the archiver, which skips locked jobs, cannot move the job whilst it is deleted. A job the
+        # archiver is moving right now is waited for and found in the archive.
+        job_object = DockerJobs.get_by_id(job_id, session=session, lock=True) or DockerJobsArchive.get_by_id(job_id, session=session, lock=True)
         if job_object is None:
             return Response(status_code=404, content="Job doesn't exist.")
         if job_object.status not in [i.value for i in JobStatus.get_deletable()]:
             return Response(status_code=422, content="Cannot delete job with ID: '{}' in current state.".format(job_id))
-        if job_object.logs is not None and os.path.exists(job_object.logs):
-            log_event(logging.INFO, message="Deleting job logs for job: '{}' at path: '{}'".format(job_id, job_object.logs), resource_id=job_id)
-            os.remove(job_object.logs)
-        else:
-            log_event(logging.WARNING, message="Job log file '{}' does not exist.".format(job_object.logs), resource_id=job_id)
         log_event(logging.INFO, message="Deleting job with ID: '{}'.".format(job_object.id), resource_id=job_id)
         session.delete(job_object)
         session.commit()
-        return Response(status_code=204)
+
+    # The logs are only removed once the job is gone, so a failed delete does not leave a job without its logs.
+    log_path = get_log_path(job_object.script_id, job_object.logs) if job_object.logs is not None else None
+    if log_path is not None and len(get_log_files(log_path)) > 0:
+        log_event(logging.INFO, message="Deleting job logs for job: '{}' at path: '{}'".format(job_id, log_path), resource_id=job_id)
+        remove_log_files(log_path)
+    else:
+        log_event(logging.WARNING, message="Job log file '{}' does not exist.".format(job_object.logs), resource_id=job_id)
+    publish_job_event(job_object, "deleted")
+    remove_from_search_index([job_id])
+    return Response(status_code=204)
 
 def cancel_job(job_id: int) -> Response:
     with Session(engine) as session:
@@ -929,9 +1417,9 @@ def cancel_job(job_id: int) -> Response:
         container_id = job_object.container_id
         if container_id is None:
             log_event(logging.WARNING, message="Job doesn't have container_id attached.", resource_id=job_id)
-            job_object.status = JobStatus.KILLED.value
-            session.add(job_object)
+            job_object.set_finished(JobStatus.KILLED.value, session)
             session.commit()
+            publish_job_event(job_object, "killed")
             return Response(status_code=204)
         try:
             DockerManager().kill_container(container_id=container_id)
@@ -949,4 +1437,48 @@ def run_script_process(job_id: int, script_id: str, image_id: str, schedule_id:
     :param script_id: Script's ID.
     :param image_id: ID of image in docker environment.
     """
-    DockerManager().run_container(job_id=job_id, script_id=script_id, image_id=image_id, schedule_id=schedule_id)
\ No newline at end of file
+    DockerManager().run_container(job_id=job_id, script_id=script_id, image_id=image_id, schedule_id=schedule_id)
+    compress_job_log.send(job_id=job_id)
+    if config.LOG_SEARCH_ENABLED:
+        index_job_log.send(job_id=job_id)
+
+
+@dramatiq.actor
+def compress_job_log(job_id: int):
+    """
+    Compress the log of a job that has reached a terminal state. Reads through JobLogReader decompress transparently.
+    :param job_id: Job ID.
+    """
+    if config.LOG_COMPRESSION is None:
+        return
+    with Session(engine) as session:
+        job_object = DockerJobs.get_by_id(job_id, session=session)
+        if job_object is None or job_object.logs is None:
+            return
+        if job_object.status not in [i.value for i in JobStatus.get_deletable()]:
+            log_event(logging.WARNING, message="Job is not finished, skipping log compression.", resource_id=job_id)
+            return
+        log_path = get_log_path(job_object.script_id, job_object.logs)
+    before, after = compress_log(log_path, block_bytes=config.LOG_COMPRESSION_BLOCK_BYTES, level=config.LOG_COMPRESSION_LEVEL)
+    log_event(logging.INFO, message="Compressed job log from {} to {} bytes".format(before, after), resource_id=job_id)
+
+
+@dramatiq.actor
+def index_job_log(job_id: int):
+    """
+    Add the log of a job that has reached a terminal state to the full-text search index.
+    :param job_id: Job ID.
+    """
+    with Session(engine) as session:
+        job_object = DockerJobs.get_by_id(job_id, session=session)
+        if job_object is None or job_object.logs is None:
+            return
+        if job_object.status not in [i.value for i in JobStatus.get_deletable()]:
+            log_event(logging.WARNING, message="Job is not finished, skipping log indexing.", resource_id=job_id)
+            return
+        with LogSearchIndex() as index:
+            lines = index.index_job(job_object)
+    if lines is None:
+        log_event(logging.WARNING, message="Job log does not exist, nothing indexed", resource_id=job_id)
+        return
+    log_event(logging.INFO, message="Indexed {} log lines".format(lines), resource_id=job_id)
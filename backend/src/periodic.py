@@ -1,8 +1,28 @@
 import dramatiq
 from periodiq import cron
+from src.factory import config
+from src.utils.garbage_collector import GarbageCollector
+from src.utils.job_archiver import JobArchiver
+from src.utils.log_search import index_pending_jobs
 from src.utils.scheduler import Scheduler
 
 
 @dramatiq.actor(periodic=cron("* * * * *"))
 def scheduled_tasks_job():
     Scheduler().run()
+
+
+@dramatiq.actor(periodic=cron(config.GC_CRON))
+def garbage_collection_job():
+    GarbageCollector().run()
+
+
+@dramatiq.actor(periodic=cron(config.LOG_SEARCH_CRON))
+def log_search_index_job():
+    if config.LOG_SEARCH_ENABLED:
+        index_pending_jobs()
+
+
+@dramatiq.actor(periodic=cron(config.JOB_ARCHIVE_CRON))
+def job_archive_job():
+    JobArchiver().run()
@@ -11,6 +11,8 @@ class ScriptUpdate(BaseModel):
     description: Optional[str] = None
     language: Optional[str] = None
     image_id: Optional[str] = None
+    log_head_bytes: Optional[int] = None
+    log_tail_bytes: Optional[int] = None
 
     class Config:
         from_attributes = True
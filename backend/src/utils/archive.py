@@ -0,0 +1,145 @@
+import io
+import os
+import tarfile
+import time
+import typing
+import zipfile
+import zlib
+from typing import Optional
+
+TAR_BLOCK = tarfile.BLOCKSIZE
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+# Signatures of formats that are compressed already and gain nothing from being deflated again.
+COMPRESSED_SIGNATURES = (
+    b"\x1f\x8b",  # gzip
+    b"PK\x03\x04",  # zip, jar, whl, docx, ...
+    b"BZh",  # bzip2
+    b"\xfd7zXZ\x00",  # xz
+    b"\x28\xb5\x2f\xfd",  # zstd
+    b"7z\xbc\xaf\x27\x1c",  # 7z
+    b"\x89PNG",
+    b"\xff\xd8\xff",  # jpeg
+    b"GIF8",
+    b"%PDF",
+)
+
+
+class ArchiveEntry:
+    """
+    A file to add to a streamed archive. The content is produced lazily by `chunks`, so only one chunk of one file is
+    held in memory at a time. `size` must be known upfront for tar archives, the content is padded or cut to it.
+    """
+
+    def __init__(self, name: str, chunks: typing.Callable[[], typing.Iterable[bytes]], size: Optional[int] = None,
+                 mtime: Optional[float] = None, compress: bool = True):
+        self.name = name
+        self.chunks = chunks
+        self.size = size
+        self.mtime = mtime if mtime is not None else time.time()
+        self.compress = compress
+
+
+class StreamSink(io.RawIOBase):
+    """Write-only, unseekable file object collecting the bytes written to it until they are drained."""
+
+    def __init__(self):
+        super().__init__()
+        self.buffer = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.buffer += data
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def is_compressed(path: str) -> bool:
+    """Whether a file is in a compressed format, judged by its leading bytes."""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(12)
+    except OSError:
+        return False
+    return head.startswith(COMPRESSED_SIGNATURES) or (head[:4] == b"RIFF" and head[8:12] == b"WEBP")
+
+
+def file_entry(path: str, name: Optional[str] = None, store_compressed: bool = True) -> ArchiveEntry:
+    """Archive entry for a file on disk. Files that are compressed already are stored as is if `store_compressed`."""
+    stat = os.stat(path)
+    return ArchiveEntry(name or os.path.basename(path), file_chunks(path), size=stat.st_size, mtime=stat.st_mtime,
+                        compress=not (store_compressed and is_compressed(path)))
+
+
+def file_chunks(path: str, chunk_size: int = 64 * 1024) -> typing.Callable[[], typing.Iterator[bytes]]:
+    def chunks():
+        with open(path, "rb") as f:
+            while chunk := f.read(chunk_size):
+                yield chunk
+    return chunks
+
+
+def stream_zip(entries: typing.Iterable[ArchiveEntry], level: int = 6) -> typing.Iterator[bytes]:
+    """
+    Stream a ZIP archive. Entries are written with data descriptors since the output is not seekable, and switch to
+    ZIP64 automatically when an entry of unknown or large size requires it.
+    """
+    sink = StreamSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=level, allowZip64=True) as archive:
+        for entry in entries:
+            info = zipfile.ZipInfo(entry.name, date_time=time.localtime(max(entry.mtime, 315532800))[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED if entry.compress else zipfile.ZIP_STORED
+            info.external_attr = 0o644 << 16
+            force_zip64 = entry.size is None or entry.size >= zipfile.ZIP64_LIMIT
+            with archive.open(info, "w", force_zip64=force_zip64) as f:
+                for chunk in entry.chunks():
+                    f.write(chunk)
+                    if sink.buffer:
+                        yield sink.drain()
+            if sink.buffer:
+                yield sink.drain()
+    yield sink.drain()
+
+
+def stream_tar_gz(entries: typing.Iterable[ArchiveEntry], level: int = 6) -> typing.Iterator[bytes]:
+    """
+    Stream a gzip compressed tar archive. Headers and padding are generated per entry instead of going through
+    tarfile.addfile, which copies a whole member before returning control.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    compress = compressor.compress
+
+    for entry in entries:
+        if entry.size is None:
+            raise ValueError("The size of tar entry '{}' must be known".format(entry.name))
+        info = tarfile.TarInfo(entry.name)
+        info.size = entry.size
+        info.mtime = int(entry.mtime)
+        info.mode = 0o644
+        if data := compress(info.tobuf(format=tarfile.PAX_FORMAT)):
+            yield data
+
+        remaining = entry.size
+        for chunk in entry.chunks():
+            if remaining <= 0:
+                break
+            chunk = chunk[:remaining]
+            remaining -= len(chunk)
+            if data := compress(chunk):
+                yield data
+        # Content that shrank after its size was determined is padded, the header cannot be changed anymore.
+        while remaining > 0:
+            padding = min(remaining, 64 * 1024)
+            remaining -= padding
+            if data := compress(b"\0" * padding):
+                yield data
+        if entry.size % TAR_BLOCK:
+            if data := compress(b"\0" * (TAR_BLOCK - entry.size % TAR_BLOCK)):
+                yield data
+
+    yield compress(b"\0" * TAR_BLOCK * 2) + compressor.flush()
@@ -0,0 +1,159 @@
+import errno
+import hashlib
+import os
+import shutil
+import typing
+import uuid
+from typing import Optional
+
+from fastapi import UploadFile
+
+from src.factory import config
+from src.helpful import save_file, UploadBudget
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, files are always copied there.
+    fcntl = None
+
+# ioctl request cloning a whole file (reflink) on filesystems that share data blocks between files, e.g. btrfs and XFS.
+FICLONE = 0x40049409
+# Errors of os.link meaning the filesystem cannot hardlink the blob, in which case it is copied instead.
+LINK_UNSUPPORTED = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP}
+# Recorded in place of a digest for files that were missing when they were to be deduplicated.
+MISSING_DIGEST = "missing"
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def clone_file(source: str, destination: str) -> None:
+    """Copy a file, sharing its data blocks with the source (reflink) where the filesystem supports it."""
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return
+            except OSError:
+                pass
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+
+class BlobStore:
+    """
+    Content-addressed storage for image files and script sources. Every distinct content is stored once, as
+    `<BLOB_DIR>/<first two digits of its digest>/<sha256 digest>`, and hardlinked to the paths using it, so images and
+    scripts sharing files neither take up additional space nor time to copy them. Where hardlinks are not possible the
+    blob is reflinked or, failing that, copied.
+
+    Blobs are never written to: paths linked to a blob are only ever replaced, not modified in place. Blobs are
+    referenced by the digests recorded in the database (DockerImageFiles.sha256, DockerScripts.code_sha256), a blob no
+    digest refers to is removed by the garbage collector once it has not been used for its grace period. Reusing a blob
+    touches it, so that it is not removed between being found and being linked.
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or config.BLOB_DIR
+        self.tmp_dir = os.path.join(self.root, "tmp")
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def touch(self, digest: str) -> bool:
+        """Mark a blob as just used. :return: Whether the blob exists."""
+        try:
+            os.utime(self.path(digest))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def put_upload(self, file: UploadFile, budget: Optional[UploadBudget] = None) -> str:
+        """
+        Store an upload, see `save_file` for the size limits applied.
+        :return: Digest of the upload's content.
+        """
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        temp_path = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+        digest = save_file(temp_path, file, budget)
+        blob_path = self.path(digest)
+        if self.touch(digest):
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(temp_path, blob_path)
+        return digest
+
+    def link(self, digest: str, destination: str) -> None:
+        """Atomically replace `destination` with a link to (or a copy of) the blob."""
+        blob_path = self.path(digest)
+        temp_path = "{}.{}.tmp".format(destination, uuid.uuid4().hex)
+        try:
+            try:
+                os.link(blob_path, temp_path)
+            except OSError as e:
+                if e.errno not in LINK_UNSUPPORTED:
+                    raise
+                clone_file(blob_path, temp_path)
+            os.replace(temp_path, destination)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def save_upload(self, destination: str, file: UploadFile, budget: Optional[UploadBudget] = None) -> str:
+        """Store an upload and link it to `destination`. Drop-in replacement for `save_file`."""
+        digest = self.put_upload(file, budget)
+        self.link(digest, destination)
+        return digest
+
+    def adopt(self, path: str) -> str:
+        """
+        Deduplicate a file written before the store existed: the file becomes the blob of its content if there is none
+        yet, otherwise it is replaced by a link to the existing blob.
+        :return: Digest of the file's content.
+        """
+        digest = hash_file(path)
+        blob_path = self.path(digest)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        try:
+            os.link(path, blob_path)
+        except FileExistsError:
+            self.touch(digest)
+            if not os.path.samefile(path, blob_path):
+                self.link(digest, path)
+        except OSError as e:
+            if e.errno not in LINK_UNSUPPORTED:
+                raise
+            clone_file(path, blob_path)
+        return digest
+
+    def iter_blobs(self) -> typing.Iterator[typing.Tuple[str, os.stat_result]]:
+        """Paths and stats of all blobs in the store."""
+        if not os.path.isdir(self.root):
+            return
+        for prefix in os.scandir(self.root):
+            if not prefix.is_dir() or len(prefix.name) != 2:
+                continue
+            for entry in os.scandir(prefix.path):
+                try:
+                    yield entry.path, entry.stat()
+                except FileNotFoundError:
+                    continue
+
+    def iter_temp_files(self) -> typing.Iterator[str]:
+        """Left over temporary files of uploads that were interrupted."""
+        if not os.path.isdir(self.tmp_dir):
+            return
+        for entry in os.scandir(self.tmp_dir):
+            yield entry.path
+
+
+blob_store = BlobStore()
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import logging
+import os
+import tarfile
+import typing
+from typing import Optional
+
+from docker.utils.build import exclude_paths
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.addHandler(logging.StreamHandler())
+
+COMPRESSION_EXTENSIONS = {None: "tar", "gzip": "tar.gz"}
+
+
+class InvalidContextCompression(Exception):
+    """Raised when the configured build context compression is not supported."""
+
+
+class ProgressReader:
+    """
+    Read-only file wrapper handed to the docker client as the request body. The HTTP client pulls the archive in small
+    blocks via read(), so the context is streamed from disk instead of being loaded into memory, and every block read
+    is reported back through the callback.
+    """
+
+    def __init__(self, fileobj: typing.BinaryIO, total: int, callback: typing.Callable[[int, int], None], steps: int = 10):
+        self.fileobj = fileobj
+        self.total = total
+        self.sent = 0
+        self.callback = callback
+        self.step_size = max(total // steps, 1)
+        self.next_report = self.step_size
+
+    def __len__(self) -> int:
+        # requests uses the length to set the Content-Length header rather than falling back to chunked encoding.
+        return self.total
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.fileobj.read(size)
+        self.sent += len(chunk)
+        if self.sent >= self.next_report or (not chunk and self.sent == self.total):
+            self.callback(self.sent, self.total)
+            self.next_report = self.sent + self.step_size
+        return chunk
+
+
+class BuildContext:
+    """
+    Build context for a given image. A version's src directory is packed into a tar archive kept in the image's
+    directory, and the archive is reused for later builds of any version as long as the content of the files (relative
+    paths, modes and SHA-256 digests) has not changed. Only the archive of the most recently built content is kept.
+    """
+
+    def __init__(self, src_dir: str, cache_dir: str, compression: Optional[str] = None, dockerfile: str = "Dockerfile"):
+        if compression not in COMPRESSION_EXTENSIONS:
+            raise InvalidContextCompression("Unsupported build context compression '{}'".format(compression))
+        self.src_dir = src_dir
+        self.compression = compression
+        self.dockerfile = dockerfile
+        self.archive_path = os.path.join(cache_dir, "context.{}".format(COMPRESSION_EXTENSIONS[compression]))
+        self.digest_path = os.path.join(cache_dir, "context.json")
+
+    @property
+    def encoding(self) -> Optional[str]:
+        """Value for the Content-Encoding header sent to the docker daemon."""
+        return self.compression
+
+    def get_files(self) -> typing.List[str]:
+        """Relative paths of the files in the src directory that are not excluded by a .dockerignore file."""
+        patterns = []
+        dockerignore = os.path.join(self.src_dir, ".dockerignore")
+        if os.path.exists(dockerignore):
+            with open(dockerignore) as f:
+                patterns = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        return sorted(exclude_paths(self.src_dir, patterns, dockerfile=self.dockerfile))
+
+    def manifest_digest(self, files: typing.List[str]) -> str:
+        manifest = []
+        for name in files:
+            path = os.path.join(self.src_dir, name)
+            stat = os.lstat(path)
+            content = hashlib.sha256()
+            if os.path.isfile(path) and not os.path.islink(path):
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                        content.update(chunk)
+            elif os.path.islink(path):
+                content.update(os.readlink(path).encode("utf-8"))
+            manifest.append([name, stat.st_mode, content.hexdigest()])
+        return hashlib.sha256(json.dumps({"compression": self.compression, "files": manifest}).encode("utf-8")).hexdigest()
+
+    def cached_digest(self) -> Optional[str]:
+        if not os.path.exists(self.digest_path) or not os.path.exists(self.archive_path):
+            return None
+        try:
+            with open(self.digest_path) as f:
+                return json.load(f).get("digest")
+        except (OSError, ValueError):
+            return None
+
+    def prepare(self) -> typing.Tuple[str, bool]:
+        """
+        Ensure an up-to-date context archive exists on disk.
+        :return: Tuple of the archive's path and whether the cached archive was reused.
+        """
+        files = self.get_files()
+        digest = self.manifest_digest(files)
+        if self.cached_digest() == digest:
+            return self.archive_path, True
+
+        # Write to a temporary file first so an interrupted build never leaves a truncated archive behind.
+        tmp_path = self.archive_path + ".tmp"
+        mode = "w:gz" if self.compression == "gzip" else "w"
+        with tarfile.open(tmp_path, mode) as archive:
+            for name in files:
+                archive.add(os.path.join(self.src_dir, name), arcname=name, recursive=False)
+        os.replace(tmp_path, self.archive_path)
+
+        with open(self.digest_path, "w") as f:
+            json.dump({"digest": digest}, f)
+        return self.archive_path, False
+
+    def invalidate(self) -> None:
+        """Remove the cached archive, forcing it to be regenerated on the next build."""
+        for path in (self.archive_path, self.digest_path):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,126 @@
+import json
+import os
+import re
+import time
+import typing
+from typing import Optional
+
+STEP_PATTERN = re.compile(r"^Step (\d+)/(\d+) : (.*)$")
+CACHE_PATTERN = re.compile(r"^\s*---> Using cache\s*$")
+
+
+class BuildStep:
+    """A single Dockerfile instruction as reported by the docker daemon's build stream."""
+
+    def __init__(self, number: int, total: int, instruction: str, started_at: float):
+        self.number = number
+        self.total = total
+        self.instruction = instruction
+        self.cached = False
+        self.started_at = started_at
+        self.finished_at: Optional[float] = None
+        self.bytes_pulled = 0
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.finished_at is None:
+            return None
+        return round(self.finished_at - self.started_at, 3)
+
+    def to_dict(self) -> dict:
+        return {
+            "step": self.number,
+            "total": self.total,
+            "instruction": self.instruction,
+            "cached": self.cached,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "duration": self.duration,
+            "bytes_pulled": self.bytes_pulled,
+        }
+
+
+class BuildProgress:
+    """
+    Collects the JSON events streamed by the docker daemon during a build into per-step records (instruction, layer
+    cache hit, duration and bytes pulled) and persists them next to the image's build log.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.success: Optional[bool] = None
+        self.steps: typing.List[BuildStep] = []
+        # Bytes downloaded per layer, keyed by layer ID. Pulled layers are reported once per layer, not per event.
+        self.layers: typing.Dict[str, int] = {}
+        self.layer_steps: typing.Dict[str, Optional[BuildStep]] = {}
+        self.save()
+
+    @property
+    def current(self) -> Optional[BuildStep]:
+        return self.steps[-1] if self.steps else None
+
+    def feed(self, event: dict) -> None:
+        """Process a single decoded event from the docker build stream."""
+        now = time.time()
+        stream = event.get("stream")
+        if stream:
+            line = stream.strip()
+            match = STEP_PATTERN.match(line)
+            if match:
+                if self.current is not None and self.current.finished_at is None:
+                    self.current.finished_at = now
+                self.steps.append(BuildStep(int(match.group(1)), int(match.group(2)), match.group(3), now))
+                self.save()
+            elif CACHE_PATTERN.match(stream) and self.current is not None:
+                self.current.cached = True
+            return
+
+        layer_id = event.get("id")
+        progress = event.get("progressDetail") or {}
+        if layer_id and event.get("status") == "Downloading" and progress.get("total"):
+            self.layer_steps.setdefault(layer_id, self.current)
+            self.record_layer(layer_id, progress.get("current", 0))
+        elif layer_id and event.get("status") in ("Download complete", "Pull complete") and layer_id in self.layer_steps:
+            self.save()
+
+    def record_layer(self, layer_id: str, current: int) -> None:
+        previous = self.layers.get(layer_id, 0)
+        if current <= previous:
+            return
+        self.layers[layer_id] = current
+        step = self.layer_steps.get(layer_id)
+        if step is not None:
+            step.bytes_pulled += current - previous
+
+    def finish(self, success: bool) -> None:
+        self.finished_at = time.time()
+        self.success = success
+        if self.current is not None and self.current.finished_at is None:
+            self.current.finished_at = self.finished_at
+        self.save()
+
+    def to_dict(self) -> dict:
+        return {
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "duration": round(self.finished_at - self.started_at, 3) if self.finished_at is not None else None,
+            "success": self.success,
+            "bytes_pulled": sum(self.layers.values()),
+            "cached_steps": len([step for step in self.steps if step.cached]),
+            "steps": [step.to_dict() for step in self.steps],
+        }
+
+    def save(self) -> None:
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def load(path: str) -> Optional[dict]:
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
@@ -0,0 +1,52 @@
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Responses of these types are compressed already (log archives, image file downloads) or are mostly binary, gzipping
+# them again costs CPU per download and saves next to nothing.
+COMPRESSED_CONTENT_TYPES = (
+    "application/gzip",
+    "application/x-gzip",
+    "application/zip",
+    "application/octet-stream",
+)
+# Content-Encoding the GZipMiddleware passes responses with through, removed again before they are sent.
+PASS_THROUGH_HEADER = (b"content-encoding", b"identity")
+
+
+class SelectiveGZipMiddleware:
+    """
+    GZipMiddleware leaving responses that are compressed already alone. The GZipMiddleware only skips responses
+    declaring a Content-Encoding, so those responses are marked with one on their way to it and unmarked after it.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 500, compresslevel: int = 9):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        marked = False
+
+        async def app(_scope: Scope, _receive: Receive, gzip_send: Send) -> None:
+            async def mark(message: Message) -> None:
+                nonlocal marked
+                if message["type"] == "http.response.start":
+                    headers = Headers(raw=message["headers"])
+                    if "content-encoding" not in headers and headers.get("content-type", "").startswith(COMPRESSED_CONTENT_TYPES):
+                        marked = True
+                        message = {**message, "headers": [*message["headers"], PASS_THROUGH_HEADER]}
+                await gzip_send(message)
+
+            await self.app(_scope, _receive, mark)
+
+        async def unmark(message: Message) -> None:
+            if marked and message["type"] == "http.response.start":
+                message = {**message, "headers": [header for header in message["headers"] if header != PASS_THROUGH_HEADER]}
+            await send(message)
+
+        await GZipMiddleware(app, self.minimum_size, self.compresslevel)(scope, receive, unmark)
@@ -6,6 +6,9 @@ import traceback
 import typing
 from datetime import datetime
 import platform
+import queue
+import threading
+import time
 from typing import Sequence, Optional
 
 import docker
@@ -15,11 +18,20 @@ from docker.types import Mount
 from sqlalchemy import Select
 from sqlmodel import select, Session
 
-from src.db_models import DockerImage, DockerImageFiles, DockerJobs, DockerScripts
+from src.db_models import DockerImage, DockerImageFiles, DockerImageVersions, DockerJobs, DockerScripts
 from src.db_models import DockerScheduled
 from src.enums import ImageStatus, JobStatus, AvailableScriptLanguages
 from src.factory import config
 from src.factory.database import engine
+from src.utils.build_context import BuildContext, ProgressReader
+from src.utils.build_progress import BuildProgress
+from src.utils.events import publish_job_event, invalidate_cache
+from src.utils.garbage_collector import JOB_LABEL, IMAGE_LABEL, IMAGE_VERSION_LABEL
+from src.utils.image_versions import get_version_dir
+from src.utils.job_logs import JobLogWriter, LogLimits, STREAMS, parse_timestamp
+from src.utils.job_state import job_state_writer
+from src.utils.pagination import COUNT_CACHE
+from src.utils.response_cache import response_cache, IMAGES, SCRIPTS
 
 class DockerfileNotFound(Exception):
     """Raised when the image is not found in the database or the Dockerfile
@@ -58,7 +70,14 @@ class DockerManager:
             f.write(log + "\n")
 
     def run_container(self, job_id: int, script_id: str, image_id: str, schedule_id: Optional[int] = None):
+        """
+        Run a job's script in a container and follow its output. The job's state changes go through the job state
+        writer, which batches them with those of other jobs; the terminal status is waited for, so that it has been
+        committed by the time the job's message is acknowledged.
+        """
         logger.info("Attempting to run script with ID '{}' with image ID: '{}'".format(script_id, image_id))
+        schedule_released = False
+        logs: dict = {}
         with Session(engine) as session:
             try:
                 job_object = DockerJobs.get_by_id(job_id, session=session)
@@ -77,38 +96,37 @@ class DockerManager:
                 logger.info("Log file path: {}".format(log_file_path))
                 logger.info("Log file path basename: {}".format(os.path.basename(log_file_path)))
 
-                job_object.logs = os.path.basename(log_file_path)
-                session.add(job_object)
-                session.commit()
+                # Not waited for, every later change of the job repeats the log path so that it is durable with them.
+                logs = {"logs": os.path.basename(log_file_path)}
+                job_state_writer.update(job_id, **logs)
 
                 # Verify script exists (again) -> Get script OBJECT
                 script = DockerScripts.get_by_id(script_id, session)
                 if script is None:
                     self.write_log("Could not find script with ID '{}'".format(script_id), log_file_path)
                     logger.error("Could not find script with ID '{}'".format(script_id))
-                    job_object.status = JobStatus.FAILED.value
-                    session.add(job_object)
-                    session.commit()
+                    schedule_released = True
+                    job_state_writer.finish(job_id, JobStatus.FAILED.value, schedule_id, **logs).result()
                     return
 
                 # Ensure image exists in docker system
                 if not self.image_exists(image_id):
                     self.write_log("Failed to run script '{}': Image {} not found".format(script_id, image_id), log_file_path)
                     logger.error("Failed to run script '{}': Image {} not found".format(script_id, image_id))
-                    job_object.status = JobStatus.FAILED.value
-                    session.add(job_object)
-                    session.commit()
+                    schedule_released = True
+                    job_state_writer.finish(job_id, JobStatus.FAILED.value, schedule_id, **logs).result()
                     return
 
                 script_language = AvailableScriptLanguages.get_by_name(script.language)
                 if script_language is None:
                     self.write_log("Failed to run script '{}': Command for language {} not found".format(script_id, script.language), log_file_path)
                     logger.error("Failed to run script '{}': Command for language {} not found".format(script_id, script.language))
-                    job_object.status = JobStatus.FAILED.value
-                    session.add(job_object)
-                    session.commit()
+                    schedule_released = True
+                    job_state_writer.finish(job_id, JobStatus.FAILED.value, schedule_id, **logs).result()
                     return
 
+                # Recorded before the container starts, the running container keeps the code it was started with.
+                script_version = script.version
                 host_script_dir: str = str(os.path.normpath(os.path.join(config.HOST_DATA_DIR, config.script_dir_name, script_id)))
                 script_file = os.path.join(host_script_dir, "src", "script")
 
@@ -130,47 +148,81 @@ class DockerManager:
                 container = self.client.containers.run(
                     image=image_id,
                     command=[*script_language.command.split(" "), "/script.{}".format(script_language.extension)],
-                    mounts=[Mount(target="/script.{}".format(script_language.extension), source=script_file, type="bind")],
+                    # Read-only, the script file is a hardlink of a blob shared with every script of the same content.
+                    mounts=[Mount(target="/script.{}".format(script_language.extension), source=script_file, type="bind", read_only=True)],
                     detach=True,
+                    labels={JOB_LABEL: str(job_id)},
                     stdout=True,
                     stderr=True,
                     # tty=True, # DEBUG ONLY
                     # stdin_open=True, # DEBUG ONLY
                 )
-                job_object.container_id = container.id
-                session.add(job_object)
-                session.commit()
+                # Waited for, the job can only be killed once its container is known.
+                job_state_writer.update(job_id, action="running", container_id=container.id, script_version=script_version, **logs).result()
 
                 try:
-                    with open(log_file_path, "a") as f:
-                        for line in container.logs(stream=True, follow=True):
-                            decoded_line = line.decode('utf-8').strip()
-                            print(decoded_line)
-                            f.write(decoded_line + "\n")
-                            f.flush()  # Ensures data is written immediately
-                    job_object.status = JobStatus.SUCCESS.value
-                    job_object.finished_at = int(datetime.now(tz=pytz.UTC).timestamp())
-                    job_object.container_id = None
-                    session.add(job_object)
-                    session.commit()
+                    with JobLogWriter(log_file_path, LogLimits.for_script(script), timestamped=config.LOG_TIMESTAMPS) as writer:
+                        if config.LOG_TIMESTAMPS:
+                            for stream, timestamp, text in self.follow_output(container):
+                                writer.write_entry(text, stream, timestamp)
+                        else:
+                            for line in container.logs(stream=True, follow=True):
+                                decoded_line = line.decode('utf-8').strip()
+                                print(decoded_line)
+                                writer.write_line(decoded_line)
                 except Exception as e:
                     logger.error("Failed to fetch script logs '{}': {}".format(script_id, e))
+                    # Committed before the message is acknowledged, like every other outcome of the job.
+                    schedule_released = True
+                    job_state_writer.finish(job_id, JobStatus.FAILED.value, schedule_id, container_id=None, **logs).result()
                     return
-                if schedule_id is not None:
-                    DockerScheduled.set_finished(schedule_id, session)
-                    session.commit()
+                # The job may have been killed whilst its output was being followed, it then stays killed.
+                schedule_released = True
+                job_state_writer.finish(job_id, JobStatus.SUCCESS.value, schedule_id, container_id=None, **logs).result()
             except Exception as e:
                 logger.error("Failed to run script '{}': {}".format(script_id, e))
-                job_object = DockerJobs.get_by_id(job_id, session=session)
-                job_object.status = JobStatus.FAILED.value
-                session.add(job_object)
-                session.commit()
+                schedule_released = True
+                job_state_writer.finish(job_id, JobStatus.FAILED.value, schedule_id, **logs).result()
             finally:
                 if "container" in locals() and container is not None:
                     container.remove(force=True)
-                if schedule_id is not None:
-                    DockerScheduled.set_finished(schedule_id, session)
-                    session.commit()
+                if schedule_id is not None and not schedule_released:
+                    job_state_writer.release_schedule(schedule_id).result()
+
+    @staticmethod
+    def follow_output(container) -> typing.Iterator[typing.Tuple[str, float, str]]:
+        """
+        Follow a container's stdout and stderr separately, each with the timestamps the docker daemon recorded the
+        output at. Both streams are read in their own thread and merged in the order their lines arrive.
+        :return: Iterator of (stream, UNIX timestamp, line).
+        """
+        output: queue.Queue = queue.Queue(maxsize=10000)
+
+        def follow(stream: str):
+            try:
+                for chunk in container.logs(stdout=stream == "stdout", stderr=stream == "stderr", stream=True, follow=True, timestamps=True):
+                    for line in chunk.decode("utf-8", errors="replace").splitlines():
+                        timestamp, _, text = line.partition(" ")
+                        try:
+                            output.put((stream, parse_timestamp(timestamp), text.rstrip()))
+                        except ValueError:
+                            output.put((stream, time.time(), line.rstrip()))
+                output.put(None)
+            except Exception as e:
+                output.put(e)
+
+        threads = [threading.Thread(target=follow, args=(stream,), daemon=True) for stream in STREAMS]
+        for thread in threads:
+            thread.start()
+        running = len(threads)
+        while running:
+            item = output.get()
+            if item is None:
+                running -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
 
     def kill_container(self, container_id: str = None) -> None:
         """
@@ -195,15 +247,23 @@ class DockerManager:
             with Session(engine) as session:
                 jobs = DockerJobs.get_by_container_id(container_id, session)
                 for job in jobs:
-                    job.set_killed()
-                    session.add(job)
+                    job.set_finished(JobStatus.KILLED.value, session)
                 session.commit()
+                for job in jobs:
+                    publish_job_event(job, "killed")
                 return None
         except Exception:
             logger.error("Error with database whilst attempting to update job status: {}".format(traceback.format_exc()))
             return None
 
-    def build_image(self, _id: str = None):
+    def build_image(self, _id: str = None, version: Optional[int] = None):
+        """
+        Build a version of an image from the version's snapshot of the image's files. Jobs keep running on the image's
+        current version whilst the new version builds, and are switched over to it in a single update once it has been
+        built successfully. A failed build leaves the image on its current version.
+        :param _id: ID of the image in the DB.
+        :param version: Version to build, the image's latest version if not given.
+        """
         if _id is None:
             raise Exception("Invalid Image ID: 'NoneType'")
 
@@ -214,41 +274,65 @@ class DockerManager:
             if image is None:
                 raise DockerfileNotFound("Could not find Docker image with ID '{}' in DB. Are you sure it exists.".format(_id))
 
-            # Update status
-            image.status = ImageStatus.BUILDING.value
-            session.add(image)
+            image_version = DockerImageVersions.get(_id, version, session) if version is not None else DockerImageVersions.get_latest(_id, session)
+            if image_version is None:
+                raise DockerfileNotFound("Could not find version {} of Docker image with ID '{}' in DB.".format(version, _id))
+
+            # Only an image without a built version is unavailable whilst building.
+            if not image.is_serving:
+                image.status = ImageStatus.BUILDING.value
+                session.add(image)
+            image_version.status = ImageStatus.BUILDING.value
+            session.add(image_version)
             session.commit()
             session.refresh(image)
+            response_cache.bump(IMAGES, SCRIPTS)
 
-            # Get the corresponding file information
-            image_files = DockerImageFiles.get_by_image_id(_id, session=session)
-
-            # Fetch the Dockerfile path from db
-            dockerfile_path = [record.filepath for record in image_files if "Dockerfile" == os.path.basename(record.filepath)]
-            dockerfile_path = dockerfile_path[0] if len(dockerfile_path) == 1 else None
-            # Ensure dockerfile exists.
-            if dockerfile_path is None:
-                raise DockerfileNotFound("Could not find Dockerfile for image with ID '{}' in DB. Are you sure it exists.".format(_id))
-
-            dockerfile_path = os.path.join(config.IMAGE_DIR, _id, "src", "Dockerfile")
+            version_dir = get_version_dir(_id, image_version.version)
+            dockerfile_path = os.path.join(version_dir, "src", "Dockerfile")
             if not os.path.exists(dockerfile_path):
-                raise DockerfileNotFound("Could not find Dockerfile for image with ID '{}' on filesystem".format(_id))
-            logger.info("Starting build of image with ID '{}' in DB".format(_id))
-            # Build the docker image, using the low level api. https://docker-py.readthedocs.io/en/stable/api.html#module-docker.api.image
-            log_generator = self.client.api.build(
-                path=os.path.dirname(dockerfile_path),
-                dockerfile=dockerfile_path,
-                tag=f"{_id}{'-' + image.tag if image.tag else ''}",
-                rm=True,
-                forcerm=True,
-                decode=True,
-                pull=True
-            )
+                raise DockerfileNotFound("Could not find Dockerfile for version {} of image with ID '{}' on filesystem".format(image_version.version, _id))
+            logger.info("Starting build of version {} of image with ID '{}' in DB".format(image_version.version, _id))
             # Create a path to a logfile inside the image's directory on the fs.
             log_file = os.path.join(config.IMAGE_DIR, _id, "build.log")
+            self.save_log_to_file(log_file, "Building version {}".format(image_version.version))
+            # Structured per-step progress (timing, cache hits, bytes pulled) is kept next to the build log.
+            build_progress = BuildProgress(os.path.join(config.IMAGE_DIR, _id, "build_steps.json"))
+
+            # Pack the version's src directory into a tar archive, cached per image and shared by versions of the same
+            # content, which is streamed to the daemon from disk.
+            build_context = BuildContext(os.path.join(version_dir, "src"), os.path.join(config.IMAGE_DIR, _id),
+                                         compression=config.BUILD_CONTEXT_COMPRESSION)
+            context_path, reused = build_context.prepare()
+            context_size = os.path.getsize(context_path)
+            self.save_log_to_file(log_file, "{} build context ({} bytes{})".format(
+                "Reusing cached" if reused else "Generated",
+                context_size,
+                ", " + build_context.compression if build_context.compression else ""
+            ))
+
+            def report_upload(sent: int, total: int):
+                self.save_log_to_file(log_file, "Uploading build context: {}/{} bytes ({}%)".format(sent, total, sent * 100 // max(total, 1)))
+
+            image_version.docker_tag = f"{_id}{'-' + image.tag if image.tag else ''}:v{image_version.version}"
+            with open(context_path, "rb") as context_file:
+                # Build the docker image, using the low level api. https://docker-py.readthedocs.io/en/stable/api.html#module-docker.api.image
+                log_generator = self.client.api.build(
+                    fileobj=ProgressReader(context_file, context_size, report_upload),
+                    custom_context=True,
+                    encoding=build_context.encoding,
+                    dockerfile=build_context.dockerfile,
+                    tag=image_version.docker_tag,
+                    labels={IMAGE_LABEL: _id, IMAGE_VERSION_LABEL: str(image_version.version)},
+                    rm=True,
+                    forcerm=True,
+                    decode=True,
+                    pull=True
+                )
             # Instantiate an image_id value (Should be the final ID given the image by the docker engine)
             image_id = None
             for log in log_generator:
+                build_progress.feed(log)
                 line = log.get("stream") or log.get("status") or log.get("errorDetail", {}).get("message")
                 if line:
                     # Find Docker Image ID from logs (regex taken directly from docker-py library's client.images.build method)
@@ -257,17 +341,48 @@ class DockerManager:
                         image_id = match.group(2)
                     self.save_log_to_file(log_file, line)
 
-            image.image_id = image_id
-
             try:
                 self.client.images.get(image_id)
-                image.status = ImageStatus.BUILD_SUCCESS.value
+                built = image_id is not None
             except docker.errors.ImageNotFound:
+                built = False
+            build_progress.finish(success=built)
+
+            image_version.docker_image_id = image_id if built else None
+            image_version.status = ImageStatus.BUILD_SUCCESS.value if built else ImageStatus.BUILD_FAILED.value
+            image_version.built_at = int(datetime.now(tz=pytz.utc).timestamp())
+            session.add(image_version)
+            # Lock the image's row, a version activated in the meantime (e.g. a rollback) is superseded by this build.
+            image = session.exec(typing.cast(Select, select(DockerImage).where(DockerImage.id == _id).with_for_update().execution_options(populate_existing=True))).one()
+            if built:
+                image.image_id = image_id
+                image.version = image_version.version
+                image.status = ImageStatus.BUILD_SUCCESS.value
+            elif not image.is_serving:
                 image.status = ImageStatus.BUILD_FAILED.value
-
+            self.save_log_to_file(log_file, "Version {} {}".format(image_version.version, "is now active" if built else "failed to build"))
             session.add(image)
             session.commit()
-            session.refresh(image)
+        invalidate_cache(COUNT_CACHE, ("images",))
+        response_cache.bump(IMAGES, SCRIPTS)
+
+    @staticmethod
+    def fail_build(_id: str, version: Optional[int] = None):
+        """Record a build that was aborted by an error."""
+        with Session(engine) as session:
+            image = session.exec(typing.cast(Select, select(DockerImage).where(DockerImage.id == _id).with_for_update())).first()
+            if image is None:
+                return
+            image_version = DockerImageVersions.get(_id, version, session) if version is not None else DockerImageVersions.get_latest(_id, session)
+            if image_version is not None and image_version.status == ImageStatus.BUILDING.value:
+                image_version.status = ImageStatus.BUILD_FAILED.value
+                session.add(image_version)
+            if not image.is_serving:
+                image.status = ImageStatus.BUILD_FAILED.value
+                session.add(image)
+            session.commit()
+        invalidate_cache(COUNT_CACHE, ("images",))
+        response_cache.bump(IMAGES, SCRIPTS)
 
     def delete_image(self, _id: str = None):
         """
@@ -301,14 +416,19 @@ class DockerManager:
                     raise e
 
                 jobs = DockerJobs.get_running_jobs(script_id=None, session=session)
+                killed_jobs = list(jobs)
 
                 for job in jobs:
                     job.kill_script(session=session, docker_client=self.client)
 
+                # Jobs may still be running on earlier versions of the image.
+                versions = DockerImageVersions.get_by_image_id(_id, session)
+                docker_image_ids = {image_id} | {version.docker_image_id for version in versions}
+                docker_image_ids.discard(None)
+
                 # Get all running containers that depend on the Image.
-                containers = self.client.containers.list(filters={
-                    "ancestor": image_id
-                })
+                containers = [container for docker_image_id in docker_image_ids
+                              for container in self.client.containers.list(filters={"ancestor": docker_image_id})]
 
                 # Kill all running containers and update their statuses in the db if they exist.
                 for container in containers:
@@ -318,8 +438,8 @@ class DockerManager:
                     # Update job status in DB
                     jobs = DockerJobs.get_by_container_id(container_id, session=session)
                     for job in jobs:
-                        job.set_killed()
-                        session.add(job)
+                        job.set_finished(JobStatus.KILLED.value, session)
+                    killed_jobs.extend(jobs)
                     session.flush()
 
                 # Get all scripts that use image id
@@ -333,6 +453,8 @@ class DockerManager:
                 image_files = DockerImageFiles.get_by_image_id(_id, session)
                 for file in image_files:
                     session.delete(file)
+                for version in versions:
+                    session.delete(version)
                 session.flush()
 
                 # Delete image from the database
@@ -340,8 +462,8 @@ class DockerManager:
                 session.flush()
 
                 # Delete Image from Docker env
-                if image_id is not None:
-                    self.delete_image_from_env(image_id)
+                for docker_image_id in docker_image_ids:
+                    self.delete_image_from_env(docker_image_id)
 
                 # Delete image from fs
                 image_dir = os.path.join(config.IMAGE_DIR, _id)
@@ -351,6 +473,8 @@ class DockerManager:
                     logger.warning("Could not find image directory with ID: '{}'".format(_id))
 
                 session.commit()
+                for job in killed_jobs:
+                    publish_job_event(job, "killed")
             except Exception as e:
                 session.rollback()
                 raise e
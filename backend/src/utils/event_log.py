@@ -0,0 +1,30 @@
+import json
+import logging
+import typing
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def get_logger(name: str, level: int = logging.INFO) -> logging.Logger:
+    """Logger of a module, writing to stderr."""
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logger.addHandler(handler)
+    return logger
+
+
+def event_logger(logger: logging.Logger) -> typing.Callable[..., None]:
+    """`log_event` of a module: logs an event about a resource as a JSON object."""
+
+    def log_event(level: int, message: str | None, resource_id: str | int | None, error: str | None = None):
+        log_object = {"message": message}
+        if error is not None:
+            log_object["error"] = error
+        if resource_id is not None:
+            log_object["resource_id"] = resource_id
+        logger.log(level, json.dumps(log_object))
+
+    return log_event
@@ -0,0 +1,232 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import traceback
+import typing
+from typing import Optional
+
+import pika
+import pika.exceptions
+from starlette.requests import Request
+
+from src.factory.conf import config
+from src.utils.log_stream import format_event
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+logger.addHandler(handler)
+
+EXCHANGE = "scripter.events"
+JOB_TOPIC = "job"
+# Invalidations of in-process caches, applied by every API process.
+CACHE_TOPIC = "cache"
+
+
+class Subscription:
+    """A subscriber's bounded queue of events, bound to the event loop it was created on."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, topics: Optional[typing.Set[str]] = None,
+                 predicate: Optional[typing.Callable[[dict], bool]] = None, maxsize: int = 1000):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.topics = topics
+        self.predicate = predicate
+        # Set when events had to be dropped because the subscriber fell behind.
+        self.overflowed = False
+
+    def matches(self, event: dict) -> bool:
+        if self.topics is not None and event.get("topic") not in self.topics:
+            return False
+        return self.predicate is None or self.predicate(event)
+
+    def deliver(self, event: dict) -> None:
+        """Thread-safe delivery from the consumer thread onto the subscriber's event loop."""
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # Event loop already closed
+            pass
+
+    def _put(self, event: dict) -> None:
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout: float) -> Optional[dict]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventBus:
+    """
+    In-process publish/subscribe of lifecycle events. Events are published to a fanout exchange on the RabbitMQ broker
+    which every process consuming events (the API) binds its own exclusive queue to, so events published by the worker
+    or scheduler reach the subscribers of every API process. When the broker cannot be reached events are still
+    delivered to the subscribers of the publishing process.
+    """
+
+    def __init__(self, host: str, port: int = 5672):
+        self.parameters = pika.ConnectionParameters(host=host, port=port)
+        self.subscriptions: typing.Set[Subscription] = set()
+        self.listeners: typing.List[typing.Tuple[Optional[typing.Set[str]], typing.Callable[[dict], None]]] = []
+        self.lock = threading.Lock()
+        self.publish_lock = threading.Lock()
+        self.channel = None
+        self.consumer: Optional[threading.Thread] = None
+
+    def publish(self, topic: str, action: str, data: dict) -> None:
+        event = {"topic": topic, "action": action, "data": data, "timestamp": time.time()}
+        try:
+            self._publish_remote(event)
+        except Exception:
+            logger.warning(json.dumps({"message": "Failed to publish event to broker", "error": traceback.format_exc()}))
+            self.dispatch(event)
+
+    def _publish_remote(self, event: dict) -> None:
+        body = json.dumps(event)
+        # BlockingConnection is not thread-safe, and dramatiq runs actors in several threads per process.
+        with self.publish_lock:
+            for attempt in range(2):
+                try:
+                    if self.channel is None or self.channel.is_closed:
+                        self.channel = pika.BlockingConnection(self.parameters).channel()
+                        self.channel.exchange_declare(exchange=EXCHANGE, exchange_type="fanout", durable=True)
+                    self.channel.basic_publish(exchange=EXCHANGE, routing_key=event["topic"], body=body)
+                    return
+                except pika.exceptions.AMQPError:
+                    # Idle publisher connections are dropped by the broker, reconnect once before giving up.
+                    self.channel = None
+                    if attempt == 1:
+                        raise
+
+    def subscribe(self, topics: Optional[typing.Set[str]] = None, predicate: Optional[typing.Callable[[dict], bool]] = None) -> Subscription:
+        """Subscribe the running event loop to events. Must be called from within a coroutine."""
+        self.start_consumer()
+        subscription = Subscription(asyncio.get_running_loop(), topics=topics, predicate=predicate)
+        with self.lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def add_listener(self, callback: typing.Callable[[dict], None], topics: Optional[typing.Set[str]] = None) -> None:
+        """
+        Call `callback` with every event of the given topics, on the thread receiving the event. Listeners do not start
+        the consumer, so they only hear events published by other processes in processes that consume events.
+        """
+        with self.lock:
+            self.listeners.append((topics, callback))
+
+    def dispatch(self, event: dict) -> None:
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+            listeners = list(self.listeners)
+        for topics, callback in listeners:
+            if topics is None or event.get("topic") in topics:
+                try:
+                    callback(event)
+                except Exception:
+                    logger.error(json.dumps({"message": "Event listener failed", "error": traceback.format_exc()}))
+        for subscription in subscriptions:
+            if subscription.matches(event):
+                subscription.deliver(event)
+
+    def start_consumer(self) -> None:
+        with self.lock:
+            if self.consumer is None or not self.consumer.is_alive():
+                self.consumer = threading.Thread(target=self._consume, name="event-bus-consumer", daemon=True)
+                self.consumer.start()
+
+    def _consume(self) -> None:
+        backoff = 1
+        while True:
+            try:
+                connection = pika.BlockingConnection(self.parameters)
+                channel = connection.channel()
+                channel.exchange_declare(exchange=EXCHANGE, exchange_type="fanout", durable=True)
+                queue = channel.queue_declare(queue="", exclusive=True, auto_delete=True).method.queue
+                channel.queue_bind(exchange=EXCHANGE, queue=queue)
+                backoff = 1
+                for _, _, body in channel.consume(queue, auto_ack=True):
+                    self.dispatch(json.loads(body))
+            except Exception:
+                logger.error(json.dumps({"message": "Event consumer disconnected, reconnecting in {}s".format(backoff), "error": traceback.format_exc()}))
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+
+event_bus = EventBus(host=config.BROKER_URL)
+
+# Invalidation callbacks of the caches of this process by name, called with the key prefix to invalidate or None.
+caches: typing.Dict[str, typing.Callable[[Optional[tuple]], None]] = {}
+
+
+def register_cache(name: str, invalidate: typing.Callable[[Optional[tuple]], None]) -> None:
+    caches[name] = invalidate
+
+
+def invalidate_cache(name: str, key: Optional[tuple] = None) -> None:
+    """
+    Invalidate the entries of a cache whose key starts with `key` (all entries when None) in this process right away,
+    and in every API process through the broker. Must be called after the change has been committed.
+    """
+    apply_invalidation(name, key)
+    event_bus.publish(CACHE_TOPIC, "invalidate", {"cache": name, "key": list(key) if key is not None else None})
+
+
+def apply_invalidation(name: str, key: Optional[tuple]) -> None:
+    invalidate = caches.get(name)
+    if invalidate is not None:
+        invalidate(key)
+
+
+def on_cache_event(event: dict) -> None:
+    key = event["data"].get("key")
+    apply_invalidation(event["data"]["cache"], tuple(key) if key is not None else None)
+
+
+event_bus.add_listener(on_cache_event, topics={CACHE_TOPIC})
+
+
+def job_snapshot(job) -> dict:
+    """The state of a job as published in its events."""
+    # Attributes are read one by one so that ones expired by the commit are reloaded from the session.
+    return {name: getattr(job, name) for name in type(job).model_fields if name != "logs"}
+
+
+def publish_job_event(job, action: str) -> None:
+    """
+    Publish a job lifecycle event. Must be called after the job's state has been committed.
+    :param job: The job, or a snapshot of its state taken with `job_snapshot`.
+    """
+    try:
+        data = job if isinstance(job, dict) else job_snapshot(job)
+        event_bus.publish(JOB_TOPIC, action, data)
+    except Exception:
+        logger.error(json.dumps({"message": "Failed to publish job event", "error": traceback.format_exc()}))
+
+
+async def stream_events(request: Request, subscription: Subscription, heartbeat_interval: float = 15.0) -> typing.AsyncIterator[str]:
+    """Stream a subscription's events as Server-Sent Events, named after the event's topic."""
+    try:
+        while not await request.is_disconnected():
+            event = await subscription.get(timeout=heartbeat_interval)
+            if subscription.overflowed:
+                # Events were dropped, the client has to reload its state.
+                subscription.overflowed = False
+                yield format_event("resync", {})
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield format_event(event["topic"], event)
+    finally:
+        event_bus.unsubscribe(subscription)
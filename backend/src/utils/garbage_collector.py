@@ -0,0 +1,391 @@
+import json
+import logging
+import os
+import shutil
+import time
+import traceback
+import typing
+from datetime import datetime
+from typing import Optional
+
+import docker
+import docker.errors
+import pytz
+from sqlalchemy import func, Select, delete
+from sqlmodel import Session, select, col, or_
+
+from src.db_models import DockerImage, DockerImageFiles, DockerImageVersions, DockerJobs, DockerJobsArchive, DockerScripts, DockerScheduled, DockerScriptVersions
+from src.enums import ImageStatus, JobStatus
+from src.factory import config
+from src.factory.database import engine
+from src.utils.blob_store import blob_store, MISSING_DIGEST
+from src.utils.image_versions import remove_version_dir
+from src.utils.job_logs import get_log_dir, get_log_name, get_log_path, get_size, remove_log_files
+from src.utils.log_search import remove_from_search_index
+from src.utils.event_log import get_logger, event_logger
+
+logger = get_logger(__name__)
+log_event = event_logger(logger)
+
+# Labels attached to containers and images created by scripter, so that only our own resources are ever collected.
+JOB_LABEL = "scripter.job"
+IMAGE_LABEL = "scripter.image"
+IMAGE_VERSION_LABEL = "scripter.image.version"
+
+
+class GarbageCollectionReport:
+
+    def __init__(self):
+        self.started_at = int(datetime.now(tz=pytz.utc).timestamp())
+        self.duration: float = 0.0
+        self.removed: typing.Dict[str, int] = {
+            "jobs": 0,
+            "log_files": 0,
+            "scripts": 0,
+            "directories": 0,
+            "containers": 0,
+            "images": 0,
+            "image_versions": 0,
+            "blobs": 0,
+            "deduplicated_files": 0,
+        }
+        self.bytes_reclaimed: int = 0
+        self.errors: typing.List[str] = []
+
+    def add(self, kind: str, count: int = 1, reclaimed: int = 0):
+        self.removed[kind] += count
+        self.bytes_reclaimed += reclaimed
+
+    def to_dict(self) -> dict:
+        return {
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "removed": self.removed,
+            "bytes_reclaimed": self.bytes_reclaimed,
+            "errors": self.errors,
+        }
+
+
+class GarbageCollector:
+    """
+    Enforces the configured retention policies on the database, the data directory and the docker environment.
+    Every phase handles at most `batch_size` items per run so a single run stays short; whatever is left over is picked
+    up by the next scheduled run.
+    """
+
+    def __init__(
+            self,
+            batch_size: Optional[int] = None,
+            keep_jobs: Optional[int] = None,
+            max_age_days: Optional[int] = None,
+            grace_period: Optional[int] = None):
+        self.batch_size = batch_size if batch_size is not None else config.GC_BATCH_SIZE
+        self.keep_jobs = keep_jobs if keep_jobs is not None else config.GC_KEEP_JOBS_PER_SCRIPT
+        self.max_age_days = max_age_days if max_age_days is not None else config.GC_MAX_JOB_AGE_DAYS
+        self.grace_period = grace_period if grace_period is not None else config.GC_GRACE_PERIOD_SECONDS
+        self._client: Optional[docker.DockerClient] = None
+        self.report = GarbageCollectionReport()
+
+    @property
+    def client(self) -> docker.DockerClient:
+        if self._client is None:
+            self._client = docker.from_env()
+        return self._client
+
+    def run(self) -> GarbageCollectionReport:
+        start = time.monotonic()
+        for phase in (
+                self.collect_expired_jobs,
+                self.collect_deleted_scripts,
+                self.collect_orphaned_logs,
+                self.collect_orphaned_directories,
+                self.deduplicate_files,
+                self.collect_blobs,
+                self.collect_containers,
+                self.collect_image_versions,
+                self.collect_images):
+            try:
+                phase()
+            except Exception:
+                log_event(logging.ERROR, "Garbage collection phase '{}' failed".format(phase.__name__), None, error=traceback.format_exc())
+                self.report.errors.append(phase.__name__)
+        self.report.duration = round(time.monotonic() - start, 3)
+        self.save_report()
+        logger.info(json.dumps({"message": "Garbage collection finished", **self.report.to_dict()}))
+        return self.report
+
+    def is_stale(self, path: str) -> bool:
+        """Files and directories are only collected once they have not been touched for the grace period, so that
+        resources that are still being created (directory first, database record second) are left alone."""
+        try:
+            return time.time() - os.path.getmtime(path) > self.grace_period
+        except FileNotFoundError:
+            return False
+
+    def delete_jobs(self, jobs: typing.Sequence[DockerJobs | DockerJobsArchive], session: Session) -> None:
+        job_ids = [job.id for job in jobs]
+        for job in jobs:
+            if job.logs is not None:
+                reclaimed = remove_log_files(get_log_path(job.script_id, job.logs))
+                self.report.add("log_files", reclaimed=reclaimed)
+            session.delete(job)
+            self.report.add("jobs")
+        session.commit()
+        remove_from_search_index(job_ids)
+
+    def collect_expired_jobs(self) -> None:
+        """
+        Remove finished jobs beyond the newest `keep_jobs` per script or older than `max_age_days`. Archived jobs only
+        expire by age, they are not counted towards `keep_jobs`.
+        """
+        if not self.keep_jobs and not self.max_age_days:
+            return
+        if self.max_age_days:
+            cutoff = int(datetime.now(tz=pytz.utc).timestamp()) - self.max_age_days * 86400
+            with Session(engine) as session:
+                archived = session.exec(typing.cast(Select, select(DockerJobsArchive).where(
+                    DockerJobsArchive.created_at < cutoff).order_by(col(DockerJobsArchive.created_at)).limit(self.batch_size))).all()
+                if len(archived) > 0:
+                    self.delete_jobs(archived, session)
+        terminal = [status.value for status in JobStatus.get_deletable()]
+        rank = func.row_number().over(partition_by=DockerJobs.script_id, order_by=col(DockerJobs.id).desc()).label("rank")
+        ranked = select(DockerJobs.id, DockerJobs.created_at, rank).where(col(DockerJobs.status).in_(terminal)).subquery()
+
+        conditions = []
+        if self.keep_jobs:
+            conditions.append(ranked.c.rank > self.keep_jobs)
+        if self.max_age_days:
+            cutoff = int(datetime.now(tz=pytz.utc).timestamp()) - self.max_age_days * 86400
+            conditions.append(ranked.c.created_at < cutoff)
+
+        with Session(engine) as session:
+            job_ids = session.exec(typing.cast(Select, select(ranked.c.id).where(or_(*conditions)).limit(self.batch_size))).all()
+            if len(job_ids) == 0:
+                return
+            jobs = session.exec(typing.cast(Select, select(DockerJobs).where(col(DockerJobs.id).in_(job_ids)))).all()
+            self.delete_jobs(jobs, session)
+
+    def collect_deleted_scripts(self) -> None:
+        """Remove the jobs, schedules, code versions and data directory of soft-deleted scripts. The script record
+        itself is kept so the script's edit history stays resolvable."""
+        with Session(engine) as session:
+            scripts = session.exec(typing.cast(Select, select(DockerScripts).where(col(DockerScripts.deleted).is_(True)))).all()
+            budget = self.batch_size
+            for script in scripts:
+                if budget <= 0:
+                    return
+                jobs = session.exec(typing.cast(Select, select(DockerJobs).where(
+                    DockerJobs.script_id == script.id,
+                    col(DockerJobs.status).in_([status.value for status in JobStatus.get_deletable()])
+                ).limit(budget))).all()
+                budget -= len(jobs)
+                self.delete_jobs(jobs, session)
+                archived = session.exec(typing.cast(Select, select(DockerJobsArchive).where(
+                    DockerJobsArchive.script_id == script.id).limit(max(budget, 0)))).all()
+                budget -= len(archived)
+                self.delete_jobs(archived, session)
+
+                for schedule in DockerScheduled.get_by_script_id(script.id, session):
+                    session.delete(schedule)
+                session.commit()
+
+                script_dir = os.path.join(config.SCRIPT_DIR, script.id)
+                if budget > 0 and len(DockerJobs.get_running_jobs(script.id, session)) == 0:
+                    # The version records point into versions.pack, they go with it. Also removed for scripts whose
+                    # directory is gone already.
+                    session.execute(delete(DockerScriptVersions).where(col(DockerScriptVersions.script_id) == script.id))
+                    session.commit()
+                if budget > 0 and os.path.exists(script_dir) and len(DockerJobs.get_running_jobs(script.id, session)) == 0:
+                    reclaimed = get_size(script_dir)
+                    shutil.rmtree(script_dir)
+                    self.report.add("scripts", reclaimed=reclaimed)
+                    budget -= 1
+
+    def collect_orphaned_logs(self) -> None:
+        """Remove log files in a script's logs directory that no job refers to any more."""
+        budget = self.batch_size
+        with Session(engine) as session:
+            script_ids = session.exec(typing.cast(Select, select(DockerScripts.id).where(col(DockerScripts.deleted).is_(False)))).all()
+            for script_id in script_ids:
+                log_dir = get_log_dir(script_id)
+                if not os.path.isdir(log_dir):
+                    continue
+                referenced = set(session.exec(typing.cast(Select, select(DockerJobs.logs).where(
+                    DockerJobs.script_id == script_id, col(DockerJobs.logs).is_not(None)))).all())
+                referenced.update(session.exec(typing.cast(Select, select(DockerJobsArchive.logs).where(
+                    DockerJobsArchive.script_id == script_id, col(DockerJobsArchive.logs).is_not(None)))).all())
+                for name in os.listdir(log_dir):
+                    if budget <= 0:
+                        return
+                    # Segment and sidecar files (e.g. "<log>.1.gz") belong to the log they are named after.
+                    if get_log_name(name) in referenced:
+                        continue
+                    path = os.path.join(log_dir, name)
+                    if not os.path.isfile(path) or not self.is_stale(path):
+                        continue
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                    self.report.add("log_files", reclaimed=size)
+                    budget -= 1
+
+    def collect_orphaned_directories(self) -> None:
+        """Remove image and script directories that have no corresponding database record."""
+        budget = self.batch_size
+        with Session(engine) as session:
+            image_ids = set(session.exec(typing.cast(Select, select(DockerImage.id))).all())
+            script_ids = set(session.exec(typing.cast(Select, select(DockerScripts.id))).all())
+        for root, known in ((config.IMAGE_DIR, image_ids), (config.SCRIPT_DIR, script_ids)):
+            for name in os.listdir(root):
+                if budget <= 0:
+                    return
+                path = os.path.join(root, name)
+                if name in known or not os.path.isdir(path) or not self.is_stale(path):
+                    continue
+                reclaimed = get_size(path)
+                shutil.rmtree(path)
+                self.report.add("directories", reclaimed=reclaimed)
+                budget -= 1
+
+    def deduplicate_files(self) -> None:
+        """Move image files and script sources saved before the blob store existed into it."""
+        budget = self.batch_size
+        with Session(engine) as session:
+            image_files = session.exec(typing.cast(Select, select(DockerImageFiles).where(
+                col(DockerImageFiles.sha256).is_(None)).limit(budget))).all()
+            for image_file in image_files:
+                path = os.path.join(config.IMAGE_DIR, image_file.image_id, "src", image_file.filepath)
+                if os.path.isfile(path):
+                    image_file.sha256 = blob_store.adopt(path)
+                    self.report.add("deduplicated_files")
+                else:
+                    # Marked, so that the file is not selected again on every run.
+                    image_file.sha256 = MISSING_DIGEST
+                session.add(image_file)
+            session.commit()
+            budget -= len(image_files)
+            if budget <= 0:
+                return
+
+            scripts = session.exec(typing.cast(Select, select(DockerScripts).where(
+                col(DockerScripts.code_sha256).is_(None), col(DockerScripts.deleted).is_(False)).limit(budget))).all()
+            for script in scripts:
+                path = os.path.join(config.SCRIPT_DIR, script.id, "src", "script")
+                if os.path.isfile(path):
+                    script.code_sha256 = blob_store.adopt(path)
+                    self.report.add("deduplicated_files")
+                else:
+                    script.code_sha256 = MISSING_DIGEST
+                session.add(script)
+            session.commit()
+
+    def collect_blobs(self) -> None:
+        """Remove blobs that are not linked to by any image or script anymore, and interrupted uploads."""
+        budget = self.batch_size
+        for path in blob_store.iter_temp_files():
+            if budget <= 0:
+                return
+            if self.is_stale(path):
+                reclaimed = os.path.getsize(path)
+                os.remove(path)
+                self.report.add("blobs", reclaimed=reclaimed)
+                budget -= 1
+        # Link counts cannot tell whether a blob is used, blobs are copied where hardlinks are not supported.
+        with Session(engine) as session:
+            referenced = set(session.exec(typing.cast(Select, select(DockerImageFiles.sha256).where(
+                col(DockerImageFiles.sha256).is_not(None)).distinct())).all())
+            referenced.update(session.exec(typing.cast(Select, select(DockerScripts.code_sha256).where(
+                col(DockerScripts.code_sha256).is_not(None)).distinct())).all())
+        for path, stat in blob_store.iter_blobs():
+            if budget <= 0:
+                return
+            # Blobs stored or reused within the grace period may belong to an upload that is not committed yet.
+            if os.path.basename(path) not in referenced and time.time() - stat.st_mtime > self.grace_period:
+                os.remove(path)
+                self.report.add("blobs", reclaimed=stat.st_size)
+                budget -= 1
+
+    def collect_containers(self) -> None:
+        """Remove stopped job containers left behind by crashed workers."""
+        result = self.client.containers.prune(filters={"label": JOB_LABEL})
+        self.report.add("containers", count=len(result.get("ContainersDeleted") or []), reclaimed=result.get("SpaceReclaimed") or 0)
+
+    def collect_image_versions(self) -> None:
+        """
+        Retire built image versions beyond the newest `GC_KEEP_IMAGE_VERSIONS` that the image could be rolled back to, and
+        the sources of versions that failed to build. The version records are kept as the image's build history.
+        """
+        budget = self.batch_size
+        with Session(engine) as session:
+            active = {image.id: image.version for image in session.exec(typing.cast(Select, select(DockerImage))).all()}
+            versions = session.exec(typing.cast(Select, select(DockerImageVersions).where(col(DockerImageVersions.status).in_(
+                [ImageStatus.BUILD_SUCCESS.value, ImageStatus.BUILD_FAILED.value])).order_by(col(DockerImageVersions.version).desc()))).all()
+            kept: typing.Dict[str, int] = {}
+            for version in versions:
+                if budget <= 0:
+                    break
+                if version.version == active.get(version.image_id):
+                    continue
+                if version.status == ImageStatus.BUILD_SUCCESS.value:
+                    kept[version.image_id] = kept.get(version.image_id, 0) + 1
+                    if kept[version.image_id] <= config.GC_KEEP_IMAGE_VERSIONS:
+                        continue
+                    try:
+                        # Removing the tag only deletes the image once no other version's tag refers to it.
+                        self.client.images.remove(version.docker_tag or version.docker_image_id)
+                        self.report.add("images")
+                    except docker.errors.ImageNotFound:
+                        pass
+                    except docker.errors.APIError as e:
+                        # Most likely still in use by a container; it will be retried on the next run.
+                        log_event(logging.WARNING, "Could not remove image version", version.docker_tag, error=str(e))
+                        continue
+                remove_version_dir(version.image_id, version.version)
+                version.status = ImageStatus.DORMANT.value
+                session.add(version)
+                self.report.add("image_versions")
+                budget -= 1
+            session.commit()
+
+    def collect_images(self) -> None:
+        """Remove dangling images from rebuilds and images whose database record is gone or points to a newer build."""
+        result = self.client.images.prune(filters={"dangling": True, "label": IMAGE_LABEL})
+        self.report.add("images", count=len(result.get("ImagesDeleted") or []), reclaimed=result.get("SpaceReclaimed") or 0)
+
+        with Session(engine) as session:
+            images = {image.id: image for image in session.exec(typing.cast(Select, select(DockerImage))).all()}
+            versions = session.exec(typing.cast(Select, select(DockerImageVersions).where(col(DockerImageVersions.status).in_(
+                [ImageStatus.BUILDING.value, ImageStatus.BUILD_SUCCESS.value])))).all()
+        building = {version.image_id for version in versions if version.status == ImageStatus.BUILDING.value}
+        # Versions that can be rolled back to, see collect_image_versions.
+        retained = [version.docker_image_id for version in versions if version.docker_image_id is not None]
+        budget = self.batch_size
+        for docker_image in self.client.images.list(filters={"label": IMAGE_LABEL}):
+            if budget <= 0:
+                return
+            owner = images.get(docker_image.labels.get(IMAGE_LABEL))
+            if owner is not None and (owner.status == ImageStatus.BUILDING.value or owner.id in building):
+                # The build may have produced the image but not yet recorded it.
+                continue
+            if owner is not None and owner.image_id is not None and owner.image_id in docker_image.id:
+                continue
+            if any(docker_image_id in docker_image.id for docker_image_id in retained):
+                continue
+            try:
+                self.client.images.remove(docker_image.id)
+                self.report.add("images", reclaimed=docker_image.attrs.get("Size", 0))
+                budget -= 1
+            except docker.errors.APIError as e:
+                # Most likely still in use by a container; it will be retried on the next run.
+                log_event(logging.WARNING, "Could not remove image", docker_image.id, error=str(e))
+
+    def save_report(self) -> None:
+        with open(os.path.join(config.DATA_DIR, "gc_report.json"), "w") as f:
+            json.dump(self.report.to_dict(), f)
+
+    @staticmethod
+    def load_report() -> Optional[dict]:
+        path = os.path.join(config.DATA_DIR, "gc_report.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
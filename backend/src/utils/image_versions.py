@@ -0,0 +1,39 @@
+import os
+import shutil
+
+from src.factory import config
+from src.utils.blob_store import clone_file
+
+
+def get_version_dir(image_id: str, version: int) -> str:
+    return os.path.join(config.IMAGE_DIR, image_id, "versions", str(version))
+
+
+def snapshot_src(image_id: str, version: int) -> str:
+    """
+    Freeze the image's src directory as the source of a version. Files are hardlinked, which is cheap, and safe since
+    files in the src directory are replaced on update rather than modified in place.
+    :return: The version's directory.
+    """
+    src_dir = os.path.join(config.IMAGE_DIR, image_id, "src")
+    version_dir = get_version_dir(image_id, version)
+    snapshot_dir = os.path.join(version_dir, "src")
+    if os.path.exists(version_dir):
+        # Left over by a request that failed before its version was recorded.
+        shutil.rmtree(version_dir)
+    for root, _, files in os.walk(src_dir):
+        target_root = os.path.join(snapshot_dir, os.path.relpath(root, src_dir))
+        os.makedirs(target_root, exist_ok=True)
+        for name in files:
+            source, target = os.path.join(root, name), os.path.join(target_root, name)
+            try:
+                os.link(source, target)
+            except OSError:
+                clone_file(source, target)
+    return version_dir
+
+
+def remove_version_dir(image_id: str, version: int) -> None:
+    version_dir = get_version_dir(image_id, version)
+    if os.path.exists(version_dir):
+        shutil.rmtree(version_dir)
@@ -0,0 +1,82 @@
+import json
+import time
+import typing
+from datetime import datetime
+from typing import Optional
+
+import pytz
+from sqlalchemy import Select, Row, delete, literal_column, union_all
+from sqlmodel import Session, select, col
+
+from src.db_models import DockerJobs, DockerJobsArchive
+from src.enums import JobStatus
+from src.factory import config
+from src.factory.database import engine
+from src.utils.events import invalidate_cache
+from src.utils.pagination import COUNT_CACHE
+from src.utils.event_log import get_logger
+
+logger = get_logger(__name__)
+
+
+def all_jobs_after(last_id: int, limit: int, session: Session,
+                   where: typing.Callable[[typing.Any], list] = lambda model: []) -> typing.Sequence[Row]:
+    """
+    Up to `limit` jobs with an ID greater than `last_id`, archived or not, in ascending ID order. Both tables are read
+    in a single statement, so a job moved by the archiver in the meantime is returned exactly once.
+    :param where: Additional conditions of the jobs, given the model (DockerJobs or DockerJobsArchive) to apply them to.
+    :return: Rows with the columns of DockerJobs.
+    """
+    names = list(DockerJobs.model_fields)
+    live, archived = [
+        select(*[getattr(model, name) for name in names]).where(model.id > last_id, *where(model))
+        for model in (DockerJobs, DockerJobsArchive)
+    ]
+    return session.execute(union_all(live, archived).order_by(literal_column("id")).limit(limit)).all()
+
+
+class JobArchiver:
+    """
+    Moves finished jobs older than `after_days` from DockerJobs to DockerJobsArchive, keeping the table the scheduler,
+    runner and job history read from small. Jobs keep their IDs and log files, and remain readable through the history
+    and log endpoints. Every batch of `batch_size` jobs is moved in its own transaction and a run stops after
+    `max_batches`, whatever is left over is picked up by the next scheduled run.
+    """
+
+    def __init__(self, after_days: Optional[int] = None, batch_size: Optional[int] = None, max_batches: Optional[int] = None):
+        self.after_days = after_days if after_days is not None else config.JOB_ARCHIVE_AFTER_DAYS
+        self.batch_size = batch_size if batch_size is not None else config.JOB_ARCHIVE_BATCH_SIZE
+        self.max_batches = max_batches if max_batches is not None else config.JOB_ARCHIVE_MAX_BATCHES
+
+    def run(self) -> int:
+        """:return: Number of jobs archived."""
+        if not self.after_days or self.batch_size <= 0:
+            return 0
+        start = time.monotonic()
+        cutoff = int(datetime.now(tz=pytz.utc).timestamp()) - self.after_days * 86400
+        archived = 0
+        for _ in range(self.max_batches):
+            moved = self.archive_batch(cutoff)
+            archived += moved
+            if moved < self.batch_size:
+                break
+        if archived:
+            invalidate_cache(COUNT_CACHE, ("jobs",))
+        logger.info(json.dumps({"message": "Job archiving finished", "archived": archived,
+                                "duration": round(time.monotonic() - start, 3)}))
+        return archived
+
+    def archive_batch(self, cutoff: int) -> int:
+        """Move up to `batch_size` finished jobs created before `cutoff`, oldest first."""
+        terminal = [status.value for status in JobStatus.get_deletable()]
+        with Session(engine) as session:
+            # Jobs locked by someone else (e.g. being deleted) are left for the next batch.
+            jobs = session.exec(typing.cast(Select, select(DockerJobs).where(
+                col(DockerJobs.status).in_(terminal), DockerJobs.created_at < cutoff
+            ).order_by(col(DockerJobs.id)).limit(self.batch_size).with_for_update(skip_locked=True))).all()
+            if len(jobs) == 0:
+                return 0
+            session.add_all([DockerJobsArchive(**job.model_dump()) for job in jobs])
+            session.execute(delete(DockerJobs).where(col(DockerJobs.id).in_([job.id for job in jobs])))
+            session.commit()
+            return len(jobs)
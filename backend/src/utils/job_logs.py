@@ -0,0 +1,825 @@
+import bisect
+import glob
+import gzip
+import json
+import os
+import zlib
+import typing
+from datetime import datetime, timezone
+from typing import Optional
+
+from src.factory import config
+
+TRUNCATED_MARKER = "[... {} bytes truncated ...]\n"
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+STREAMS = ("stdout", "stderr")
+READ_CHUNK_BYTES = 64 * 1024
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+# Suffixes of the files belonging to a log besides its numbered segments: compressed segments, the segment manifest,
+# line and time indexes, and files still being written.
+LOG_FILE_SUFFIXES = (".gz", ".segments", ".lines", ".times", ".tmp")
+
+
+class LogNotTimestamped(Exception):
+    pass
+
+
+def format_timestamped_line(timestamp: float, stream: str, text: str) -> str:
+    """A line of the timestamped log format: "<RFC 3339 UTC timestamp> <stdout|stderr> <text>"."""
+    return "{} {} {}".format(datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime(TIMESTAMP_FORMAT), stream, text)
+
+
+def parse_timestamp(value: str) -> float:
+    """Parse an RFC 3339 UTC timestamp as used by the docker daemon, which has nanosecond precision."""
+    seconds, _, fraction = value.rstrip("Z").partition(".")
+    parsed = datetime.strptime(seconds, "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+    return parsed + float("0." + fraction[:6]) if fraction else parsed
+
+
+def parse_timestamped_line(line: str) -> Optional[typing.Tuple[float, str, str]]:
+    """Split a line of the timestamped log format into (timestamp, stream, text), None if it isn't one."""
+    parts = line.split(" ", 2)
+    if len(parts) < 2 or parts[1].rstrip("\n") not in STREAMS:
+        return None
+    try:
+        timestamp = parse_timestamp(parts[0])
+    except ValueError:
+        return None
+    return timestamp, parts[1].rstrip("\n"), parts[2] if len(parts) == 3 else "\n"
+
+
+def is_truncation(entry: typing.Tuple[str, int, int]) -> bool:
+    """Whether an entry returned by `JobLogReader.read_entries` is the marker of truncated output."""
+    text, start, end = entry
+    return text == TRUNCATED_MARKER.format(end - start)
+
+
+def get_log_dir(script_id: str) -> str:
+    return os.path.join(config.SCRIPT_DIR, script_id, "logs")
+
+
+def get_log_path(script_id: str, log_name: str) -> str:
+    """Absolute path of a job's log file given the basename stored in DockerJobs.logs."""
+    return os.path.join(get_log_dir(script_id), log_name)
+
+
+def get_log_name(file_name: str) -> str:
+    """Name of the log a file in a logs directory belongs to: the file name without segment and sidecar suffixes."""
+    while True:
+        base, suffix = os.path.splitext(file_name)
+        if suffix not in LOG_FILE_SUFFIXES and not suffix[1:].isdigit():
+            return file_name
+        file_name = base
+
+
+def get_log_files(log_path: str) -> typing.List[str]:
+    """All files on the filesystem that belong to a job's log (segments and sidecar files)."""
+    return [path for path in [log_path, *glob.glob(glob.escape(log_path) + ".*")] if os.path.isfile(path)]
+
+
+def get_size(path: str) -> int:
+    """Size of a file, or the total size of all files inside a directory."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                continue
+    return total
+
+
+def remove_log_files(log_path: str) -> int:
+    """
+    Remove every file that belongs to a job's log.
+    :return: Number of bytes reclaimed.
+    """
+    reclaimed = 0
+    for path in get_log_files(log_path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            reclaimed += size
+        except FileNotFoundError:
+            continue
+    return reclaimed
+
+
+class LogLimits:
+    """
+    Size caps applied while a job's output is written. The first `head_bytes` of the output are always kept, after which
+    output is written to rotating segments of `segment_bytes` of which only the newest `tail_bytes` are kept.
+    A cap of 0 disables it; with both caps disabled the log is a single unbounded file.
+    """
+
+    def __init__(self, head_bytes: int = 0, tail_bytes: int = 0, segment_bytes: int = 0):
+        self.head_bytes = max(head_bytes, 0)
+        self.tail_bytes = max(tail_bytes, 0)
+        segment_bytes = segment_bytes if segment_bytes > 0 else self.tail_bytes
+        self.segment_bytes = min(segment_bytes, self.tail_bytes) if self.tail_bytes else segment_bytes
+
+    @property
+    def unlimited(self) -> bool:
+        return self.head_bytes == 0 and self.tail_bytes == 0
+
+    @property
+    def max_tail_segments(self) -> int:
+        return max(self.tail_bytes // max(self.segment_bytes, 1), 1)
+
+    @classmethod
+    def for_script(cls, script) -> typing.Self:
+        """Script specific caps take precedence over the global configuration."""
+        head = script.log_head_bytes if script is not None and script.log_head_bytes is not None else config.LOG_HEAD_BYTES
+        tail = script.log_tail_bytes if script is not None and script.log_tail_bytes is not None else config.LOG_TAIL_BYTES
+        return cls(head_bytes=head, tail_bytes=tail, segment_bytes=config.LOG_SEGMENT_BYTES)
+
+
+class LogSegment:
+
+    def __init__(self, index: int, offset: int, size: int = 0, dropped: bool = False, compressed: bool = False,
+                 blocks: Optional[typing.List[typing.List[int]]] = None):
+        self.index = index
+        self.offset = offset
+        self.size = size
+        self.dropped = dropped
+        self.compressed = compressed
+        # Seek index of a compressed segment: [uncompressed offset, compressed offset] of every gzip member.
+        self.blocks = blocks or []
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+    def path(self, log_path: str) -> str:
+        path = log_path if self.index == 0 else "{}.{}".format(log_path, self.index)
+        return path + ".gz" if self.compressed else path
+
+    def to_dict(self) -> dict:
+        data = {"index": self.index, "offset": self.offset, "size": self.size, "dropped": self.dropped}
+        if self.compressed:
+            data.update({"compressed": True, "blocks": self.blocks})
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> typing.Self:
+        return cls(index=data["index"], offset=data["offset"], size=data["size"], dropped=data.get("dropped", False),
+                   compressed=data.get("compressed", False), blocks=data.get("blocks"))
+
+
+class SegmentManifest:
+    """
+    Describes how a job's log is split over segment files. Offsets are logical byte positions in the job's complete
+    output, so a position handed out to a client stays valid across rotations, even after the segment it pointed into
+    has been dropped. Logs written without rotation have no manifest file and consist of a single segment.
+    """
+
+    def __init__(self, log_path: str, segments: typing.List[LogSegment], closed: bool = False):
+        self.log_path = log_path
+        self.segments = segments
+        self.closed = closed
+
+    @staticmethod
+    def manifest_path(log_path: str) -> str:
+        return log_path + ".segments"
+
+    @classmethod
+    def load(cls, log_path: str) -> typing.Self:
+        path = cls.manifest_path(log_path)
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            manifest = cls(log_path, [LogSegment.from_dict(s) for s in data["segments"]], closed=data.get("closed", False))
+        else:
+            manifest = cls(log_path, [LogSegment(0, 0)], closed=False)
+        # The segment currently being written to is only recorded in the manifest on rotation and close.
+        last = manifest.segments[-1]
+        if not manifest.closed and not last.dropped and os.path.exists(last.path(log_path)):
+            last.size = os.path.getsize(last.path(log_path))
+        return manifest
+
+    def save(self) -> None:
+        path = self.manifest_path(self.log_path)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"closed": self.closed, "segments": [s.to_dict() for s in self.segments]}, f)
+        os.replace(tmp_path, path)
+
+    @property
+    def size(self) -> int:
+        """Logical size of the job's output, including dropped segments."""
+        return self.segments[-1].end
+
+
+class LineIndex:
+    """
+    Sparse index of a log's line numbers, stored next to it as "<log>.lines". Every entry is a checkpoint
+    "<line number> <logical position>" of the first byte of that line. The writer records a checkpoint every
+    LOG_INDEX_INTERVAL lines, at the start of every segment and a final one when the log is closed, so any line can be
+    located and the log's line count determined by scanning at most one interval of lines. The file is append-only.
+    """
+
+    def __init__(self, log_path: str, checkpoints: typing.List[typing.Tuple[int, int]]):
+        self.log_path = log_path
+        self.checkpoints = checkpoints or [(0, 0)]
+
+    @staticmethod
+    def index_path(log_path: str) -> str:
+        return log_path + ".lines"
+
+    @classmethod
+    def load(cls, log_path: str) -> Optional[typing.Self]:
+        path = cls.index_path(log_path)
+        if not os.path.exists(path):
+            return None
+        checkpoints = []
+        with open(path) as f:
+            for entry in f:
+                parts = entry.split()
+                # Ignore an entry that is still being appended.
+                if len(parts) == 2 and entry.endswith("\n"):
+                    checkpoints.append((int(parts[0]), int(parts[1])))
+        return cls(log_path, checkpoints)
+
+    @classmethod
+    def build(cls, log_path: str, interval: Optional[int] = None) -> typing.Self:
+        """Build the index of a log written without one by scanning it once."""
+        interval = interval or config.LOG_INDEX_INTERVAL
+        reader = JobLogReader(log_path)
+        checkpoints = [(0, 0)]
+        line, position = 0, 0
+        for segment in reader.manifest.segments:
+            if segment.dropped or segment.end <= position:
+                continue
+            position = segment.offset
+            if checkpoints[-1][0] != line:
+                checkpoints.append((line, position))
+            try:
+                for chunk in reader.iter_segment(segment, 0):
+                    start = 0
+                    while (newline := chunk.find(b"\n", start)) != -1:
+                        line += 1
+                        start = newline + 1
+                        if line - checkpoints[-1][0] >= interval:
+                            checkpoints.append((line, position + start))
+                    position += len(chunk)
+            except FileNotFoundError:
+                break
+        index = cls(log_path, checkpoints)
+        tmp_path = cls.index_path(log_path) + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.writelines("{} {}\n".format(*checkpoint) for checkpoint in checkpoints)
+        os.replace(tmp_path, cls.index_path(log_path))
+        return index
+
+    @classmethod
+    def load_or_build(cls, log_path: str) -> typing.Self:
+        return cls.load(log_path) or cls.build(log_path)
+
+    def checkpoint(self, line: int) -> typing.Tuple[int, int]:
+        """The last checkpoint at or before the given line."""
+        return self.checkpoints[max(bisect.bisect_right([c[0] for c in self.checkpoints], line) - 1, 0)]
+
+    def locate(self, reader: "JobLogReader", line: int) -> int:
+        """Logical position of the start of the given (0 based) line."""
+        checkpoint_line, position = self.checkpoint(line)
+        return reader.skip_lines(position, line - checkpoint_line)[0]
+
+    def count(self, reader: "JobLogReader") -> int:
+        """Number of complete lines in the log. Lines written to dropped segments of a log that is still being written
+        are only counted once the log has been closed."""
+        line, position = self.checkpoints[-1]
+        return line + reader.skip_lines(position)[1]
+
+
+class TimeIndex:
+    """
+    Sparse index of the times at which a timestamped log was written, stored next to it as "<log>.times". Every entry is
+    a checkpoint "<UNIX timestamp> <logical position>" of the first line written at or after that time. The writer
+    records a checkpoint every LOG_TIME_INDEX_INTERVAL seconds of output and with every line index checkpoint, so the
+    start of a time window is found by scanning at most one interval of lines. The file only exists for logs written in
+    the timestamped format.
+    """
+
+    def __init__(self, log_path: str, checkpoints: typing.List[typing.Tuple[float, int]]):
+        self.log_path = log_path
+        self.checkpoints = checkpoints
+
+    @staticmethod
+    def index_path(log_path: str) -> str:
+        return log_path + ".times"
+
+    @classmethod
+    def load(cls, log_path: str) -> Optional[typing.Self]:
+        path = cls.index_path(log_path)
+        if not os.path.exists(path):
+            return None
+        checkpoints = []
+        with open(path) as f:
+            for entry in f:
+                parts = entry.split()
+                # Ignore an entry that is still being appended.
+                if len(parts) == 2 and entry.endswith("\n"):
+                    checkpoints.append((float(parts[0]), int(parts[1])))
+        return cls(log_path, checkpoints)
+
+    def locate(self, reader: "JobLogReader", since: float) -> int:
+        """Logical position of the first line written at or after `since`."""
+        index = bisect.bisect_right([c[0] for c in self.checkpoints], since) - 1
+        position = self.checkpoints[index][1] if index >= 0 else 0
+        while True:
+            entries, new_position = reader.read_entries(position, max_lines=1000)
+            for entry in entries:
+                parsed = None if is_truncation(entry) else parse_timestamped_line(entry[0])
+                if parsed is not None and parsed[0] >= since:
+                    return entry[1]
+            if new_position == position:
+                return position
+            position = new_position
+
+
+class JobLogWriter:
+    """Appends a job's output to its log, rotating segments according to the given LogLimits."""
+
+    def __init__(self, log_path: str, limits: LogLimits, index_interval: Optional[int] = None, timestamped: bool = False):
+        self.log_path = log_path
+        self.limits = limits
+        self.manifest = SegmentManifest.load(log_path)
+        self.file: Optional[typing.BinaryIO] = None
+        self.index_interval = index_interval or config.LOG_INDEX_INTERVAL
+        # Timestamped logs are written through write_entry and indexed by time as well.
+        self.time_index_file: Optional[typing.TextIO] = open(TimeIndex.index_path(log_path), "a") if timestamped else None
+        self.last_time_checkpoint: Optional[float] = None
+        self.force_time_checkpoint = False
+        self.lines = 0
+        self.last_checkpoint = 0
+        self.last_checkpoint_entry: Optional[typing.Tuple[int, int]] = None
+        # The line index can only be kept for logs written from the start.
+        self.index_file: Optional[typing.TextIO] = None
+        if self.position == 0:
+            self.index_file = open(LineIndex.index_path(log_path), "w")
+            self.checkpoint()
+        self.open_segment()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def segment(self) -> LogSegment:
+        return self.manifest.segments[-1]
+
+    @property
+    def position(self) -> int:
+        return self.manifest.size
+
+    def open_segment(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if not self.segment.dropped:
+            self.file = open(self.segment.path(self.log_path), "ab")
+
+    def capacity(self, segment: LogSegment) -> int:
+        if segment.index == 0 and self.limits.head_bytes:
+            return self.limits.head_bytes
+        return self.limits.segment_bytes
+
+    def write_line(self, line: str) -> None:
+        self.write((line + "\n").encode("utf-8"))
+
+    def write_entry(self, text: str, stream: str, timestamp: float) -> None:
+        """Write a line of output in the timestamped log format."""
+        if self.time_index_file is not None and (
+                self.force_time_checkpoint or self.last_time_checkpoint is None
+                or timestamp - self.last_time_checkpoint >= config.LOG_TIME_INDEX_INTERVAL):
+            self.time_index_file.write("{} {}\n".format(timestamp, self.position))
+            self.time_index_file.flush()
+            self.last_time_checkpoint = timestamp
+            self.force_time_checkpoint = False
+        self.write_line(format_timestamped_line(timestamp, stream, text))
+
+    def write(self, data: bytes) -> None:
+        segment = self.segment
+        if not self.limits.unlimited and not segment.dropped and 0 < segment.size and segment.size + len(data) > self.capacity(segment):
+            self.rotate()
+            segment = self.segment
+        if self.file is not None:
+            self.file.write(data)
+            self.file.flush()  # Ensures data is written immediately
+        segment.size += len(data)
+        self.lines += data.count(b"\n")
+        if self.lines - self.last_checkpoint >= self.index_interval and data.endswith(b"\n"):
+            self.checkpoint()
+
+    def checkpoint(self) -> None:
+        if self.index_file is None or (self.lines, self.position) == self.last_checkpoint_entry:
+            return
+        self.index_file.write("{} {}\n".format(self.lines, self.position))
+        self.index_file.flush()
+        self.last_checkpoint = self.lines
+        self.force_time_checkpoint = True
+        self.last_checkpoint_entry = (self.lines, self.position)
+
+    def rotate(self) -> None:
+        segments = self.manifest.segments
+        if self.limits.tail_bytes == 0:
+            # Only the head is kept, everything after it is counted but never written.
+            segments.append(LogSegment(len(segments), self.position, dropped=True))
+        else:
+            segments.append(LogSegment(len(segments), self.position))
+            tail = [s for s in segments if not s.dropped and not (s.index == 0 and self.limits.head_bytes)]
+            for expired in tail[:max(len(tail) - self.limits.max_tail_segments, 0)]:
+                expired.dropped = True
+                if os.path.exists(expired.path(self.log_path)):
+                    os.remove(expired.path(self.log_path))
+        self.manifest.save()
+        self.checkpoint()
+        self.open_segment()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.index_file is not None:
+            self.checkpoint()
+            self.index_file.close()
+            self.index_file = None
+        if self.time_index_file is not None:
+            self.time_index_file.close()
+            self.time_index_file = None
+        if not self.manifest.closed:
+            self.manifest.closed = True
+            if len(self.manifest.segments) > 1:
+                self.manifest.save()
+
+
+class JobLogReader:
+    """
+    Reads a job's log by logical offset, transparently crossing segment boundaries, dropped segments and compressed
+    segments.
+    """
+
+    def __init__(self, log_path: str):
+        self.log_path = log_path
+        self.manifest = SegmentManifest.load(log_path)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.log_path) or os.path.exists(SegmentManifest.manifest_path(self.log_path))
+
+    @property
+    def size(self) -> int:
+        return self.manifest.size
+
+    def iter_segment(self, segment: LogSegment, start: int) -> typing.Iterator[bytes]:
+        """Yield the uncompressed content of a segment starting at the given offset relative to the segment."""
+        if not segment.compressed:
+            with open(segment.path(self.log_path), "rb") as f:
+                f.seek(start)
+                while chunk := f.read(READ_CHUNK_BYTES):
+                    yield chunk
+            return
+
+        # Start decompressing at the last gzip member beginning at or before the requested offset.
+        block = max(bisect.bisect_right([b[0] for b in segment.blocks], start) - 1, 0)
+        uncompressed_offset, compressed_offset = segment.blocks[block] if segment.blocks else (0, 0)
+        skip = start - uncompressed_offset
+        with open(segment.path(self.log_path), "rb") as f:
+            f.seek(compressed_offset)
+            decompressor = zlib.decompressobj(wbits=GZIP_WBITS)
+            while raw := f.read(READ_CHUNK_BYTES):
+                while raw:
+                    chunk = decompressor.decompress(raw)
+                    if decompressor.eof:
+                        # Every block is a separate gzip member.
+                        raw = decompressor.unused_data
+                        decompressor = zlib.decompressobj(wbits=GZIP_WBITS)
+                    else:
+                        raw = b""
+                    if skip:
+                        dropped = min(skip, len(chunk))
+                        chunk = chunk[dropped:]
+                        skip -= dropped
+                    if chunk:
+                        yield chunk
+
+    def read_entries(self, position: int = 0, end: Optional[int] = None, max_bytes: Optional[int] = None,
+                     max_lines: Optional[int] = None) -> typing.Tuple[typing.List[typing.Tuple[str, int, int]], int]:
+        """
+        Read complete lines from the given logical position onwards.
+        :param end: Logical position to stop at. Lines that do not end before it are not read.
+        :param max_bytes: Maximum number of bytes of output to read. A single line longer than this is returned in
+            pieces of `max_bytes`, so the memory used per call stays bounded.
+        :param max_lines: Maximum number of lines to read.
+        :return: Tuple of the entries read as (line, start position, end position), and the position to continue
+            reading from. Truncated output is reported as a single marker entry spanning the dropped bytes.
+        """
+        entries: typing.List[typing.Tuple[str, int, int]] = []
+        position = max(position, 0)
+        end = self.size if end is None else end
+        read = 0
+        truncated = 0
+
+        def full() -> bool:
+            return (max_lines is not None and len(entries) >= max_lines) or (max_bytes is not None and read >= max_bytes)
+
+        def take(line: str, length: int) -> None:
+            nonlocal position, read
+            entries.append((line, position, position + length))
+            position += length
+            read += length
+
+        segments = list(self.manifest.segments)
+        while segments and position < end and not full():
+            segment = segments.pop(0)
+            if position >= segment.end:
+                continue
+            if segment.dropped:
+                # Consecutive dropped segments are reported as a single truncation marker.
+                truncated += min(segment.end, end) - max(position, segment.offset)
+                position = min(segment.end, end)
+                continue
+            if truncated:
+                entries.append((TRUNCATED_MARKER.format(truncated), position - truncated, position))
+                truncated = 0
+            position = max(position, segment.offset)
+            buffer = b""
+            try:
+                for chunk in self.iter_segment(segment, position - segment.offset):
+                    *complete, buffer = (buffer + chunk).split(b"\n")
+                    for raw in complete:
+                        if full() or position + len(raw) + 1 > end:
+                            break
+                        if max_bytes is not None and read + len(raw) + 1 > max_bytes:
+                            if not entries:
+                                take(raw[:max_bytes].decode("utf-8", errors="replace"), max_bytes)
+                            break
+                        take((raw + b"\n").decode("utf-8", errors="replace"), len(raw) + 1)
+                    else:
+                        if max_bytes is not None and len(buffer) >= max_bytes and not entries and position + max_bytes <= end:
+                            take(buffer[:max_bytes].decode("utf-8", errors="replace"), max_bytes)
+                        elif not full() and position < end:
+                            continue
+                    buffer = b""
+                    break
+            except FileNotFoundError:
+                # The segment was compressed or rotated out after the manifest was loaded.
+                if self.compressed_since(segment) is not None:
+                    segments = [s for s in self.manifest.segments if s.index >= segment.index]
+                    continue
+                truncated += segment.end - position
+                position = segment.end
+            if position < segment.end and position < end:
+                # Stopped inside the segment, either because a limit was reached or because the last line is still
+                # being written; the rest is returned by the next read.
+                return entries, position
+        if truncated:
+            entries.append((TRUNCATED_MARKER.format(truncated), position - truncated, position))
+        return entries, position
+
+    def compressed_since(self, segment: LogSegment) -> Optional[LogSegment]:
+        """
+        Reload the manifest after a segment's file has gone missing.
+        :return: The segment as it is now, if it was compressed since the manifest was loaded, None otherwise.
+        """
+        reloaded = SegmentManifest.load(self.log_path)
+        if segment.compressed or segment.index >= len(reloaded.segments) or not reloaded.segments[segment.index].compressed:
+            return None
+        self.manifest = reloaded
+        return reloaded.segments[segment.index]
+
+    def content_parts(self) -> typing.List[typing.Union[LogSegment, bytes]]:
+        """The parts making up the log's complete content: live segments, and truncation markers for dropped ones."""
+        parts: typing.List[typing.Union[LogSegment, bytes]] = []
+        truncated = 0
+        for segment in self.manifest.segments:
+            if not segment.dropped and not os.path.exists(segment.path(self.log_path)):
+                segment = self.compressed_since(segment) or segment
+            if segment.dropped or not os.path.exists(segment.path(self.log_path)):
+                truncated += segment.size
+                continue
+            if truncated:
+                parts.append(TRUNCATED_MARKER.format(truncated).encode("utf-8"))
+                truncated = 0
+            parts.append(segment)
+        if truncated:
+            parts.append(TRUNCATED_MARKER.format(truncated).encode("utf-8"))
+        return parts
+
+    def content_size(self, parts: Optional[typing.List[typing.Union[LogSegment, bytes]]] = None) -> int:
+        parts = parts if parts is not None else self.content_parts()
+        return sum(len(part) if isinstance(part, bytes) else part.size for part in parts)
+
+    def iter_content(self, parts: Optional[typing.List[typing.Union[LogSegment, bytes]]] = None) -> typing.Iterator[bytes]:
+        """
+        Yield the log's complete, uncompressed content, as exported in log archives. A segment compressed while it is
+        being read is continued from its compressed file, so the content stays complete.
+        """
+        for part in parts if parts is not None else self.content_parts():
+            if isinstance(part, bytes):
+                yield part
+                continue
+            position = 0
+            while True:
+                try:
+                    for chunk in self.iter_segment(part, position):
+                        position += len(chunk)
+                        yield chunk
+                    break
+                except FileNotFoundError:
+                    part = self.compressed_since(part)
+                    if part is None:
+                        # Rotated out, the archive pads the entry to the size announced for it.
+                        break
+
+    def skip_lines(self, position: int, count: Optional[int] = None) -> typing.Tuple[int, int]:
+        """
+        Move forwards from a logical position over `count` complete lines, or over all complete lines if no count is
+        given, without decoding them. A dropped segment is skipped as a whole, its lines are not counted.
+        :return: Tuple of the position reached and the number of lines skipped.
+        """
+        skipped = 0
+        for segment in self.manifest.segments:
+            if count is not None and skipped >= count:
+                break
+            if position >= segment.end:
+                continue
+            if segment.dropped:
+                position = segment.end
+                continue
+            position = max(position, segment.offset)
+            offset = position
+            try:
+                for chunk in self.iter_segment(segment, position - segment.offset):
+                    start = 0
+                    while (count is None or skipped < count) and (newline := chunk.find(b"\n", start)) != -1:
+                        skipped += 1
+                        start = newline + 1
+                        position = offset + start
+                    if count is not None and skipped >= count:
+                        break
+                    offset += len(chunk)
+            except FileNotFoundError:
+                position = segment.end
+                continue
+            if position < segment.end:
+                break
+        return position, skipped
+
+    def read_lines(self, position: int = 0, max_bytes: Optional[int] = None, max_lines: Optional[int] = None) -> typing.Tuple[typing.List[str], int]:
+        """
+        Read complete lines from the given logical position onwards, see `read_entries`.
+        :return: Tuple of the lines read and the position to continue reading from.
+        """
+        entries, position = self.read_entries(position, max_bytes=max_bytes, max_lines=max_lines)
+        return [line for line, _, _ in entries], position
+
+    def tail_lines(self, count: int, end: Optional[int] = None, max_bytes: Optional[int] = None) -> typing.Tuple[typing.List[str], int, int]:
+        """
+        Read the last `count` complete lines before the logical position `end` (the end of the log by default) without
+        reading the log from the start: a window ending at `end` is read, growing until it holds enough lines, reaches
+        the start of the log or reaches `max_bytes`. A line ending before `end` that is longer than `max_bytes` is
+        returned cut to its end, so paging backwards from its start still makes progress.
+        :return: Tuple of the lines read, the position of the first line and the position after the last line.
+        """
+        end = self.size if end is None else min(max(end, 0), self.size)
+        window = READ_CHUNK_BYTES
+        while True:
+            if max_bytes is not None:
+                window = min(window, max_bytes)
+            start = max(end - window, 0)
+            # Read from the byte before the window, so a line cut off by the start of the window can be recognised.
+            entries, stop = self.read_entries(max(start - 1, 0), end=end)
+            cut = None
+            if start > 0 and entries and not is_truncation(entries[0]):
+                cut = entries.pop(0)
+            if len(entries) >= count or start == 0 or (max_bytes is not None and window >= max_bytes):
+                break
+            window *= 4
+
+        entries = entries[-count:] if count > 0 else []
+        if not entries and cut is not None and count > 0:
+            entries = [cut]
+        if not entries:
+            return [], stop, stop
+        return [line for line, _, _ in entries], entries[0][1], stop
+
+def read_filtered_lines(reader: JobLogReader, position: int, max_bytes: int, max_lines: int, until: Optional[float] = None,
+                        stream: Optional[str] = None) -> typing.Tuple[typing.List[str], int, bool]:
+    """
+    Read the lines of a timestamped log from `position` onwards that were written to `stream` before `until`. At most
+    `max_bytes` are returned and at most 8 times as much is scanned per call.
+    :return: Tuple of the lines read, the position to continue from and whether the end of the window was reached.
+    """
+    lines: typing.List[str] = []
+    returned, scanned = 0, 0
+    while scanned < max_bytes * 8:
+        entries, new_position = reader.read_entries(position, max_bytes=max_bytes, max_lines=max_lines)
+        if new_position == position:
+            return lines, position, False
+        for entry in entries:
+            text, start, end = entry
+            parsed = None if is_truncation(entry) else parse_timestamped_line(text)
+            if parsed is not None and until is not None and parsed[0] >= until:
+                return lines, start, True
+            if stream is None or (parsed is not None and parsed[1] == stream):
+                if len(lines) >= max_lines or returned + len(text) > max_bytes:
+                    return lines, start, False
+                lines.append(text)
+                returned += len(text)
+            scanned += end - start
+        position = new_position
+    return lines, position, False
+
+
+def read_log_page(log_path: str, position: int = 0, tail: Optional[int] = None, before: Optional[int] = None,
+                  max_bytes: Optional[int] = None, max_lines: Optional[int] = None, line: Optional[int] = None,
+                  since: Optional[float] = None, until: Optional[float] = None, stream: Optional[str] = None,
+                  line_index: bool = True) -> dict:
+    """
+    Read a bounded page of a log. Pages are read forwards from `position`, or from line number `line` (0 based) when
+    given, or, when `tail` is given, backwards: the last `tail` lines before `before` (the end of the log by default).
+    Both limits are capped to LOG_READ_MAX_BYTES and LOG_READ_MAX_LINES. The returned positions are continuation
+    cursors: `new_position` continues forwards and `start_position` can be passed as `before` to page backwards.
+
+    Logs written in the timestamped format can also be read by time window: forwards from the first line written at
+    or after `since` (UNIX timestamp), stopping at the first line written at or after `until`, optionally only the lines
+    of one `stream`. A time window continues with `new_position` as `position` and the same `until`.
+    :param line_index: False for logs appended to by writers that do not maintain a line index (e.g. image build logs),
+        an index built on first read would go stale. Such pages have no `total_lines` and `line` is located by scanning.
+    :raises LogNotTimestamped: When filtering by time or stream a log written without timestamps.
+    """
+    max_bytes = min(max_bytes, config.LOG_READ_MAX_BYTES) if max_bytes else config.LOG_READ_MAX_BYTES
+    max_lines = min(max_lines, config.LOG_READ_MAX_LINES) if max_lines else config.LOG_READ_MAX_LINES
+    reader = JobLogReader(log_path)
+    index = LineIndex.load_or_build(log_path) if line_index else None
+    time_index = TimeIndex.load(log_path)
+    window_end = False
+    if (since is not None or until is not None or stream is not None) and time_index is None:
+        raise LogNotTimestamped("The log was not written with timestamps.")
+
+    if tail is not None:
+        lines, start, new_position = reader.tail_lines(min(tail, max_lines), end=before, max_bytes=max_bytes)
+    elif since is not None or until is not None or stream is not None:
+        start = time_index.locate(reader, since) if since is not None else max(position, 0)
+        lines, new_position, window_end = read_filtered_lines(reader, start, max_bytes, max_lines, until=until, stream=stream)
+    else:
+        if line is None:
+            start = max(position, 0)
+        else:
+            start = index.locate(reader, line) if index is not None else reader.skip_lines(0, line)[0]
+        lines, new_position = reader.read_lines(start, max_bytes=max_bytes, max_lines=max_lines)
+    page = {
+        "lines": lines,
+        "start_position": start,
+        "new_position": new_position,
+        "size": reader.size,
+        "total_lines": index.count(reader) if index is not None else None,
+        "timestamped": time_index is not None,
+        "has_more": new_position < reader.size and not window_end,
+    }
+    if line is not None:
+        page["line"] = line
+    return page
+
+
+def compress_log(log_path: str, block_bytes: int, level: int = 6) -> typing.Tuple[int, int]:
+    """
+    Compress every segment of a finished job's log into gzip files made of independent members of `block_bytes`
+    uncompressed bytes each. The members' offsets are recorded in the segment manifest so reads at an arbitrary offset
+    only need to decompress a single block, while the files remain readable by any gzip tool.
+    :return: Tuple of the size on disk before and after compression.
+    """
+    manifest = SegmentManifest.load(log_path)
+    before, after, replaced = 0, 0, []
+    for segment in manifest.segments:
+        if segment.dropped or segment.compressed:
+            continue
+        source = segment.path(log_path)
+        if not os.path.exists(source):
+            continue
+        segment.compressed = True
+        target = segment.path(log_path)
+        blocks, uncompressed = [], 0
+        with open(source, "rb") as f, open(target + ".tmp", "wb") as out:
+            while chunk := f.read(block_bytes):
+                blocks.append([uncompressed, out.tell()])
+                out.write(gzip.compress(chunk, compresslevel=level, mtime=0))
+                uncompressed += len(chunk)
+        os.replace(target + ".tmp", target)
+        segment.size = uncompressed
+        segment.blocks = blocks
+        before += uncompressed
+        after += os.path.getsize(target)
+        replaced.append(source)
+
+    if replaced:
+        # The manifest is switched over before the uncompressed files are removed, so readers never miss data.
+        manifest.closed = True
+        manifest.save()
+        for source in replaced:
+            os.remove(source)
+    return before, after
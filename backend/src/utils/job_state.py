@@ -0,0 +1,151 @@
+import logging
+import threading
+import time
+import traceback
+import typing
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Optional
+
+from sqlalchemy import Select
+from sqlmodel import Session, select, col
+
+from src.db_models import DockerJobs, DockerScheduled
+from src.factory import config
+from src.factory.database import engine
+from src.utils.events import publish_job_event, job_snapshot
+from src.utils.event_log import get_logger, event_logger
+
+logger = get_logger(__name__)
+log_event = event_logger(logger)
+
+
+@dataclass
+class JobStateChange:
+    job_id: Optional[int]
+    changes: typing.Dict[str, typing.Any] = field(default_factory=dict) # Columns of the job to set
+    status: Optional[int] = None # Terminal status, see `DockerJobs.set_finished`
+    schedule_id: Optional[int] = None # Schedule whose run this change ends
+    action: Optional[str] = None # Job event published once the change has been written
+    submitted_at: float = field(default_factory=time.monotonic)
+    future: Future = field(default_factory=Future)
+
+
+class JobStateWriter:
+    """
+    Write-behind job state of the runner. Changes of all jobs run by this process are queued and written by a single
+    thread, which coalesces the changes submitted within `flush_interval` seconds of each other (up to `batch_size` of
+    them) into one transaction, then publishes their job events.
+
+    Every change returns a future resolved once it has been committed. Callers wait for terminal statuses, so that a
+    job's outcome is durable before its message is acknowledged. Intermediate changes that are not waited for (e.g.
+    the log path) must be repeated by the terminal change, so that they are durable once it is.
+
+    Every change's event carries the job's state as of that change, also when several changes of a job are written in
+    the same batch.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float):
+        self.batch_size = max(batch_size, 1)
+        self.flush_interval = flush_interval
+        self.pending: typing.List[JobStateChange] = []
+        self.condition = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+
+    def submit(self, change: JobStateChange) -> Future:
+        with self.condition:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="job-state-writer", daemon=True)
+                self.thread.start()
+            self.pending.append(change)
+            self.condition.notify()
+        return change.future
+
+    def update(self, job_id: int, action: Optional[str] = None, **changes) -> Future:
+        return self.submit(JobStateChange(job_id, changes, action=action))
+
+    def finish(self, job_id: int, status: int, schedule_id: Optional[int] = None, action: Optional[str] = "finished",
+               **changes) -> Future:
+        return self.submit(JobStateChange(job_id, changes, status=status, schedule_id=schedule_id, action=action))
+
+    def release_schedule(self, schedule_id: int) -> Future:
+        return self.submit(JobStateChange(None, schedule_id=schedule_id))
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                # Give changes of other jobs until the oldest change's deadline to join the batch.
+                deadline = self.pending[0].submitted_at + self.flush_interval
+                while len(self.pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+            self.write_batch(batch)
+
+    def write_batch(self, batch: typing.List[JobStateChange]) -> None:
+        try:
+            written = [(change, *result) for change, result in zip(batch, self.write(batch))]
+        except Exception:
+            # A single bad change must not fail the changes of other jobs, write them one by one.
+            log_event(logging.WARNING, "Failed to write batch of {} job state changes".format(len(batch)), None,
+                      error=traceback.format_exc())
+            written = []
+            for change in batch:
+                try:
+                    written.append((change, *self.write([change])[0]))
+                except Exception as e:
+                    log_event(logging.ERROR, "Failed to write job state change", change.job_id, error=str(e))
+                    change.future.set_exception(e)
+
+        for change, job, snapshot in written:
+            if change.action is not None and job is not None:
+                publish_job_event(snapshot, change.action)
+            change.future.set_result(job)
+
+    @staticmethod
+    def write(batch: typing.List[JobStateChange]) -> typing.List[typing.Tuple[Optional[DockerJobs], Optional[dict]]]:
+        """
+        Apply changes, in order, in a single transaction.
+        :return: The job of every change after it was written and a snapshot of the job as of the change (see
+            `job_snapshot`), both None when the job does not exist.
+        """
+        with Session(engine, expire_on_commit=False) as session:
+            job_ids = sorted({change.job_id for change in batch if change.job_id is not None})
+            jobs: typing.Dict[int, DockerJobs] = {}
+            if job_ids:
+                # Locked in the order of their IDs, like every batch does, so concurrent batches cannot deadlock.
+                query = select(DockerJobs).where(col(DockerJobs.id).in_(job_ids)).order_by(col(DockerJobs.id)).with_for_update()
+                jobs = {job.id: job for job in session.exec(typing.cast(Select, query.execution_options(populate_existing=True))).all()}
+
+            finished: typing.Dict[int, int] = {}
+            snapshots: typing.List[Optional[dict]] = []
+            for change in batch:
+                job = jobs.get(change.job_id)
+                if job is None:
+                    snapshots.append(None)
+                    continue
+                for name, value in change.changes.items():
+                    setattr(job, name, value)
+                session.add(job)
+                if change.status is not None:
+                    finished.setdefault(job.id, change.status)
+                snapshots.append(job_snapshot(job))
+
+            # Script statistics are locked in the order of their scripts, for the same reason.
+            for job_id in sorted(finished, key=lambda _id: (jobs[_id].script_id, _id)):
+                jobs[job_id].set_finished(finished[job_id], session, lock=False)
+            # Terminal changes are snapshot once their status and finish time have been set.
+            for i, change in enumerate(batch):
+                if change.status is not None and change.job_id in jobs:
+                    snapshots[i] = job_snapshot(jobs[change.job_id])
+
+            DockerScheduled.set_finished_many({change.schedule_id for change in batch if change.schedule_id is not None}, session)
+            session.commit()
+            return [(jobs.get(change.job_id), snapshot) for change, snapshot in zip(batch, snapshots)]
+
+
+job_state_writer = JobStateWriter(config.JOB_STATE_BATCH_SIZE, config.JOB_STATE_FLUSH_SECONDS)
@@ -0,0 +1,289 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+import traceback
+import typing
+from typing import Optional
+
+from sqlmodel import Session, col
+
+from src.db_models import DockerJobs
+from src.enums import JobStatus
+from src.factory import config
+from src.factory.database import engine
+from src.utils.job_archiver import all_jobs_after
+from src.utils.job_logs import JobLogReader, LineIndex, get_log_path, is_truncation
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+logger.addHandler(handler)
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS log_lines USING fts5(text, job_id UNINDEXED, line UNINDEXED, position UNINDEXED);
+CREATE TABLE IF NOT EXISTS indexed_jobs (
+    job_id INTEGER PRIMARY KEY,
+    script_id TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    created_at INTEGER,
+    finished_at INTEGER,
+    first_rowid INTEGER NOT NULL,
+    last_rowid INTEGER NOT NULL,
+    indexed_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS indexed_jobs_script ON indexed_jobs (script_id, job_id);
+CREATE TABLE IF NOT EXISTS index_state (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS retry_jobs (job_id INTEGER PRIMARY KEY, attempts INTEGER NOT NULL);
+"""
+# Every job with an ID up to this one has been indexed or has nothing to index, see `index_pending_jobs`.
+HIGH_WATER_MARK = "high_water_mark"
+
+
+class InvalidSearchQuery(Exception):
+    pass
+
+
+class LogSearchIndex:
+    """
+    Full-text index over the logs of finished jobs, kept in a local SQLite database using FTS5. Every indexed line
+    records its job, line number and logical log position, so matches can be opened directly through the log API.
+
+    The lines of a job are stored under a contiguous range of rowids recorded in `indexed_jobs`, which allows removing a
+    job from the index without scanning it. Jobs are indexed once they have reached a terminal state, so the job
+    metadata copied into `indexed_jobs` for filtering never changes afterwards.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or config.LOG_SEARCH_DB
+        self.connection = sqlite3.connect(self.path, timeout=30)
+        # WAL lets the API search whilst a worker is indexing.
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def is_indexed(self, job_ids: typing.Sequence[int]) -> typing.Set[int]:
+        if len(job_ids) == 0:
+            return set()
+        placeholders = ",".join("?" * len(job_ids))
+        rows = self.connection.execute("SELECT job_id FROM indexed_jobs WHERE job_id IN ({})".format(placeholders), list(job_ids))
+        return {row[0] for row in rows}
+
+    def get_state(self, name: str, default: int = 0) -> int:
+        row = self.connection.execute("SELECT value FROM index_state WHERE name = ?", (name,)).fetchone()
+        return row[0] if row is not None else default
+
+    def set_state(self, name: str, value: int) -> None:
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO index_state (name, value) VALUES (?, ?)", (name, value))
+
+    def get_retries(self, limit: int) -> typing.Dict[int, int]:
+        """Jobs the catch-up has passed over without indexing them, with the number of times they were retried."""
+        return dict(self.connection.execute("SELECT job_id, attempts FROM retry_jobs ORDER BY job_id LIMIT ?", (limit,)).fetchall())
+
+    def add_retries(self, job_ids: typing.Sequence[int]) -> None:
+        with self.connection:
+            self.connection.executemany("INSERT OR IGNORE INTO retry_jobs (job_id, attempts) VALUES (?, 0)", [(_id,) for _id in job_ids])
+
+    def update_retries(self, attempts: typing.Dict[int, int], done: typing.Sequence[int]) -> None:
+        with self.connection:
+            self.connection.executemany("UPDATE retry_jobs SET attempts = ? WHERE job_id = ?", [(n, _id) for _id, n in attempts.items()])
+            self.connection.executemany("DELETE FROM retry_jobs WHERE job_id = ?", [(_id,) for _id in done])
+
+    def index_job(self, job: DockerJobs, batch_lines: int = 5000) -> Optional[int]:
+        """
+        (Re-)index the log of a finished job.
+        :return: Number of lines indexed, None when the job's log does not exist.
+        """
+        log_path = get_log_path(job.script_id, job.logs)
+        reader = JobLogReader(log_path)
+        if not reader.exists():
+            # Recorded with an empty range of lines, so that the job is not picked up again.
+            with self.connection:
+                self.remove_jobs([job.id], commit=False)
+                self.connection.execute(
+                    "INSERT INTO indexed_jobs (job_id, script_id, status, created_at, finished_at, first_rowid, last_rowid, indexed_at) "
+                    "VALUES (?, ?, ?, ?, ?, 0, -1, ?)",
+                    (job.id, job.script_id, job.status, job.created_at, job.finished_at, int(time.time())))
+            return None
+        # Line numbers continue at the checkpoint following truncated output.
+        checkpoints = {position: line for line, position in LineIndex.load_or_build(log_path).checkpoints}
+        max_line_bytes = config.LOG_SEARCH_MAX_LINE_BYTES
+
+        with self.connection:
+            self.remove_jobs([job.id], commit=False)
+            first_rowid = self.connection.execute("SELECT COALESCE(MAX(rowid), 0) + 1 FROM log_lines").fetchone()[0]
+            rowid, line, position = first_rowid, 0, 0
+            while position < reader.size:
+                entries, new_position = reader.read_entries(position, max_lines=batch_lines)
+                if new_position == position:
+                    break
+                rows = []
+                for entry in entries:
+                    text, start, end = entry
+                    if is_truncation(entry):
+                        line = checkpoints.get(end, line)
+                        continue
+                    text = text.rstrip("\n")
+                    if text.strip():
+                        rows.append((rowid, text[:max_line_bytes], job.id, line, start))
+                        rowid += 1
+                    line += 1
+                self.connection.executemany("INSERT INTO log_lines (rowid, text, job_id, line, position) VALUES (?, ?, ?, ?, ?)", rows)
+                position = new_position
+            self.connection.execute(
+                "INSERT INTO indexed_jobs (job_id, script_id, status, created_at, finished_at, first_rowid, last_rowid, indexed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.script_id, job.status, job.created_at, job.finished_at, first_rowid, rowid - 1, int(time.time())))
+        return rowid - first_rowid
+
+    def remove_jobs(self, job_ids: typing.Sequence[int], commit: bool = True) -> None:
+        if len(job_ids) == 0:
+            return
+        placeholders = ",".join("?" * len(job_ids))
+        ranges = self.connection.execute(
+            "SELECT first_rowid, last_rowid FROM indexed_jobs WHERE job_id IN ({})".format(placeholders), list(job_ids)).fetchall()
+        for first_rowid, last_rowid in ranges:
+            self.connection.execute("DELETE FROM log_lines WHERE rowid BETWEEN ? AND ?", (first_rowid, last_rowid))
+        self.connection.execute("DELETE FROM indexed_jobs WHERE job_id IN ({})".format(placeholders), list(job_ids))
+        if commit:
+            self.connection.commit()
+
+    def search(
+            self,
+            query: str,
+            script_id: Optional[str] = None,
+            status: Optional[int] = None,
+            since: Optional[int] = None,
+            until: Optional[int] = None,
+            raw: bool = False,
+            limit: int = 20,
+            matches_per_job: int = 5) -> typing.List[dict]:
+        """
+        Find the most recent jobs whose logs match the query.
+        :param query: Text to search for. Matched as a phrase unless `raw` is set, in which case FTS5 query syntax
+            (prefix queries, AND/OR/NOT, NEAR) can be used.
+        :param since: Only jobs created at or after this UNIX timestamp.
+        :param until: Only jobs created at or before this UNIX timestamp.
+        :return: The matching jobs, newest first, each with up to `matches_per_job` matching lines.
+        """
+        match = query if raw else '"{}"'.format(query.replace('"', '""'))
+        where, parameters = ["log_lines MATCH ?"], [match]
+        for clause, value in (("j.script_id = ?", script_id), ("j.status = ?", status), ("j.created_at >= ?", since), ("j.created_at <= ?", until)):
+            if value is not None:
+                where.append(clause)
+                parameters.append(value)
+
+        sql = (
+            "SELECT j.job_id, j.script_id, j.status, j.created_at, j.finished_at, l.line, l.position, "
+            "snippet(log_lines, 0, '[', ']', '...', 24) "
+            "FROM log_lines l JOIN indexed_jobs j ON j.job_id = l.job_id "
+            "WHERE {} ORDER BY j.job_id DESC, l.rowid".format(" AND ".join(where)))
+        jobs: typing.Dict[int, dict] = {}
+        try:
+            for job_id, job_script_id, job_status, created_at, finished_at, line, position, snippet in self.connection.execute(sql, parameters):
+                if job_id not in jobs:
+                    if len(jobs) >= limit:
+                        break
+                    jobs[job_id] = {"job_id": job_id, "script_id": job_script_id, "status": job_status,
+                                    "created_at": created_at, "finished_at": finished_at, "matches": []}
+                if len(jobs[job_id]["matches"]) < matches_per_job:
+                    jobs[job_id]["matches"].append({"line": line, "position": position, "snippet": snippet})
+        except sqlite3.OperationalError as e:
+            raise InvalidSearchQuery(str(e))
+        return list(jobs.values())
+
+
+def index_pending_jobs(batch_size: Optional[int] = None, scan_limit: Optional[int] = None) -> int:
+    """
+    Index the logs of finished jobs that are not in the search index yet, e.g. because the worker stopped before the
+    job's indexing message was processed or because the jobs predate the index. Jobs are scanned in ascending ID order
+    from a high-water mark kept in the index, at most `scan_limit` of them per run. The mark moves past every job that
+    has been indexed or has nothing to index, and stops at the first job that has not finished yet, so that it is looked
+    at again next time. Jobs that failed to index, or have not finished LOG_SEARCH_PENDING_SECONDS after being created
+    (e.g. a job whose runner died), do not hold the mark: they are retried separately, up to LOG_SEARCH_MAX_RETRIES
+    times.
+    :return: Number of jobs indexed.
+    """
+    batch_size = batch_size or config.LOG_SEARCH_BATCH_SIZE
+    scan_limit = scan_limit or config.LOG_SEARCH_SCAN_LIMIT
+    terminal = [status.value for status in JobStatus.get_deletable()]
+    pending_before = int(time.time()) - config.LOG_SEARCH_PENDING_SECONDS
+    indexed = 0
+
+    def index(job) -> bool:
+        nonlocal indexed
+        try:
+            if index_log.index_job(job) is not None:
+                indexed += 1
+            return True
+        except Exception:
+            logger.error(json.dumps({"message": "Failed to index job log", "resource_id": job.id, "error": traceback.format_exc()}))
+            return False
+
+    with LogSearchIndex() as index_log, Session(engine) as session:
+        retries = index_log.get_retries(batch_size)
+        if retries:
+            jobs = {job.id: job for job in all_jobs_after(0, len(retries), session, lambda model: [col(model.id).in_(list(retries))])}
+            attempts, done = {}, []
+            done_ids = index_log.is_indexed(list(retries))
+            for job_id, attempt in retries.items():
+                job = jobs.get(job_id)
+                if job is None or job_id in done_ids or (job.status in terminal and job.logs is None):
+                    done.append(job_id)
+                elif job.status in terminal and index(job):
+                    done.append(job_id)
+                elif attempt + 1 >= config.LOG_SEARCH_MAX_RETRIES:
+                    done.append(job_id)
+                else:
+                    attempts[job_id] = attempt + 1
+            index_log.update_retries(attempts, done)
+
+        high_water_mark = index_log.get_state(HIGH_WATER_MARK)
+        last_id, advancing, scanned = high_water_mark, True, 0
+        while scanned < scan_limit and indexed < batch_size:
+            # Jobs archived before they were indexed are indexed from the archive.
+            jobs = all_jobs_after(last_id, min(batch_size, scan_limit - scanned), session)
+            if len(jobs) == 0:
+                break
+            scanned += len(jobs)
+            done = index_log.is_indexed([job.id for job in jobs])
+            retry = []
+            for job in jobs:
+                if job.status not in terminal:
+                    if (job.created_at or 0) < pending_before:
+                        retry.append(job.id)
+                    else:
+                        advancing = False
+                elif job.logs is not None and job.id not in done:
+                    if indexed >= batch_size:
+                        break
+                    if not index(job):
+                        retry.append(job.id)
+                last_id = job.id
+                if advancing:
+                    high_water_mark = job.id
+            index_log.add_retries(retry)
+        index_log.set_state(HIGH_WATER_MARK, high_water_mark)
+    return indexed
+
+
+def remove_from_search_index(job_ids: typing.Sequence[int]) -> None:
+    """Remove deleted jobs from the search index, if it exists."""
+    if not config.LOG_SEARCH_ENABLED or not os.path.exists(config.LOG_SEARCH_DB):
+        return
+    try:
+        with LogSearchIndex() as index:
+            index.remove_jobs(job_ids)
+    except sqlite3.Error:
+        logger.error(json.dumps({"message": "Failed to remove jobs from the search index", "error": traceback.format_exc()}))
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import os
+import time
+import typing
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
+from src.factory import config
+from src.utils.job_logs import JobLogReader, SegmentManifest
+
+# Resolves the state of the streamed resource: (status, is_terminal, log_path). log_path may be None until the log
+# file has been assigned, e.g. whilst a job is still pending.
+StatusResolver = typing.Callable[[], typing.Tuple[Optional[typing.Any], bool, Optional[str]]]
+
+
+def format_event(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    """Format a single Server-Sent Event."""
+    message = "event: {}\ndata: {}\n\n".format(event, json.dumps(data))
+    return "id: {}\n{}".format(event_id, message) if event_id is not None else message
+
+
+def get_resume_position(request: Request, last_position: int) -> int:
+    """EventSource clients resend the last received event id (the log position) when they reconnect."""
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id is not None and last_event_id.isdigit():
+        return int(last_event_id)
+    return last_position
+
+
+class LogTail:
+    """
+    Follows a log from a logical position. The log is only re-read when the stat of its manifest or of the segment
+    being written to has changed, so an idle follower costs two stat calls per poll.
+    """
+
+    def __init__(self, log_path: str, position: int = 0):
+        self.log_path = log_path
+        self.position = position
+        self.reader = JobLogReader(log_path)
+        self.last_signature = None
+
+    def signature(self) -> tuple:
+        paths = (SegmentManifest.manifest_path(self.log_path), self.reader.manifest.segments[-1].path(self.log_path))
+        signature = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def poll(self) -> typing.List[str]:
+        signature = self.signature()
+        if signature == self.last_signature or all(part is None for part in signature):
+            return []
+        self.last_signature = signature
+        self.reader = JobLogReader(self.log_path)
+        previous = self.position
+        lines, self.position = self.reader.read_lines(self.position, max_bytes=config.LOG_READ_MAX_BYTES, max_lines=config.LOG_READ_MAX_LINES)
+        if previous < self.position < self.reader.size:
+            # Possibly only part of the backlog fit into this event, read on at the next poll.
+            self.last_signature = None
+        return lines
+
+
+async def stream_log(
+        request: Request,
+        resolve: StatusResolver,
+        position: int = 0,
+        poll_interval: float = 0.5,
+        status_interval: float = 2.0,
+        heartbeat_interval: float = 15.0,
+        idle_timeout: Optional[float] = None) -> typing.AsyncIterator[str]:
+    """
+    Stream new log lines as "log" events and status changes as "status" events until the resource reaches a terminal
+    state, then send a final "end" event and close the stream. A running resource keeps the stream open however long
+    its log stays quiet, keep-alive comments are sent every `heartbeat_interval` seconds so proxies do not drop it.
+    `idle_timeout` only closes streams whose resource has no status, e.g. one that the resolver cannot find.
+    """
+    tail: Optional[LogTail] = None
+    status, terminal, log_path = None, False, None
+    last_status_check = 0.0
+    last_sent = time.monotonic()
+    last_change = time.monotonic()
+
+    while not await request.is_disconnected():
+        now = time.monotonic()
+        if now - last_status_check >= status_interval:
+            last_status_check = now
+            previous = status
+            status, terminal, log_path = await run_in_threadpool(resolve)
+            if status != previous:
+                yield format_event("status", {"status": status})
+                last_sent = last_change = now
+
+        if tail is None and log_path is not None:
+            tail = LogTail(log_path, position)
+
+        # Checked after the status, so the final read of a finished resource includes all of its output.
+        if tail is not None:
+            lines = await run_in_threadpool(tail.poll)
+            if lines:
+                yield format_event("log", {"lines": lines, "position": tail.position}, event_id=tail.position)
+                last_sent = last_change = now
+
+        if terminal:
+            yield format_event("end", {"status": status, "position": tail.position if tail is not None else position})
+            return
+        if idle_timeout is not None and status is None and now - last_change >= idle_timeout:
+            yield format_event("end", {"status": status, "position": tail.position if tail is not None else position})
+            return
+        if now - last_sent >= heartbeat_interval:
+            yield ": keep-alive\n\n"
+            last_sent = now
+        await asyncio.sleep(poll_interval)
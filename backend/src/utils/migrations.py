@@ -0,0 +1,150 @@
+import logging
+import time
+import typing
+from datetime import datetime
+
+import pytz
+from sqlalchemy import Column, Connection, Engine, Index, Integer, MetaData, String, Table, bindparam, inspect, text
+from sqlalchemy.dialects import mysql
+from sqlalchemy.schema import CreateColumn
+
+from src.db_models import DockerScriptStats
+from src.enums import JobStatus
+from src.utils.event_log import get_logger, event_logger
+
+logger = get_logger(__name__)
+log_event = event_logger(logger)
+
+MIGRATIONS_TABLE = "schema_migrations"
+# Named lock held whilst migrating, so that processes starting at the same time do not migrate concurrently.
+MIGRATIONS_LOCK = "scripter.schema_migrations"
+MIGRATIONS_LOCK_TIMEOUT = 300
+
+
+class MigrationError(Exception):
+    pass
+
+
+def add_column(connection: Connection, table_name: str, column: Column) -> bool:
+    """Add a column to an existing table, unless it is already there."""
+    if column.name in {c["name"] for c in inspect(connection).get_columns(table_name)}:
+        return False
+    ddl = CreateColumn(column).compile(dialect=connection.dialect)
+    connection.execute(text("ALTER TABLE {} ADD COLUMN {}".format(connection.dialect.identifier_preparer.quote(table_name), ddl)))
+    return True
+
+
+def create_index(connection: Connection, table_name: str, name: str, *columns: str) -> bool:
+    """Create an index on an existing table, unless one of the same name is already there."""
+    if name in {i["name"] for i in inspect(connection).get_indexes(table_name)}:
+        return False
+    table = Table(table_name, MetaData(), autoload_with=connection)
+    Index(name, *[table.c[column] for column in columns]).create(connection)
+    return True
+
+
+def add_versioning_columns(connection: Connection) -> None:
+    """Columns added to existing tables for log caps, the blob store and script and image versions."""
+    add_column(connection, "dockerimagefiles", Column("sha256", String(64), nullable=True))
+    add_column(connection, "dockerscripts", Column("log_head_bytes", Integer, nullable=True))
+    add_column(connection, "dockerscripts", Column("log_tail_bytes", Integer, nullable=True))
+    add_column(connection, "dockerscripts", Column("code_sha256", String(64), nullable=True))
+    add_column(connection, "dockerscripts", Column("version", Integer, nullable=True))
+    add_column(connection, "dockerjobs", Column("script_version", Integer, nullable=True))
+    add_column(connection, "dockerimage", Column("version", Integer, nullable=True))
+
+
+def add_hot_path_indexes(connection: Connection) -> None:
+    """Indexes of the queries in db_models, see `src.utils.query_plans` for the queries they serve."""
+    create_index(connection, "dockerjobs", "ix_dockerjobs_script_created", "script_id", "created_at", "id")
+    create_index(connection, "dockerjobs", "ix_dockerjobs_script_status_created", "script_id", "status", "created_at", "id")
+    create_index(connection, "dockerjobs", "ix_dockerjobs_status_script", "status", "script_id")
+    create_index(connection, "dockerjobs", "ix_dockerjobs_container_id", "container_id")
+    create_index(connection, "dockerscheduled", "ix_dockerscheduled_runnable", "enabled", "running")
+    create_index(connection, "dockerscheduled", "ix_dockerscheduled_script_created", "script_id", "created_at", "id")
+    create_index(connection, "dockerscheduled", "ix_dockerscheduled_created", "created_at", "id")
+    create_index(connection, "dockerscripts", "ix_dockerscripts_image_deleted", "image_id", "deleted")
+    create_index(connection, "dockerscripts", "ix_dockerscripts_deleted_created", "deleted", "created_at", "id")
+    create_index(connection, "dockerimage", "ix_dockerimage_created", "created_at", "id")
+    create_index(connection, "dockerimage", "ix_dockerimage_image_id", "image_id")
+    create_index(connection, "dockerimagefiles", "ix_dockerimagefiles_image_id", "image_id")
+    create_index(connection, "dockerimagefiles", "ix_dockerimagefiles_sha256", "sha256")
+
+
+def backfill_script_stats(connection: Connection) -> None:
+    """Statistics of the jobs that finished before they were kept, for the scripts that have none yet."""
+    existing = {row[0] for row in connection.execute(text("SELECT script_id FROM dockerscriptstats"))}
+    script_ids = [row[0] for row in connection.execute(text("SELECT DISTINCT script_id FROM dockerjobs"))]
+    statuses = [status.value for status in JobStatus.get_deletable()]
+    jobs_query = text("SELECT id, status, created_at, finished_at FROM dockerjobs WHERE script_id = :script_id "
+                      "AND status IN :statuses").bindparams(bindparam("statuses", expanding=True))
+    for script_id in script_ids:
+        if script_id in existing:
+            continue
+        stats = DockerScriptStats(script_id=script_id)
+        for job_id, status, created_at, finished_at in connection.execute(jobs_query, {"script_id": script_id, "statuses": statuses}):
+            stats.add(job_id, status, created_at, finished_at)
+        if stats.runs:
+            # Jobs keep finishing whilst the API starts, a script whose statistics were created by one of them since is
+            # left as it is rather than failing the startup.
+            insert = mysql.insert(DockerScriptStats.__table__)
+            connection.execute(insert.on_duplicate_key_update(script_id=insert.inserted.script_id), [stats.model_dump()])
+
+
+# Applied in order, each at most once. Append new migrations to the end and never reorder or remove them. Migrations
+# run after `create_all`, which creates missing tables with their current columns and indexes but leaves existing
+# tables alone, so every step checks whether its change is already there.
+MIGRATIONS: typing.List[typing.Tuple[int, str, typing.Callable[[Connection], None]]] = [
+    (1, "add_versioning_columns", add_versioning_columns),
+    (2, "add_hot_path_indexes", add_hot_path_indexes),
+    (3, "backfill_script_stats", backfill_script_stats),
+]
+
+
+def get_applied(connection: Connection) -> typing.Set[int]:
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS {} (version INTEGER NOT NULL PRIMARY KEY, name VARCHAR(255) NOT NULL, "
+        "applied_at INTEGER NOT NULL)".format(MIGRATIONS_TABLE)))
+    return {row[0] for row in connection.execute(text("SELECT version FROM {}".format(MIGRATIONS_TABLE)))}
+
+
+def run_migrations(engine: Engine, metadata: MetaData) -> int:
+    """
+    Create missing tables from the models' metadata, then apply the migrations that have not been applied to the
+    database yet. MySQL commits schema changes implicitly, so a migration is recorded only once all of its steps are
+    done and is safe to run again after failing halfway.
+    :return: Number of migrations applied.
+    """
+    applied_count = 0
+    with engine.connect() as connection:
+        is_mysql = connection.dialect.name == "mysql"
+        if is_mysql:
+            locked = connection.execute(text("SELECT GET_LOCK(:name, :timeout)"),
+                                        {"name": MIGRATIONS_LOCK, "timeout": MIGRATIONS_LOCK_TIMEOUT}).scalar()
+            if locked != 1:
+                raise MigrationError("Timed out waiting for another process to finish migrating the database")
+        try:
+            metadata.create_all(connection)
+            applied = get_applied(connection)
+            connection.commit()
+            for version, name, migrate in MIGRATIONS:
+                if version in applied:
+                    continue
+                started = time.perf_counter()
+                log_event(logging.INFO, "Applying migration {}".format(name), version)
+                try:
+                    migrate(connection)
+                    connection.execute(text("INSERT INTO {} (version, name, applied_at) VALUES (:version, :name, :applied_at)".format(MIGRATIONS_TABLE)),
+                                       {"version": version, "name": name, "applied_at": int(datetime.now(tz=pytz.utc).timestamp())})
+                    connection.commit()
+                except Exception as e:
+                    connection.rollback()
+                    log_event(logging.ERROR, "Migration {} failed".format(name), version, error=str(e))
+                    raise MigrationError("Migration {} ({}) failed: {}".format(version, name, e)) from e
+                log_event(logging.INFO, "Applied migration {} in {:.2f}s".format(name, time.perf_counter() - started), version)
+                applied_count += 1
+        finally:
+            if is_mysql:
+                connection.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": MIGRATIONS_LOCK})
+                connection.commit()
+    return applied_count
@@ -0,0 +1,122 @@
+import base64
+import binascii
+import json
+import threading
+import time
+import typing
+from typing import Optional
+
+from sqlalchemy import and_, or_
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+# How the total number of rows of a listing is determined: counted on every request, counted at most every
+# PAGINATION_COUNT_CACHE_SECONDS per filter combination, or not at all.
+CountMode = typing.Literal["exact", "cached", "none"]
+# Name of the count cache for invalidations, see `src.utils.events.invalidate_cache`. Keys start with the listing's name.
+COUNT_CACHE = "pagination.counts"
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(created_at: int, _id: typing.Union[int, str]) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, _id], separators=(",", ":")).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> typing.Tuple[int, typing.Union[int, str]]:
+    try:
+        created_at, _id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+        raise InvalidCursor("Invalid cursor '{}'".format(cursor))
+    if not isinstance(created_at, int) or not isinstance(_id, (int, str)):
+        raise InvalidCursor("Invalid cursor '{}'".format(cursor))
+    return created_at, _id
+
+
+def paginate(query, created_at_column, id_column, limit: int, cursor: Optional[str] = None, page: int = 0):
+    """
+    Order a query newest first by (created_at, id) and select one page of it, plus one row to tell whether there is a
+    next page. With a cursor, rows are selected by position (keyset pagination) instead of skipping `page * limit` rows,
+    so every page costs the same to read, however deep into the listing it is.
+    """
+    if cursor is not None:
+        created_at, _id = decode_cursor(cursor)
+        query = query.where(or_(created_at_column < created_at, and_(created_at_column == created_at, id_column < _id)))
+    query = query.order_by(created_at_column.desc(), id_column.desc())
+    if cursor is None and page > 0:
+        query = query.offset(page * limit)
+    return query.limit(limit + 1)
+
+
+def split_page(rows: typing.Sequence, limit: int, key: typing.Callable[[typing.Any], typing.Tuple[int, typing.Union[int, str]]]) -> typing.Tuple[list, Optional[str]]:
+    """
+    :param rows: Rows selected by `paginate`.
+    :param key: Returns the (created_at, id) of a row.
+    :return: The rows of the page and the cursor of the next page, None on the last page.
+    """
+    rows = list(rows)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
+
+
+class CountCache:
+    """Row counts of listings per filter combination, each reused for `ttl` seconds."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.entries: typing.Dict[typing.Hashable, typing.Tuple[float, int]] = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: typing.Hashable) -> Optional[int]:
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return None
+        return entry[1]
+
+    def invalidate(self, prefix: Optional[tuple] = None) -> None:
+        """Drop the counts whose key starts with `prefix`, all counts when None."""
+        with self.lock:
+            if prefix is None:
+                self.entries.clear()
+                return
+            for key in [k for k in self.entries if isinstance(k, tuple) and k[:len(prefix)] == prefix]:
+                del self.entries[key]
+
+    def put(self, key: typing.Hashable, value: int) -> None:
+        with self.lock:
+            if len(self.entries) > 10000:
+                self.entries.clear()
+            self.entries[key] = (time.monotonic(), value)
+
+
+    def count(self, session: Session, query, mode: CountMode, key: typing.Hashable) -> Optional[int]:
+        """
+        Run a count query, according to `mode`.
+        :param key: Identifies the listing and its filters.
+        """
+        if mode == "none":
+            return None
+        if mode == "cached":
+            total = self.get(key)
+            if total is not None:
+                return total
+        total = session.exec(query).one()
+        self.put(key, total)
+        return total
+
+    async def count_async(self, session: AsyncSession, query, mode: CountMode, key: typing.Hashable) -> Optional[int]:
+        """`count` on an asynchronous session."""
+        if mode == "none":
+            return None
+        if mode == "cached":
+            total = self.get(key)
+            if total is not None:
+                return total
+        total = (await session.exec(query)).one()
+        self.put(key, total)
+        return total
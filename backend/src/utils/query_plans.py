@@ -0,0 +1,127 @@
+"""
+Verify that the hot queries of db_models are served by the indexes added in `src.utils.migrations`:
+
+    python -m src.utils.query_plans [--strict]
+
+Every query is issued through its db_models method inside a transaction that is rolled back, the SQL it sends is
+recorded and explained. A check fails when its index cannot be used by the query at all. MySQL prefers scanning small
+tables over using an index, so an index that can be used but is not chosen only fails the check with --strict.
+"""
+import argparse
+import sys
+import typing
+from dataclasses import dataclass, field
+
+from sqlalchemy import Connection, Engine, event
+from sqlmodel import Session
+
+from src.db_models import DockerImage, DockerImageFiles, DockerJobs, DockerScheduled, DockerScripts
+from src.enums import JobStatus
+from src.factory.database import engine
+
+# Hot query, table expected to be read through an index, the index, and a call issuing the query.
+HOT_QUERIES: typing.List[typing.Tuple[str, str, str, typing.Callable[[Session], typing.Any]]] = [
+    ("job history", "dockerjobs", "ix_dockerjobs_script_created",
+     lambda session: DockerJobs.get_by_script_id("script", 0, 100, None, session)),
+    ("job history by status", "dockerjobs", "ix_dockerjobs_script_status_created",
+     lambda session: DockerJobs.get_by_script_id("script", 0, 100, JobStatus.SUCCESS.value, session)),
+    ("running jobs of a script", "dockerjobs", "ix_dockerjobs_script_status_created",
+     lambda session: DockerJobs.get_running_jobs("script", session)),
+    ("running jobs", "dockerjobs", "ix_dockerjobs_status_script",
+     lambda session: DockerJobs.get_running_jobs(None, session)),
+    ("kill lookup", "dockerjobs", "ix_dockerjobs_container_id",
+     lambda session: DockerJobs.get_by_container_id("container", session)),
+    ("runnable schedules", "dockerscheduled", "ix_dockerscheduled_runnable",
+     lambda session: DockerScheduled.get_runnable(session)),
+    ("schedules of a script", "dockerscheduled", "ix_dockerscheduled_script_created",
+     lambda session: DockerScheduled.get_by_script_id("script", session)),
+    ("scripts of an image", "dockerscripts", "ix_dockerscripts_image_deleted",
+     lambda session: DockerScripts.get_by_image_id("image", session)),
+    ("files of an image", "dockerimagefiles", "ix_dockerimagefiles_image_id",
+     lambda session: DockerImageFiles.get_by_image_id("image", session)),
+    ("images by docker id", "dockerimage", "ix_dockerimage_image_id",
+     lambda session: DockerImage.get_by_image_id("sha256:image", session)),
+]
+
+
+@dataclass
+class PlanCheck:
+    name: str
+    table: str
+    index: str
+    possible_keys: typing.List[str] = field(default_factory=list)
+    key: typing.Optional[str] = None
+    error: typing.Optional[str] = None
+
+    @property
+    def usable(self) -> bool:
+        return self.error is None and self.index in self.possible_keys
+
+    @property
+    def chosen(self) -> bool:
+        return self.error is None and self.key == self.index
+
+    def passed(self, strict: bool = False) -> bool:
+        return self.chosen if strict else self.usable
+
+
+def record_selects(connection: Connection, call: typing.Callable[[Session], typing.Any]) -> typing.List[typing.Tuple[str, typing.Any]]:
+    """Statements and parameters of the SELECTs sent whilst running `call`."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    event.listen(connection, "before_cursor_execute", before_cursor_execute)
+    try:
+        with Session(bind=connection) as session:
+            call(session)
+    finally:
+        event.remove(connection, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+def explain(connection: Connection, statement: str, parameters: typing.Any) -> typing.List[dict]:
+    result = connection.exec_driver_sql("EXPLAIN " + statement, parameters)
+    return [dict(row._mapping) for row in result]
+
+
+def check_query_plans(bind: Engine) -> typing.List[PlanCheck]:
+    checks = []
+    with bind.connect() as connection:
+        if connection.dialect.name != "mysql":
+            raise RuntimeError("Query plans can only be checked on MySQL, not {}".format(connection.dialect.name))
+        for name, table, index, call in HOT_QUERIES:
+            check = PlanCheck(name, table, index)
+            checks.append(check)
+            transaction = connection.begin()
+            try:
+                for statement, parameters in record_selects(connection, call):
+                    for row in explain(connection, statement, parameters):
+                        if row.get("table") != table:
+                            continue
+                        check.possible_keys = (row.get("possible_keys") or "").split(",")
+                        check.key = row.get("key")
+            except Exception as e:
+                check.error = str(e)
+            finally:
+                transaction.rollback()
+    return checks
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Verify that hot queries are served by their indexes.")
+    parser.add_argument("--strict", action="store_true", help="Fail when an index can be used but is not chosen.")
+    args = parser.parse_args(argv)
+
+    checks = check_query_plans(engine)
+    for check in checks:
+        state = "OK" if check.chosen else "USABLE" if check.usable else "FAIL"
+        detail = check.error if check.error is not None else "uses {}".format(check.key or "no index")
+        print("{:<7} {:<26} {:<38} {}".format(state, check.name, check.index, detail))
+    return 0 if all(check.passed(args.strict) for check in checks) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
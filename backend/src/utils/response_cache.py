@@ -0,0 +1,153 @@
+import collections
+import inspect
+import json
+import threading
+import time
+import typing
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+
+from fastapi.encoders import jsonable_encoder
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+from src.factory.conf import config
+from src.utils.events import invalidate_cache, register_cache
+
+# Name of the response cache for invalidations, see `src.utils.events.invalidate_cache`.
+RESPONSE_CACHE = "responses"
+
+# Resources whose GET responses are cached. A response depends on exactly one resource's version.
+IMAGES = "images"
+SCRIPTS = "scripts"
+LANGUAGES = "languages"
+
+
+def script_code(script_id: str) -> str:
+    return "script-code:{}".format(script_id)
+
+
+class ResourceVersion(typing.NamedTuple):
+    token: str
+    modified_at: float
+    seen_at: float  # When this process learnt about the version, compared against the cache's ttl
+
+
+class ResponseCache:
+    """
+    Versioned GET responses. Every resource has a version, replaced whenever the resource is written to: the new
+    version is applied by the writing process right away and by every API process through the broker, so all of them
+    hand out the same ETag for it. Requests presenting the current version's ETag (or a Last-Modified date that is not
+    older) are answered with 304 Not Modified, others from the bodies cached for the current version, least recently
+    used evicted first, or by computing the response.
+
+    A process that never heard of a resource's version makes one up, modified now, and versions older than `ttl`
+    seconds are made up anew, which bounds the staleness should an invalidation ever get lost.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.versions: typing.Dict[str, ResourceVersion] = {}
+        self.entries: collections.OrderedDict[typing.Tuple[str, str, str], typing.Tuple[bytes, Optional[str]]] = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def version(self, resource: str) -> ResourceVersion:
+        with self.lock:
+            current = self.versions.get(resource)
+            now = time.time()
+            if current is None or (self.ttl > 0 and now - current.seen_at > self.ttl):
+                current = ResourceVersion(uuid.uuid4().hex[:16], now, now)
+                self.versions[resource] = current
+            return current
+
+    def apply(self, key: Optional[tuple]) -> None:
+        """Switch a resource to a new version, key is (resource, token, modified_at). Forget all versions when None."""
+        with self.lock:
+            if key is None:
+                self.versions.clear()
+                self.entries.clear()
+                self.size = 0
+                return
+            resource, token, modified_at = key
+            self.versions[resource] = ResourceVersion(token, modified_at, time.time())
+            for entry_key in [k for k in self.entries if k[0] == resource]:
+                body, _ = self.entries.pop(entry_key)
+                self.size -= len(body)
+
+    def bump(self, *resources: str) -> None:
+        """Give resources a new version. Must be called after the write has been committed."""
+        now = time.time()
+        for resource in resources:
+            invalidate_cache(RESPONSE_CACHE, (resource, uuid.uuid4().hex[:16], now))
+
+    def get(self, resource: str, token: str, url: str) -> Optional[typing.Tuple[bytes, Optional[str]]]:
+        with self.lock:
+            entry = self.entries.get((resource, token, url))
+            if entry is not None:
+                self.entries.move_to_end((resource, token, url))
+            return entry
+
+    def put(self, resource: str, token: str, url: str, body: bytes, media_type: Optional[str]) -> None:
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop((resource, token, url), None)
+            if previous is not None:
+                self.size -= len(previous[0])
+            self.entries[(resource, token, url)] = (body, media_type)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    async def respond(self, request: Request, resource: str,
+                      compute: typing.Callable[[], typing.Union[dict, Response, typing.Awaitable[typing.Union[dict, Response]]]]) -> Response:
+        """
+        Answer a GET request for `resource` from the cache, computing the response with `compute` on a miss. Only
+        successful, non-streaming responses are cached, others are returned as they are.
+        """
+        current = self.version(resource)
+        headers = {"ETag": 'W/"{}"'.format(current.token), "Last-Modified": formatdate(current.modified_at, usegmt=True),
+                   "Cache-Control": "no-cache"}
+        if is_not_modified(request, current):
+            return Response(status_code=304, headers=headers)
+
+        url = str(request.url)
+        cached = self.get(resource, current.token, url)
+        if cached is not None:
+            return Response(content=cached[0], media_type=cached[1], headers=headers)
+
+        result = compute()
+        if inspect.isawaitable(result):
+            result = await result
+        if isinstance(result, StreamingResponse):
+            return result
+        if not isinstance(result, Response):
+            result = Response(content=json.dumps(jsonable_encoder(result)), media_type="application/json")
+        if result.status_code != 200:
+            return result
+        self.put(resource, current.token, url, result.body, result.media_type)
+        result.headers.update(headers)
+        return result
+
+
+def is_not_modified(request: Request, current: ResourceVersion) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or '"{}"'.format(current.token) in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            # HTTP dates have a resolution of seconds.
+            return int(current.modified_at) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+response_cache = ResponseCache(config.RESPONSE_CACHE_BYTES, config.RESPONSE_CACHE_TTL_SECONDS)
+register_cache(RESPONSE_CACHE, response_cache.apply)
@@ -10,6 +10,7 @@ from src.db_models import DockerJobs, DockerScheduled, DockerScripts, DockerImag
 from src.enums import JobStatus
 from src.factory.database import engine
 from src.logic import run_script_process
+from src.utils.events import publish_job_event
 
 class ScriptNotFound(Exception):
     """Raised when a script cannot be found."""
@@ -46,6 +47,7 @@ class Task:
         session.add(job_object)
         session.commit()
         session.refresh(job_object)
+        publish_job_event(job_object, "created")
         return job_object.id
 
     def validate(self):
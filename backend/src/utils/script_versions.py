@@ -0,0 +1,206 @@
+import collections
+import difflib
+import hashlib
+import os
+import struct
+import threading
+import typing
+import zlib
+from typing import Optional
+
+from sqlalchemy import event
+from sqlmodel import Session
+
+from src.db_models import DockerScripts, DockerScriptVersions
+from src.factory import config
+
+# Delta operations: copy a run of lines from the base version, or insert new content.
+COPY = b"C"
+INSERT = b"I"
+COPY_STRUCT = struct.Struct(">II")
+INSERT_STRUCT = struct.Struct(">I")
+# Content larger than this is always stored as a keyframe, line matching is quadratic in the worst case.
+DELTA_MAX_BYTES = 1024 * 1024
+
+
+class VersionNotFound(Exception):
+    pass
+
+
+class CorruptVersion(Exception):
+    pass
+
+
+def make_delta(base: bytes, target: bytes) -> bytes:
+    """Encode `target` as the runs of lines it shares with `base` plus the content in between."""
+    base_lines = base.splitlines(keepends=True)
+    target_lines = target.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, base_lines, target_lines, autojunk=False)
+    delta = bytearray()
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            delta += COPY + COPY_STRUCT.pack(i1, i2 - i1)
+        elif j2 > j1:
+            data = b"".join(target_lines[j1:j2])
+            delta += INSERT + INSERT_STRUCT.pack(len(data)) + data
+    return bytes(delta)
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    base_lines = base.splitlines(keepends=True)
+    parts = []
+    position = 0
+    while position < len(delta):
+        op = delta[position:position + 1]
+        position += 1
+        if op == COPY:
+            start, count = COPY_STRUCT.unpack_from(delta, position)
+            position += COPY_STRUCT.size
+            parts.extend(base_lines[start:start + count])
+        elif op == INSERT:
+            (length,) = INSERT_STRUCT.unpack_from(delta, position)
+            position += INSERT_STRUCT.size
+            parts.append(delta[position:position + length])
+            position += length
+        else:
+            raise CorruptVersion("Unknown delta operation {!r} at offset {}".format(op, position - 1))
+    return b"".join(parts)
+
+
+class VersionCache:
+    """Least recently used reconstructed versions, bounded by their total size."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: collections.OrderedDict[typing.Tuple[str, int], bytes] = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, script_id: str, version: int) -> Optional[bytes]:
+        with self.lock:
+            content = self.entries.get((script_id, version))
+            if content is not None:
+                self.entries.move_to_end((script_id, version))
+            return content
+
+    def put(self, script_id: str, version: int, content: bytes) -> None:
+        if len(content) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop((script_id, version), None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.entries[(script_id, version)] = content
+            self.size += len(content)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+version_cache = VersionCache(config.SCRIPT_VERSION_CACHE_BYTES)
+# Key of the versions added in a session, cached once the session commits them. A version whose transaction is rolled
+# back is not cached, its number is given to the next version added.
+PENDING_VERSIONS = "pending_script_versions"
+
+
+@event.listens_for(Session, "after_commit")
+def cache_committed_versions(session: Session) -> None:
+    for script_id, version, content in session.info.pop(PENDING_VERSIONS, []):
+        version_cache.put(script_id, version, content)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_pending_versions(session: Session) -> None:
+    session.info.pop(PENDING_VERSIONS, None)
+
+
+class ScriptVersionStore:
+    """
+    Every version of a script's code, appended to the script's `versions.pack` as a zlib compressed record. A record
+    holds the full content (a keyframe) at least every SCRIPT_VERSION_KEYFRAME_INTERVAL versions, and a line based
+    delta against the previous version otherwise, so a version is reconstructed from at most that many records.
+    Records are only ever appended: one that is not referenced by a committed version is ignored.
+    """
+
+    def __init__(self, script_id: str, keyframe_interval: Optional[int] = None):
+        self.script_id = script_id
+        self.pack_path = os.path.join(config.SCRIPT_DIR, script_id, "versions.pack")
+        self.keyframe_interval = keyframe_interval or config.SCRIPT_VERSION_KEYFRAME_INTERVAL
+
+    def append(self, payload: bytes) -> typing.Tuple[int, int]:
+        record = zlib.compress(payload, 9)
+        with open(self.pack_path, "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+        return offset, len(record)
+
+    def add(self, script: DockerScripts, content: bytes, session: Session) -> DockerScriptVersions:
+        """
+        Store `content` as the script's next version and make it the script's current version. The caller holds a lock
+        on the script's row and commits the session.
+        """
+        version = (script.version or 0) + 1
+        base_version = None
+        payload = content
+        if script.version is not None and len(content) <= DELTA_MAX_BYTES:
+            chain = DockerScriptVersions.get_chain(self.script_id, script.version, session)
+            if len(chain) < self.keyframe_interval:
+                base = self.read_chain(chain)
+                if len(base) <= DELTA_MAX_BYTES:
+                    delta = make_delta(base, content)
+                    # Content that changed throughout is cheaper to store in full.
+                    if len(zlib.compress(delta)) < len(zlib.compress(content)):
+                        base_version, payload = script.version, delta
+
+        offset, length = self.append(payload)
+        record = DockerScriptVersions(script_id=self.script_id, version=version, sha256=hashlib.sha256(content).hexdigest(),
+                                      size=len(content), base_version=base_version, offset=offset, length=length)
+        session.add(record)
+        script.version = version
+        session.add(script)
+        session.info.setdefault(PENDING_VERSIONS, []).append((self.script_id, version, content))
+        return record
+
+    def read(self, version: int, session: Session) -> bytes:
+        content = version_cache.get(self.script_id, version)
+        if content is not None:
+            return content
+        chain = DockerScriptVersions.get_chain(self.script_id, version, session)
+        if len(chain) == 0 or chain[-1].version != version:
+            raise VersionNotFound("Version {} of script '{}' not found".format(version, self.script_id))
+        return self.read_chain(chain)
+
+    def read_chain(self, chain: typing.Sequence[DockerScriptVersions]) -> bytes:
+        """Reconstruct the last version of a chain starting at a keyframe, verifying every version on the way."""
+        # Continue from the latest version of the chain that is cached, if any.
+        start, content = 0, b""
+        for index in range(len(chain) - 1, -1, -1):
+            cached = version_cache.get(self.script_id, chain[index].version)
+            if cached is not None:
+                start, content = index + 1, cached
+                break
+        if start == len(chain):
+            return content
+
+        with open(self.pack_path, "rb") as f:
+            for record in chain[start:]:
+                f.seek(record.offset)
+                try:
+                    payload = zlib.decompress(f.read(record.length))
+                except zlib.error as e:
+                    raise CorruptVersion("Version {} of script '{}' is unreadable: {}".format(record.version, self.script_id, e))
+                content = payload if record.base_version is None else apply_delta(content, payload)
+                if hashlib.sha256(content).hexdigest() != record.sha256:
+                    raise CorruptVersion("Version {} of script '{}' does not match its digest".format(record.version, self.script_id))
+        if chain:
+            version_cache.put(self.script_id, chain[-1].version, content)
+        return content
+
+    def diff(self, from_version: int, to_version: int, session: Session, context: int = 3) -> str:
+        """Unified diff between two versions."""
+        before = self.read(from_version, session).decode("utf-8", errors="replace").splitlines(keepends=True)
+        after = self.read(to_version, session).decode("utf-8", errors="replace").splitlines(keepends=True)
+        return "".join(difflib.unified_diff(before, after, fromfile="script@v{}".format(from_version),
+                                            tofile="script@v{}".format(to_version), n=context))
@@ -0,0 +1,77 @@
+from typing import Optional
+
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import PlainTextResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.factory.conf import config
+
+# Allowance for the multipart boundaries, part headers and form fields around the uploaded files.
+FORM_OVERHEAD_BYTES = 1024 * 1024
+
+
+def limit_message() -> str:
+    return "Request body exceeds the upload limit of {} bytes".format(config.UPLOAD_MAX_REQUEST_BYTES)
+
+
+class RequestTooLarge(HTTPException):
+    """
+    Raised from the body stream once a request without a declared length exceeds the limit. It is raised whilst the
+    endpoint parses its form, FastAPI passes HTTP exceptions raised there on instead of reporting a malformed body (400).
+    """
+
+    def __init__(self):
+        super().__init__(status_code=413, detail=limit_message(), headers={"Connection": "close"})
+
+
+class RequestSizeLimitMiddleware:
+    """
+    Rejects request bodies larger than UPLOAD_MAX_REQUEST_BYTES with 413 before they are parsed. Requests declaring
+    their length are rejected from their headers alone, chunked requests once the limit has been received.
+    """
+
+    def __init__(self, app: ASGIApp, max_bytes: Optional[int] = None):
+        self.app = app
+        limit = config.UPLOAD_MAX_REQUEST_BYTES if max_bytes is None else max_bytes
+        self.max_bytes = limit + FORM_OVERHEAD_BYTES if limit > 0 else 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or self.max_bytes == 0:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            await self.reject(scope, receive, send)
+            return
+
+        received = 0
+        response_started = False
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise RequestTooLarge()
+            return message
+
+        async def tracked_send(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except RequestTooLarge:
+            # Read outside of the endpoints' exception handling, e.g. by another middleware.
+            if response_started:
+                raise
+            await self.reject(scope, receive, send)
+
+    async def reject(self, scope: Scope, receive: Receive, send: Send) -> None:
+        response = PlainTextResponse(limit_message(), status_code=413, headers={"Connection": "close"})
+        await response(scope, receive, send)
@@ -6,7 +6,8 @@ import {
     ScriptResponse,
     AvailableLanguages,
     JobLog,
-    JobResponse, IFile
+    JobResponse, IFile,
+    LogStreamHandlers, JobEvent, LogPageOptions
 } from "@/interfaces";
 export interface ImageResponse {
     images: Image[],
@@ -74,9 +75,19 @@ export async function getImageSupporting(imageId: string): Promise<{files: IFile
     }
 }
 
-export async function getImageLogs(imageId: string, lastPosition: number): Promise<ImageLog> {
+function logPageQuery(lastPosition: number, options: LogPageOptions): string {
+    const params = new URLSearchParams({last_position: String(lastPosition)});
+    if (options.tail !== undefined) params.set("tail", String(options.tail));
+    if (options.before !== undefined) params.set("before", String(options.before));
+    if (options.maxLines !== undefined) params.set("max_lines", String(options.maxLines));
+    if (options.maxBytes !== undefined) params.set("max_bytes", String(options.maxBytes));
+    if (options.line !== undefined) params.set("line", String(options.line));
+    return params.toString();
+}
+
+export async function getImageLogs(imageId: string, lastPosition: number, options: LogPageOptions = {}): Promise<ImageLog> {
     try{
-        const res = await fetch(`${BASE_URL}/api/image/${imageId}/logs?last_position=${encodeURIComponent(lastPosition)}`)
+        const res = await fetch(`${BASE_URL}/api/image/${imageId}/logs?${logPageQuery(lastPosition, options)}`)
         if (res.ok){
             return Promise.resolve(await res.json())
         } else if (res.status == 404) {
@@ -146,6 +157,21 @@ export async function buildImage(imageId: string): Promise<string> {
     }
 }
 
+export async function rollbackImage(imageId: string): Promise<string> {
+    try{
+        const res = await fetch(`${BASE_URL}/api/image/${imageId}/rollback`, {
+            method: 'POST'
+        });
+        if (res.ok) {
+            return Promise.resolve(await res.text())
+        }else{
+            return Promise.reject(await res.text())
+        }
+    }catch (e) {
+        return Promise.reject(e);
+    }
+}
+
 export async function createImage(formData: FormData): Promise<string> {
     try{
         const res = await fetch(`${BASE_URL}/api/image`, {
@@ -314,9 +340,15 @@ export async function getScriptJobs(scriptId: string, page: number = 0, limit: n
     }
 }
 
-export async function getJobLogs(jobId: number, lastPosition: number): Promise<JobLog> {
+export function getScriptLogsExportUrl(scriptId: string, format: "tar.gz" | "zip" = "tar.gz", afterJobId?: number): string {
+    const params = new URLSearchParams({format});
+    if (afterJobId !== undefined) params.set("after_job_id", String(afterJobId));
+    return `${BASE_URL}/api/script/${scriptId}/logs/export?${params.toString()}`;
+}
+
+export async function getJobLogs(jobId: number, lastPosition: number, options: LogPageOptions = {}): Promise<JobLog> {
     try{
-        const res = await fetch(`${BASE_URL}/api/job/${jobId}?last_position=${encodeURIComponent(lastPosition)}`)
+        const res = await fetch(`${BASE_URL}/api/job/${jobId}?${logPageQuery(lastPosition, options)}`)
         if (res.ok){
             return Promise.resolve(await res.json())
         } else if (res.status == 404) {
@@ -433,4 +465,42 @@ export async function deleteScript(scriptId: string): Promise<void> {
     }catch (e) {
         return Promise.reject(e);
     }
-}
\ No newline at end of file
+}
+
+function openLogStream(url: string, handlers: LogStreamHandlers): EventSource {
+    const source = new EventSource(url);
+    source.addEventListener("log", (event) => {
+        const {lines, position} = JSON.parse((event as MessageEvent).data);
+        handlers.onLines(lines, position);
+    });
+    source.addEventListener("status", (event) => {
+        handlers.onStatus?.(JSON.parse((event as MessageEvent).data).status);
+    });
+    source.addEventListener("end", (event) => {
+        source.close();
+        handlers.onEnd?.(JSON.parse((event as MessageEvent).data).status);
+    });
+    source.onerror = (event) => {
+        // EventSource reconnects (resuming from the last event id) unless the stream was closed.
+        if (source.readyState === EventSource.CLOSED) handlers.onError?.(event);
+    };
+    return source;
+}
+
+export function streamJobLogs(jobId: number, lastPosition: number, handlers: LogStreamHandlers): EventSource {
+    return openLogStream(`${BASE_URL}/api/job/${jobId}/stream?last_position=${encodeURIComponent(lastPosition)}`, handlers);
+}
+
+export function streamImageLogs(imageId: string, lastPosition: number, handlers: LogStreamHandlers): EventSource {
+    return openLogStream(`${BASE_URL}/api/image/${imageId}/logs/stream?last_position=${encodeURIComponent(lastPosition)}`, handlers);
+}
+
+export function streamJobEvents(scriptId: string, onEvent: (event: JobEvent) => void, onResync: () => void): EventSource {
+    let opened = false;
+    const source = new EventSource(`${BASE_URL}/api/jobs/events?script_id=${encodeURIComponent(scriptId)}`);
+    source.addEventListener("job", (event) => onEvent(JSON.parse((event as MessageEvent).data)));
+    // Events were dropped, or may have been missed whilst reconnecting.
+    source.addEventListener("resync", onResync);
+    source.onopen = () => { if (opened) onResync(); opened = true; };
+    return source;
+}
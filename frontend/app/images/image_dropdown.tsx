@@ -1,4 +1,4 @@
-import {Bomb, Delete, Edit, Hammer, Logs, MoreHorizontal} from "lucide-react"
+import {Bomb, Delete, Edit, Hammer, Logs, MoreHorizontal, Undo2} from "lucide-react"
 
 import {
     DropdownMenu,
@@ -16,13 +16,14 @@ import {router} from "next/client";
 type DropDownProps = {
     image: Image;
     onBuild: (imageId: string) => void;
+    onRollback: (imageId: string) => void;
     onLogs: (imageId: string) => void;
     onDelete: (imageId: string) => void;
     onEdit: (imageId: string) => void;
     onDestroy: (imageId: string) => void;
 }
 
-export function ImageDropDown({image, onBuild, onLogs, onDelete, onEdit, onDestroy}: DropDownProps) {
+export function ImageDropDown({image, onBuild, onRollback, onLogs, onDelete, onEdit, onDestroy}: DropDownProps) {
     return (
         <DropdownMenu>
             <DropdownMenuTrigger asChild >
@@ -33,11 +34,22 @@ export function ImageDropDown({image, onBuild, onLogs, onDelete, onEdit, onDestr
                 <DropdownMenuSeparator />
                 <DropdownMenuGroup>
                     {
-                        image.status == ImageStatus.DORMANT && (
+                        image.status != ImageStatus.BUILDING && (
                             <DropdownMenuItem className={"hover:bg-[#383838]"}>
                                 <div className="flex gap-2 items-center hover:cursor-pointer w-full" onClick={() => onBuild(image.id)}>
                                     <Hammer size={16}/>
-                                    Build
+                                    {image.status == ImageStatus.DORMANT ? "Build" : "Build New Version"}
+                                </div>
+                            </DropdownMenuItem>
+                        )
+                    }
+
+                    {
+                        image.status == ImageStatus.BUILD_SUCCESS && image.version != null && image.version > 1 && (
+                            <DropdownMenuItem className={"hover:bg-[#383838]"}>
+                                <div className="flex gap-2 items-center hover:cursor-pointer w-full" onClick={() => onRollback(image.id)}>
+                                    <Undo2 size={16}/>
+                                    Roll Back to Previous Version
                                 </div>
                             </DropdownMenuItem>
                         )
@@ -3,8 +3,8 @@ import {Button} from "@/components/ui/button";
 import {X} from "lucide-react";
 import {LoadingSpinner} from "@/components/loading-spinner";
 import {useEffect, useState} from "react";
-import {Image, ImageLog} from "@/interfaces";
-import {getImageLogs} from "@/apis";
+import {Image} from "@/interfaces";
+import {streamImageLogs} from "@/apis";
 import {ImageStatus} from "@/app/images/enums";
 
 export default function ImageLogs({open, image, onClose}: {open: boolean, image: Image|null, onClose: () => void }) {
@@ -13,46 +13,26 @@ export default function ImageLogs({open, image, onClose}: {open: boolean, image:
     const [logContent, setLogContent] = useState<string[] | null>(null);
     const [nextPosition, setNextPosition] = useState<number>(0)
 
-    const fetchLogContent = async (id: string, position: number = 0): Promise<ImageLog> => {
-        try {
-            return Promise.resolve(await getImageLogs(id, position))
-        } catch (e) {
-            setLogContent(["Error fetching log content"]);
-            setLoading(false)
-            return Promise.reject(e);
-        }
-    }
-
     useEffect(() => {
-        let interval: NodeJS.Timeout;
-        let previousNextPosition: number | null = null;
+        let source: EventSource | null = null;
 
-        const pollLogs = async () => {
-            if (!image?.id) return;
-            try {
-                const {lines, new_position} = await fetchLogContent(image.id, nextPosition);
-                if(new_position !== previousNextPosition){
+        // The build log is streamed as it is written; the stream ends once the build succeeds or fails.
+        if (image?.id) {
+            source = streamImageLogs(image.id, nextPosition, {
+                onLines: (lines, position) => {
                     setLogContent(prev => [...(prev ? prev : []), ...lines])
-                    previousNextPosition = new_position;
-                    setNextPosition(new_position);
-                }else{
+                    setNextPosition(position);
+                },
+                onEnd: () => setLoading(false),
+                onError: () => {
+                    setLogContent(prev => prev ? prev : ["Error fetching log content"]);
                     setLoading(false)
-                    clearInterval(interval)
                 }
-            }catch (error){
-                console.error(error)
-                clearInterval(interval)
-            }
-        }
-
-        // Initial fetch
-        if (image?.id) {
-            void pollLogs();
-            interval = setInterval(pollLogs, 5000);
+            });
         }
 
         return () => {
-            if (interval) clearInterval(interval);
+            source?.close();
         };
     }, [image]);
 
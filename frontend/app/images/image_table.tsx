@@ -3,7 +3,7 @@ import {ColumnDef} from "@tanstack/react-table"
 import {useEffect, useState} from "react";
 import DataTable from "@/components/data-table";
 import {useRouter} from "next/navigation";
-import {buildImage, deleteImage, destroyImage, getImages} from "@/apis";
+import {buildImage, deleteImage, destroyImage, getImages, rollbackImage} from "@/apis";
 import {Image} from "@/interfaces";
 import {ImageDropDown} from "@/app/images/image_dropdown";
 import ImageLogs from "@/app/images/image_logs";
@@ -58,6 +58,17 @@ export function ImageTable() {
         }
     }
 
+    const onRollbackImage = async (imageId: string) => {
+        try {
+            await rollbackImage(imageId);
+            setPagination(prevState => ({...prevState, pageIndex: prevState.pageIndex}))
+            toast.success("Image rolled back.")
+        }catch (e: unknown) {
+            toast.error(e as string);
+            return Promise.reject(e)
+        }
+    }
+
     const onDeleteImage = async (imageId: string) => {
         try {
             await deleteImage(imageId);
@@ -96,7 +107,7 @@ export function ImageTable() {
             header: "Status",
             cell: ({row}) => (
                 <div className={row.original.status  == ImageStatus.BUILD_SUCCESS ? "text-green-200" : row.original.status == ImageStatus.BUILD_FAILED ? "text-red-200" : "text-orange-200"}>
-                    {ImageStatus[row?.original?.status] ?? "UNKNOWN"}
+                    {ImageStatus[row?.original?.status] ?? "UNKNOWN"}{row.original.version != null ? ` (v${row.original.version})` : ""}
                 </div>),
         },
         {
@@ -107,6 +118,9 @@ export function ImageTable() {
                                onBuild={(imageId: string) => {
                                    void onBuildImage(imageId);
                                }}
+                               onRollback={(imageId: string) => {
+                                   void onRollbackImage(imageId);
+                               }}
                                onLogs={() => {
                                   setImageLogs(row.original)
                                }}
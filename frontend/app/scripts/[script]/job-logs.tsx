@@ -3,19 +3,24 @@ import {JobStatus} from "@/app/scripts/[script]/enums";
 import {Button} from "@/components/ui/button";
 import {X} from "lucide-react";
 import {LoadingSpinner} from "@/components/loading-spinner";
-import {getJobLogs} from "@/apis";
-import {JobLog, Jobs} from "@/interfaces"
+import {getJobLogs, streamJobLogs} from "@/apis";
+import {JobLog, Jobs, LogPageOptions} from "@/interfaces"
 import {useEffect, useState} from "react";
 
+// Number of lines loaded when the logs are opened, and per "Load earlier lines".
+const TAIL_LINES = 1000;
+
 export default function JobLogs({open, jobId, onClose}: {open: boolean, jobId?: number, onClose: () => void }) {
 
     const [loading, setLoading] = useState(true);
     const [logContent, setLogContent] = useState<string[] | null>(null);
     const [job, setJob] = useState<Jobs>(null!)
+    // Position of the first loaded line, null once the start of the log has been loaded.
+    const [earliestPosition, setEarliestPosition] = useState<number | null>(null)
 
-    const fetchLogContent = async (id: number, position: number = 0): Promise<JobLog> => {
+    const fetchLogContent = async (id: number, position: number = 0, options: LogPageOptions = {}): Promise<JobLog> => {
         try {
-            return Promise.resolve(await getJobLogs(id, position))
+            return Promise.resolve(await getJobLogs(id, position, options))
         } catch (e) {
             setLogContent(["Error fetching log content"]);
             setLoading(false)
@@ -24,41 +29,60 @@ export default function JobLogs({open, jobId, onClose}: {open: boolean, jobId?:
     }
 
     useEffect(() => {
-        let interval: NodeJS.Timeout;
+        let source: EventSource | null = null;
+        let cancelled = false;
         let nextPosition: number = 0;
 
-        const pollLogs = async () => {
-            if (!jobId) return;
+        const openStream = async (id: number) => {
             try {
-                const {job: myJob, lines, new_position} = await fetchLogContent(jobId, nextPosition);
+                // Initial fetch provides the job details and the last lines written so far.
+                const {job: myJob, lines, new_position, start_position} = await fetchLogContent(id, nextPosition, {tail: TAIL_LINES});
+                if (cancelled) return;
                 setJob(myJob);
-                if(myJob.status == JobStatus.RUNNING || myJob.status == JobStatus.PENDING){
-                    setLogContent(prev => [...(prev ? prev : []), ...lines])
-                    nextPosition = new_position;
-                }else{
-                    setLogContent(prev => [...(prev ? prev : []), ...lines])
-                    nextPosition = new_position;
+                setEarliestPosition(start_position > 0 ? start_position : null);
+                setLogContent(prev => [...(prev ? prev : []), ...lines])
+                nextPosition = new_position;
+                if (myJob.status != JobStatus.RUNNING && myJob.status != JobStatus.PENDING) {
                     setLoading(false)
-                    clearInterval(interval)
+                    return;
                 }
-
-            }catch (error){
+                // Follow the remaining output as it is written instead of polling.
+                source = streamJobLogs(id, nextPosition, {
+                    onLines: (newLines, position) => {
+                        setLogContent(prev => [...(prev ? prev : []), ...newLines])
+                        nextPosition = position;
+                    },
+                    onStatus: (status) => setJob(prev => prev ? {...prev, status: Number(status)} : prev),
+                    onEnd: async () => {
+                        setLoading(false)
+                        // Refresh the job details to pick up its finish time.
+                        const {job: finishedJob} = await fetchLogContent(id, nextPosition);
+                        if (!cancelled) setJob(finishedJob);
+                    },
+                    onError: () => setLoading(false)
+                });
+            } catch (error) {
                 console.error(error)
-                clearInterval(interval)
             }
         }
 
-        // Initial fetch
         if (jobId) {
-            void pollLogs();
-            interval = setInterval(pollLogs, 5000);
+            void openStream(jobId);
         }
 
         return () => {
-            if (interval) clearInterval(interval);
+            cancelled = true;
+            source?.close();
         };
     }, [jobId]);
 
+    const loadEarlier = async () => {
+        if (!jobId || earliestPosition === null) return;
+        const {lines, start_position} = await fetchLogContent(jobId, 0, {tail: TAIL_LINES, before: earliestPosition});
+        setEarliestPosition(start_position > 0 ? start_position : null);
+        setLogContent(prev => [...lines, ...(prev ? prev : [])])
+    }
+
     return(
         <>
             {(open && !!job) && (
@@ -66,6 +90,7 @@ export default function JobLogs({open, jobId, onClose}: {open: boolean, jobId?:
                         onOpenChange={(open) => {
                             if(!open) {
                                 setLoading(true)
+                                setEarliestPosition(null)
                                 setLogContent(null)
                                 onClose();
                             }}}
@@ -94,6 +119,11 @@ export default function JobLogs({open, jobId, onClose}: {open: boolean, jobId?:
 
                             {logContent && (
                                 <div className="p-4 bg-black/50 border rounded" style={{maxHeight: "50vh", overflowY: "auto"}}>
+                                    {earliestPosition !== null && (
+                                        <Button variant={"ghost"} size={"sm"} className={"hover:cursor-pointer"} onClick={loadEarlier}>
+                                            Load earlier lines
+                                        </Button>
+                                    )}
                                     {logContent.map((item, i) => (
                                         <pre key={i}>{item}</pre>
                                     ))}
@@ -2,7 +2,7 @@
 
 import {ColumnDef} from "@tanstack/react-table";
 import {useEffect, useMemo, useState} from "react";
-import {cancelJob, deleteJob, getScriptJobs} from "@/apis";
+import {cancelJob, deleteJob, getScriptJobs, streamJobEvents} from "@/apis";
 import {Jobs} from "@/interfaces"
 import {JobStatus} from "@/app/scripts/[script]/enums";
 import {Ban, Delete, Logs} from "lucide-react";
@@ -43,23 +43,25 @@ export default function JobsTable({scriptId}: {scriptId: string}) {
 
 
     useEffect(() => {
-        let interval: NodeJS.Timeout;
-
         async function fetchData(){
             const jobs = await getScriptJobs(scriptId, pagination.pageIndex, pagination.pageSize);
             setData(jobs.history)
             setTotal(jobs.total)
         }
 
-        // Initial fetch
-        if (scriptId) {
-            void fetchData();
-            interval = setInterval(fetchData, 5000);
-        }
+        if (!scriptId) return;
+        void fetchData();
+
+        // Rows are patched in place from job events; the page is only refetched when jobs are added or removed.
+        const source = streamJobEvents(scriptId, (event) => {
+            if (event.action === "created" || event.action === "deleted") {
+                void fetchData();
+                return;
+            }
+            setData(prevState => prevState.map(job => job.id === event.data.id ? {...job, ...event.data} : job))
+        }, () => void fetchData());
 
-        return () => {
-            if (interval) clearInterval(interval);
-        };
+        return () => source.close();
     }, [pagination]);
 
     const columns: ColumnDef<Jobs>[] = useMemo(() => [
@@ -6,7 +6,7 @@ import {
     BreadcrumbSeparator
 } from "@/components/ui/breadcrumb";
 import {Button} from "@/components/ui/button";
-import {Calendar, Edit, Play} from "lucide-react";
+import {Calendar, Download, Edit, Play} from "lucide-react";
 import {useState} from "react";
 import {
     Dialog,
@@ -16,7 +16,7 @@ import {
     DialogHeader,
     DialogTitle
 } from "@/components/ui/dialog";
-import {runScript} from "@/apis";
+import {getScriptLogsExportUrl, runScript} from "@/apis";
 import {toast} from "sonner";
 import {useRouter} from "next/navigation";
 
@@ -51,6 +51,11 @@ export default function PageHeader({scriptId, onRefresh}: {scriptId: string, onR
                     </BreadcrumbList>
                 </Breadcrumb>
                 <div className={"flex justify-between items-center gap-2"}>
+                    <Button size={"sm"} className={"hover:cursor-pointer"} asChild>
+                        <a href={getScriptLogsExportUrl(scriptId)} download>
+                            <Download /> Export Logs
+                        </a>
+                    </Button>
                     <Button size={"sm"} className={"hover:cursor-pointer"} onClick={() => {
                         router.push(`/scripts/${scriptId}/schedule`);
                     }}>
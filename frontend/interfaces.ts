@@ -3,6 +3,7 @@ export interface Image {
     name: string;
     description: string;
     status: number;
+    version: number | null;
 }
 
 export interface Scheduled {
@@ -15,10 +16,26 @@ export interface Scheduled {
     running: boolean;
 }
 
-export interface ImageLog {
-    image: number;
+export interface LogPage {
     lines: string[];
+    start_position: number;
     new_position: number;
+    size: number;
+    total_lines: number;
+    has_more: boolean;
+    line?: number;
+}
+
+export interface LogPageOptions {
+    tail?: number;
+    before?: number;
+    maxLines?: number;
+    maxBytes?: number;
+    line?: number;
+}
+
+export interface ImageLog extends LogPage {
+    image: number;
     status: number;
 }
 
@@ -49,13 +66,25 @@ export interface Jobs {
     message_id: string;
 }
 
-export interface JobLog {
+export interface JobLog extends LogPage {
     job: Jobs;
-    lines: string[];
-    new_position: number;
     job_status: number;
 }
 
+export interface LogStreamHandlers {
+    onLines: (lines: string[], position: number) => void;
+    onStatus?: (status: number | string) => void;
+    onEnd?: (status: number | string) => void;
+    onError?: (event: Event) => void;
+}
+
+export interface JobEvent {
+    topic: string;
+    action: "created" | "running" | "finished" | "killed" | "deleted";
+    data: Jobs;
+    timestamp: number;
+}
+
 export interface JobResponse {
     history: Jobs[], page: number, limit: number, total: number
 }